@@ -0,0 +1,74 @@
+"""Atlas acquisition from a local stand-in server, and parsing of the atlas files."""
+import os.path as op
+import shutil
+import tempfile
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+
+from benchmarks.fixtures import VARIANTS, write_atlas_files
+from wheres_waldo.atlas import centroid_url, fetch_file, labels_url, load_labels
+from wheres_waldo.tests.utils import AtlasServer
+
+
+class AtlasAcquisition:
+    params = VARIANTS
+    param_names = ["variant"]
+    timeout = 600
+
+    def setup_cache(self):
+        return write_atlas_files()
+
+    def setup(self, directory, variant):
+        self.server = AtlasServer(directory).start()
+        self.cache_dir = tempfile.mkdtemp(prefix="waldo_cache_")
+
+    def teardown(self, directory, variant):
+        self.server.stop()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def time_fetch_centroids(self, directory, variant):
+        fetch_file(centroid_url(*variant), tempfile.mkdtemp(dir=self.cache_dir))
+
+    def time_fetch_labels(self, directory, variant):
+        fetch_file(labels_url(*variant), tempfile.mkdtemp(dir=self.cache_dir))
+
+
+class AtlasParsing:
+    params = VARIANTS
+    param_names = ["variant"]
+    timeout = 600
+
+    def setup_cache(self):
+        return write_atlas_files()
+
+    def setup(self, directory, variant):
+        self.csv_path = op.join(
+            directory, "Centroid_coordinates", op.basename(centroid_url(*variant))
+        )
+        self.labels_path = op.join(directory, op.basename(labels_url(*variant)))
+        self.cache_dir = tempfile.mkdtemp(prefix="waldo_cache_")
+        shutil.copy(self.labels_path, self.cache_dir)
+        # Revalidate the copy against the local server once, so that the timed calls use
+        # the cache without contacting any server
+        with AtlasServer(directory):
+            load_labels(*variant, cache_dir=self.cache_dir)
+
+    def teardown(self, directory, variant):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def time_read_centroids(self, directory, variant):
+        pd.read_csv(self.csv_path)
+
+    def time_load_labels_gz(self, directory, variant):
+        np.asarray(nib.load(self.labels_path).dataobj).max()
+
+    def time_load_labels_sidecar(self, directory, variant):
+        np.asarray(load_labels(*variant, cache_dir=self.cache_dir).dataobj).max()
+
+    def peakmem_read_centroids(self, directory, variant):
+        pd.read_csv(self.csv_path)
+
+    def peakmem_load_labels_sidecar(self, directory, variant):
+        np.asarray(load_labels(*variant, cache_dir=self.cache_dir).dataobj).max()
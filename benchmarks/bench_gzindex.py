@@ -0,0 +1,37 @@
+"""Random access into gzipped 4D NIfTI runs, with and without a seek-point index."""
+import os.path as op
+
+import nibabel as nib
+import numpy as np
+
+from wheres_waldo.gzindex import build_index, load_indexed
+
+# A 1000-volume run of small volumes, about 220 MB uncompressed
+SHAPE = (40, 40, 34, 1000)
+
+
+class GzipIndexSuite:
+    timeout = 600
+
+    def setup_cache(self):
+        # Benchmark runners call setup_cache from a scratch working directory
+        path = op.abspath("run.nii.gz")
+        rng = np.random.default_rng(0)
+        # Smooth signal plus noise, so that the run compresses like real data
+        base = rng.normal(1000, 50, size=SHAPE[:3]).astype(np.float32)
+        data = base[..., None] + rng.normal(0, 10, size=SHAPE).astype(np.float32)
+        nib.save(nib.Nifti1Image(data.round(), np.eye(4)), path)
+        build_index(path)
+        return path
+
+    def time_last_volume_without_index(self, path):
+        np.asarray(nib.load(path).dataobj[..., -1])
+
+    def time_last_volume_with_index(self, path):
+        np.asarray(load_indexed(path, build=False).dataobj[..., -1])
+
+    def time_slab_with_index(self, path):
+        np.asarray(load_indexed(path, build=False).dataobj[:, :, 10:20, 500:510])
+
+    def time_build_index(self, path):
+        build_index(path, force=True)
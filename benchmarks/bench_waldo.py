@@ -0,0 +1,94 @@
+"""ROI resolution, coordinate transform and output writing of ``wheres_waldo()``."""
+import os
+import os.path as op
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fixtures import ROI_COUNTS, VARIANTS, write_atlas_files
+from wheres_waldo.atlas import load_centroids
+from wheres_waldo.tests.utils import AtlasServer
+from wheres_waldo.utils import get_MNI_152
+from wheres_waldo.wheres_waldo import wheres_waldo
+
+
+class WheresWaldo:
+    params = [VARIANTS, ROI_COUNTS]
+    param_names = ["variant", "n_rois"]
+    timeout = 3600
+
+    def setup_cache(self):
+        return write_atlas_files()
+
+    def setup(self, directory, variant, n_rois):
+        self.server = AtlasServer(directory).start()
+        self.tmp_dir = tempfile.mkdtemp(prefix="waldo_")
+        self.cache = os.environ.get("WALDO_CACHE_DIR")
+        os.environ["WALDO_CACHE_DIR"] = op.join(self.tmp_dir, "cache")
+        load_centroids(*variant)
+        self.rois = np.random.default_rng(0).integers(0, variant[0], n_rois).tolist()
+        self.output = op.join(self.tmp_dir, "output.csv")
+
+    def teardown(self, directory, variant, n_rois):
+        self.server.stop()
+        if self.cache is None:
+            os.environ.pop("WALDO_CACHE_DIR", None)
+        else:
+            os.environ["WALDO_CACHE_DIR"] = self.cache
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def time_wheres_waldo(self, directory, variant, n_rois):
+        wheres_waldo(self.rois, self.output, n_networks=variant[1], n_parcels=variant[0])
+
+    def peakmem_wheres_waldo(self, directory, variant, n_rois):
+        wheres_waldo(self.rois, self.output, n_networks=variant[1], n_parcels=variant[0])
+
+
+class CoordinateTransform:
+    params = ROI_COUNTS
+    param_names = ["n_coords"]
+
+    def setup(self, n_coords):
+        rng = np.random.default_rng(0)
+        self.coords = np.column_stack([rng.uniform(-90, 90, (n_coords, 3)), np.ones(n_coords)])
+        self.rows = self.coords.tolist()
+
+    def time_get_MNI_152_per_coordinate(self, n_coords):
+        for row in self.rows:
+            get_MNI_152(row)
+
+    def time_get_MNI_152_batch(self, n_coords):
+        get_MNI_152(self.coords)
+
+    def peakmem_get_MNI_152_batch(self, n_coords):
+        get_MNI_152(self.coords)
+
+
+class OutputWriting:
+    params = ROI_COUNTS
+    param_names = ["n_rois"]
+
+    def setup(self, n_rois):
+        rng = np.random.default_rng(0)
+        coords = rng.integers(-90, 90, (n_rois, 4)).tolist()
+        self.output_df = pd.DataFrame(
+            {
+                "values": [f"LH_Default_{i % 1000}" for i in range(n_rois)],
+                "roi_label": [f"7Networks_LH_Default_{i % 1000}" for i in range(n_rois)],
+                "FS_coords": coords,
+                "MNI_152_coords": [get_MNI_152(c) for c in coords[:1]] * n_rois,
+                "location_detail": [None] * n_rois,
+            }
+        )
+        self.tmp_dir = tempfile.mkdtemp(prefix="waldo_")
+
+    def teardown(self, n_rois):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def time_to_csv(self, n_rois):
+        self.output_df.to_csv(op.join(self.tmp_dir, "output.csv"), index=False)
+
+    def peakmem_to_csv(self, n_rois):
+        self.output_df.to_csv(op.join(self.tmp_dir, "output.csv"), index=False)
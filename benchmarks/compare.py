@@ -0,0 +1,191 @@
+"""Compare benchmark results against a stored baseline and fail on regressions.
+
+Only the hot paths listed in :data:`STAGES` are gated. Without a results file, the gated
+benchmarks are run first::
+
+    python -m benchmarks.compare benchmarks/baseline.json --tolerance 0.25
+    python -m benchmarks.compare benchmarks/baseline.json --update-baseline
+"""
+import argparse
+import json
+import os.path as op
+import platform
+import re
+import sys
+
+from benchmarks import run as runner
+
+# Gated hot paths: stage name to the regex selecting its benchmarks
+STAGES = {
+    "atlas load": r"^bench_atlas\.AtlasParsing\.\w+\(\(100, 7\)\)$",
+    "ROI lookup loop": r"^bench_waldo\.WheresWaldo\.\w+\(\(100, 7\), 1000\)$",
+    "coordinate transform": r"^bench_waldo\.CoordinateTransform\.\w+\(10000\)$",
+    "CSV write": r"^bench_waldo\.OutputWriting\.\w+\(10000\)$",
+}
+GATE = "|".join(f"(?:{pattern})" for pattern in STAGES.values())
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare")
+    parser.add_argument("baseline", help="Baseline results (JSON).", type=str)
+    parser.add_argument(
+        "current",
+        help="Results to check (JSON). If omitted, the gated benchmarks are run.",
+        type=str,
+        nargs="?",
+        default=None,
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        help="Allowed relative slowdown of timings, e.g. 0.25 for +25%%.",
+        type=float,
+        default=0.25,
+        dest="tolerance",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory-tolerance",
+        help="Allowed relative increase of peak memory.",
+        type=float,
+        default=0.10,
+        dest="memory_tolerance",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        help="Write the current results to the baseline file instead of comparing.",
+        action="store_true",
+        dest="update_baseline",
+    )
+    return parser
+
+
+def _stage(benchmark_id):
+    for stage, pattern in STAGES.items():
+        if re.search(pattern, benchmark_id):
+            return stage
+    return None
+
+
+def compare(baseline, current, tolerance=0.25, memory_tolerance=0.10):
+    """
+    Compare gated benchmark results.
+
+    Timings are compared by their minimum over repeats, the least noisy statistic, and
+    peak memory by its single sample.
+
+    Parameters
+    ----------
+    baseline, current : dict
+        Benchmark id to result, as stored by :mod:`benchmarks.run`.
+    tolerance : float, optional
+        Allowed relative slowdown of timings. Default is 0.25.
+    memory_tolerance : float, optional
+        Allowed relative increase of peak memory. Default is 0.10.
+
+    Returns
+    -------
+    rows : list of dict
+        One row per gated benchmark found in both results, with its stage, baseline and
+        current values, relative change and whether it regressed.
+    """
+    rows = []
+    for benchmark_id in sorted(baseline, key=lambda key: (str(_stage(key)), key)):
+        stage = _stage(benchmark_id)
+        if stage is None or benchmark_id not in current:
+            continue
+        unit = baseline[benchmark_id]["unit"]
+        before = baseline[benchmark_id]["min"]
+        after = current[benchmark_id]["min"]
+        delta = (after - before) / before if before else 0.0
+        allowed = memory_tolerance if unit == "bytes" else tolerance
+        rows.append(
+            {
+                "stage": stage,
+                "benchmark": benchmark_id.split(".", 2)[2],
+                "unit": unit,
+                "baseline": before,
+                "current": after,
+                "delta": delta,
+                "regressed": delta > allowed,
+            }
+        )
+    return rows
+
+
+def _format_value(value, unit):
+    if unit == "bytes":
+        return f"{value / 2 ** 20:.2f} MiB"
+    return f"{value * 1e3:.3f} ms"
+
+
+def print_table(rows):
+    """Print a per-stage delta table."""
+    header = ("stage", "benchmark", "baseline", "current", "delta", "")
+    lines = [
+        (
+            row["stage"],
+            row["benchmark"],
+            _format_value(row["baseline"], row["unit"]),
+            _format_value(row["current"], row["unit"]),
+            f"{100 * row['delta']:+.1f}%",
+            "REGRESSION" if row["regressed"] else "",
+        )
+        for row in rows
+    ]
+    widths = [max(len(line[i]) for line in [header] + lines) for i in range(len(header))]
+    for line in [header] + lines:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip())
+
+
+def _main(argv=None):
+    options = _get_parser().parse_args(argv)
+
+    if options.current is None:
+        current = runner.run(GATE)
+    else:
+        with open(options.current) as f:
+            current = json.load(f)["results"]
+
+    if options.update_baseline:
+        with open(options.baseline, "w") as f:
+            json.dump(
+                {
+                    "commit": runner._git_commit(),
+                    "machine": platform.platform(),
+                    "results": current,
+                },
+                f,
+                indent=1,
+            )
+        print(f"Saved baseline to {options.baseline}")
+        return 0
+
+    if not op.isfile(options.baseline):
+        print(f"No baseline found at {options.baseline}.", file=sys.stderr)
+        return 1
+    with open(options.baseline) as f:
+        baseline = json.load(f)["results"]
+
+    rows = compare(baseline, current, options.tolerance, options.memory_tolerance)
+    missing = sorted(set(k for k in baseline if _stage(k)) - set(current))
+    print_table(rows)
+    for benchmark_id in missing:
+        print(f"Missing from current results: {benchmark_id}", file=sys.stderr)
+
+    regressions = [row for row in rows if row["regressed"]]
+    if regressions:
+        print(f"{len(regressions)} hot path benchmark(s) regressed.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,108 @@
+"""Synthetic Schaefer atlas files, served like the CBIG repository by a local server."""
+import os
+import os.path as op
+import tempfile
+
+import nibabel as nib
+import numpy as np
+from scipy.spatial import cKDTree
+
+from wheres_waldo.atlas import N_NETWORKS, N_PARCELS, centroid_url, labels_url
+
+VARIANTS = [(n_parcels, n_networks) for n_parcels in N_PARCELS for n_networks in N_NETWORKS]
+ROI_COUNTS = [10**k for k in range(7)]
+
+# Generated atlas files are deterministic, so they are shared by all suites and runs
+FIXTURE_DIR = os.environ.get(
+    "WALDO_BENCH_FIXTURES", op.join(tempfile.gettempdir(), "waldo_bench_atlas")
+)
+
+# FSLMNI152 1mm grid
+MNI_SHAPE = (182, 218, 182)
+MNI_AFFINE = np.array([[-1.0, 0, 0, 90], [0, 1.0, 0, -126], [0, 0, 1.0, -72], [0, 0, 0, 1]])
+# fmt: off
+NETWORKS = {
+    7: ["Vis", "SomMot", "DorsAttn", "SalVentAttn", "Limbic", "Cont", "Default"],
+    17: [
+        "VisCent", "VisPeri", "SomMotA", "SomMotB", "DorsAttnA", "DorsAttnB", "SalVentAttnA",
+        "SalVentAttnB", "LimbicA", "LimbicB", "ContA", "ContB", "ContC", "DefaultA",
+        "DefaultB", "DefaultC", "TempPar",
+    ],
+}
+# fmt: on
+
+
+def make_atlas(n_parcels, n_networks, seed=0):
+    """
+    Create a synthetic Schaefer variant: Voronoi parcels of an ellipsoidal brain.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        int32 label volume on the FSLMNI152 1mm grid.
+    table : str
+        Centroid table in the CBIG CSV format.
+    """
+    rng = np.random.default_rng(seed + n_parcels + n_networks)
+    ijk = np.indices(MNI_SHAPE).reshape(3, -1).T
+    center = np.array(MNI_SHAPE) / 2
+    in_brain = (((ijk - center) / (center * 0.85)) ** 2).sum(axis=1) <= 1
+
+    # Parcel seeds: first half in the left hemisphere (x < 0), second half in the right
+    seeds = ijk[in_brain][rng.choice(in_brain.sum(), n_parcels, replace=False)]
+    xyz = nib.affines.apply_affine(MNI_AFFINE, seeds)
+    left = np.argsort(xyz[:, 0] >= 0, kind="stable")
+    seeds = seeds[left]
+
+    labels = np.zeros(ijk.shape[0], dtype=np.int32)
+    _, nearest = cKDTree(seeds).query(ijk[in_brain])
+    labels[in_brain] = nearest + 1
+    labels = labels.reshape(MNI_SHAPE)
+
+    counts = np.bincount(labels.ravel(), minlength=n_parcels + 1)[1:]
+    centroids = np.stack(
+        [
+            np.bincount(labels.ravel(), weights=ijk[:, d], minlength=n_parcels + 1)[1:]
+            for d in range(3)
+        ],
+        axis=1,
+    )
+    centroids /= np.maximum(counts, 1)[:, None]
+    centroids = nib.affines.apply_affine(MNI_AFFINE, centroids).round().astype(int)
+
+    rows = ["ROI Label,ROI Name,R,A,S"]
+    networks = NETWORKS[n_networks]
+    for label in range(1, n_parcels + 1):
+        hemi = "LH" if label <= n_parcels // 2 else "RH"
+        network = networks[(label - 1) * len(networks) // (n_parcels // 2) % len(networks)]
+        r, a, s = centroids[label - 1]
+        rows.append(f"{label},{n_networks}Networks_{hemi}_{network}_{label},{r},{a},{s}")
+    return labels, "\n".join(rows) + "\n"
+
+
+def write_atlas_files(directory=FIXTURE_DIR, variants=VARIANTS):
+    """
+    Write synthetic atlas files with the directory layout of the CBIG repository.
+
+    Files that already exist are kept.
+
+    Returns
+    -------
+    directory : str
+    """
+    for n_parcels, n_networks in variants:
+        csv_path = op.join(
+            directory, "Centroid_coordinates", op.basename(centroid_url(n_parcels, n_networks))
+        )
+        labels_path = op.join(directory, op.basename(labels_url(n_parcels, n_networks)))
+        if op.isfile(csv_path) and op.isfile(labels_path):
+            continue
+
+        labels, table = make_atlas(n_parcels, n_networks)
+        os.makedirs(op.dirname(csv_path), exist_ok=True)
+        nib.save(nib.Nifti1Image(labels, MNI_AFFINE), f"{labels_path}.tmp.nii.gz")
+        os.replace(f"{labels_path}.tmp.nii.gz", labels_path)
+        with open(f"{csv_path}.tmp", "w") as f:
+            f.write(table)
+        os.replace(f"{csv_path}.tmp", csv_path)
+    return directory
@@ -0,0 +1,232 @@
+"""Run the benchmark suites and store their results as JSON.
+
+The suites follow the airspeed velocity (asv) conventions: classes with optional ``params``,
+``param_names``, ``setup_cache``, ``setup`` and ``teardown``, and ``time_*`` (wall time,
+in seconds) and ``peakmem_*`` (peak traced memory, in bytes) benchmarks. They can be run
+with asv, or with this runner, which needs no extra dependency::
+
+    python -m benchmarks.run -b "WheresWaldo.*\\(100, 7\\)" -o results.json
+"""
+import argparse
+import datetime
+import gc
+import glob
+import importlib
+import inspect
+import itertools
+import json
+import math
+import os
+import os.path as op
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_DIR = op.dirname(op.abspath(__file__))
+PREFIXES = {"time_": "seconds", "peakmem_": "bytes"}
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument(
+        "-b",
+        "--bench",
+        help="Only run benchmarks whose id (module.Class.method(params)) matches this regex.",
+        type=str,
+        default=None,
+        dest="bench",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Output JSON file. Defaults to benchmarks/results/<commit>.json.",
+        type=str,
+        default=None,
+        dest="output",
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Maximum number of timed runs per benchmark.",
+        type=int,
+        default=5,
+        dest="repeat",
+    )
+    parser.add_argument(
+        "--max-time",
+        help="Stop repeating a benchmark once its runs exceeded this many seconds.",
+        type=float,
+        default=10.0,
+        dest="max_time",
+    )
+    return parser
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _param_combinations(suite):
+    """Return the parameter tuples of a suite, following asv's conventions."""
+    params = getattr(suite, "params", None)
+    if params is None:
+        return [()]
+    param_names = getattr(suite, "param_names", ["param"])
+    if len(param_names) == 1:
+        return [(param,) for param in params]
+    return list(itertools.product(*params))
+
+
+def _benchmark_id(module, suite, method, params):
+    name = f"{module}.{suite.__name__}.{method}"
+    return f"{name}({', '.join(map(repr, params))})" if params else name
+
+
+def _measure(func, args, unit, repeat, max_time, sample_time=0.05):
+    """
+    Run a benchmark and return its samples.
+
+    Like asv, fast benchmarks are called several times per timing sample, so that each
+    sample lasts at least ``sample_time`` seconds and timer noise is averaged out.
+    """
+    if unit == "bytes":
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            return [tracemalloc.get_traced_memory()[1]]
+        finally:
+            tracemalloc.stop()
+
+    start = time.perf_counter()
+    func(*args)
+    first = time.perf_counter() - start
+    number = max(1, int(math.ceil(sample_time / max(first, 1e-9))))
+
+    samples = []
+    while len(samples) < repeat and sum(samples) * number < max_time:
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        samples.append((time.perf_counter() - start) / number)
+    return samples or [first]
+
+
+def discover():
+    """Yield the (module name, suite class) pairs of the benchmark modules."""
+    for path in sorted(glob.glob(op.join(BENCHMARK_DIR, "bench_*.py"))):
+        name = op.splitext(op.basename(path))[0]
+        module = importlib.import_module(f"benchmarks.{name}")
+        for _, suite in inspect.getmembers(module, inspect.isclass):
+            if suite.__module__ == module.__name__:
+                yield name, suite
+
+
+def run(bench=None, repeat=5, max_time=10.0):
+    """
+    Run the benchmarks.
+
+    Parameters
+    ----------
+    bench : str or None, optional
+        Regular expression selecting benchmarks by id.
+    repeat : int, optional
+        Maximum number of timed runs per benchmark.
+    max_time : float, optional
+        Stop repeating a benchmark once its runs exceeded this many seconds.
+
+    Returns
+    -------
+    results : dict
+        Benchmark id to unit, samples, minimum and median.
+    """
+    pattern = re.compile(bench) if bench else None
+    results = {}
+    cwd = os.getcwd()
+    for module, suite_cls in discover():
+        methods = [
+            (method, unit)
+            for method, _ in inspect.getmembers(suite_cls, inspect.isfunction)
+            for prefix, unit in PREFIXES.items()
+            if method.startswith(prefix)
+        ]
+        todo = [
+            (method, unit, params)
+            for params in _param_combinations(suite_cls)
+            for method, unit in methods
+            if pattern is None or pattern.search(_benchmark_id(module, suite_cls, method, params))
+        ]
+        if not todo:
+            continue
+
+        with tempfile.TemporaryDirectory(prefix="waldo_bench_") as scratch:
+            os.chdir(scratch)
+            try:
+                suite = suite_cls()
+                cache = (suite.setup_cache(),) if hasattr(suite, "setup_cache") else ()
+                for method, unit, params in todo:
+                    benchmark_id = _benchmark_id(module, suite_cls, method, params)
+                    args = cache + tuple(params)
+                    if hasattr(suite, "setup"):
+                        suite.setup(*args)
+                    try:
+                        samples = _measure(getattr(suite, method), args, unit, repeat, max_time)
+                    finally:
+                        if hasattr(suite, "teardown"):
+                            suite.teardown(*args)
+                    samples_sorted = sorted(samples)
+                    results[benchmark_id] = {
+                        "unit": unit,
+                        "samples": samples,
+                        "min": samples_sorted[0],
+                        "median": samples_sorted[len(samples) // 2],
+                    }
+                    print(
+                        f"{benchmark_id}: {results[benchmark_id]['median']:.6g} {unit}", flush=True
+                    )
+            finally:
+                os.chdir(cwd)
+    return results
+
+
+def _main(argv=None):
+    options = _get_parser().parse_args(argv)
+    commit = _git_commit()
+    output = options.output or op.join(BENCHMARK_DIR, "results", f"{commit}.json")
+
+    results = run(options.bench, options.repeat, options.max_time)
+
+    os.makedirs(op.dirname(op.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                "results": results,
+            },
+            f,
+            indent=1,
+        )
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
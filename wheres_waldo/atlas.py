@@ -0,0 +1,475 @@
+"""Acquisition and caching of the Schaefer 2018 atlas files."""
+import glob
+import gzip
+import hashlib
+import http.client
+import json
+import logging
+import os
+import os.path as op
+import shutil
+import time
+from email.utils import formatdate
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+from wheres_waldo.downloads import (
+    atomic_write,
+    download,
+    download_ranges,
+    file_checksum,
+)
+from wheres_waldo.locking import FileLock
+
+N_PARCELS = (100, 200, 300, 400, 500, 600, 700, 800, 900, 1000)
+N_NETWORKS = (7, 17)
+
+# Seconds during which a cached file is used without asking the server whether it changed
+CACHE_TTL = 24 * 60 * 60
+
+GH_URL = (
+    "https://raw.githubusercontent.com/ThomasYeoLab/CBIG/master/stable_projects/"
+    "brain_parcellation/Schaefer2018_LocalGlobal/Parcellations/MNI"
+)
+
+LGR = logging.getLogger(__name__)
+
+
+def get_cache_dir(cache_dir=None):
+    """
+    Return the directory used to store downloaded atlas files, creating it if needed.
+
+    Parameters
+    ----------
+    cache_dir : str or None, optional
+        Explicit cache directory. If None, the ``WALDO_CACHE_DIR`` environment variable is
+        used, falling back to ``~/.cache/wheres_waldo``.
+
+    Returns
+    -------
+    cache_dir : str
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(
+            "WALDO_CACHE_DIR", op.join(op.expanduser("~"), ".cache", "wheres_waldo")
+        )
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_atlas_url():
+    """
+    Return the base URL of the Schaefer MNI parcellation files.
+
+    The ``WALDO_ATLAS_URL`` environment variable overrides the CBIG GitHub repository, e.g.
+    to use a mirror or a local server.
+    """
+    return os.environ.get("WALDO_ATLAS_URL", GH_URL).rstrip("/")
+
+
+def variant_name(n_parcels, n_networks):
+    """Return the file name stem shared by all files of a Schaefer variant."""
+    return f"Schaefer2018_{n_parcels}Parcels_{n_networks}Networks_order"
+
+
+def centroid_url(n_parcels=100, n_networks=7):
+    """Return the URL of the FSLMNI152 1mm centroid table of a Schaefer variant."""
+    name = f"{variant_name(n_parcels, n_networks)}_FSLMNI152_1mm.Centroid_RAS.csv"
+    return f"{get_atlas_url()}/Centroid_coordinates/{name}"
+
+
+def labels_url(n_parcels=100, n_networks=7, resolution=1):
+    """Return the URL of the volumetric FSLMNI152 label image of a Schaefer variant."""
+    name = f"{variant_name(n_parcels, n_networks)}_FSLMNI152_{resolution}mm.nii.gz"
+    return f"{get_atlas_url()}/{name}"
+
+
+def get_cache_ttl(ttl=None):
+    """
+    Return the time during which cached files are used without revalidation.
+
+    Parameters
+    ----------
+    ttl : float or None, optional
+        Explicit time, in seconds. If None, the ``WALDO_CACHE_TTL`` environment variable is
+        used, falling back to :data:`CACHE_TTL` (one day). ``inf`` disables revalidation,
+        and 0 revalidates on every use.
+    """
+    if ttl is None:
+        ttl = os.environ.get("WALDO_CACHE_TTL", CACHE_TTL)
+    return float(ttl)
+
+
+def _metadata_path(path):
+    """Return the path of the HTTP metadata of a cached file."""
+    directory, name = op.split(path)
+    return op.join(directory, "metadata", f"{name}.json")
+
+
+def _read_metadata(path):
+    try:
+        with open(_metadata_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_metadata(path, metadata):
+    meta_path = _metadata_path(path)
+    os.makedirs(op.dirname(meta_path), exist_ok=True)
+    with atomic_write(meta_path, "w") as f:
+        json.dump(metadata, f)
+
+
+def fetch_file(url, cache_dir=None, session=None, ttl=None, sha256=None):
+    """
+    Download ``url`` into the cache directory, or revalidate the cached copy.
+
+    The download is written to a temporary file and renamed into place, so an interrupted
+    download never leaves a partial file in the cache. The ``ETag`` and ``Last-Modified``
+    headers of the response are stored with the file. Once the cached copy is older than
+    ``ttl``, a conditional request checks whether the file changed upstream: it is only
+    downloaded again if it did. If the server cannot be reached, the cached copy is used
+    and the server is not contacted again before ``ttl`` has elapsed.
+
+    Downloads are safe on filesystems shared by many processes or nodes: a lock file in
+    ``<cache_dir>/locks`` ensures that a single process downloads a given file, while the
+    others wait and then read the completed file. Large files are downloaded as byte ranges
+    fetched in parallel, and an interrupted download is resumed by the next call (see
+    :func:`wheres_waldo.downloads.download_ranges`).
+
+    Parameters
+    ----------
+    url : str
+        URL of the file to fetch.
+    cache_dir : str or None, optional
+        Cache directory. See :func:`get_cache_dir`.
+    session : wheres_waldo.downloads.Session or None, optional
+        Connection pool to download with. Defaults to the shared session.
+    ttl : float or None, optional
+        Time after which cached files are revalidated, in seconds. See
+        :func:`get_cache_ttl`.
+    sha256 : str or None, optional
+        Expected SHA-256 checksum of the file, verified when it is downloaded.
+
+    Returns
+    -------
+    path : str
+        Local path of the cached file.
+    """
+    cache_dir = get_cache_dir(cache_dir)
+    path = op.join(cache_dir, op.basename(url))
+    ttl = get_cache_ttl(ttl)
+    if _is_fresh(path, ttl):
+        return path
+
+    # Only one process downloads or revalidates a file; the others wait for it to finish
+    os.makedirs(op.join(cache_dir, "locks"), exist_ok=True)
+    with FileLock(op.join(cache_dir, "locks", f"{op.basename(url)}.lock")):
+        if _is_fresh(path, ttl):
+            return path
+        _download_or_revalidate(url, path, session, sha256)
+    return path
+
+
+def cached_checksum(path):
+    """Return the SHA-256 checksum of a cached file, as stored with its HTTP metadata."""
+    return _read_metadata(path).get("sha256") or file_checksum(path)
+
+
+def source_digest(*paths):
+    """
+    Return a short digest of the checksums of cached files, to key entries derived from them.
+
+    Entries keyed by the digest of their sources are not reused once a source is updated on
+    the server (see :func:`fetch_file`).
+    """
+    digest = hashlib.sha1("".join(cached_checksum(path) for path in paths).encode())
+    return digest.hexdigest()[:12]
+
+
+def remove_stale(path):
+    """Remove the entries derived from older sources than ``<stem>_<digest><ext>``."""
+    stem, ext = op.splitext(path)
+    pattern = f"{glob.escape(stem.rsplit('_', 1)[0])}_*{ext}"
+    for stale in glob.glob(pattern):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                # Already removed by a concurrent process
+                pass
+
+
+def _is_fresh(path, ttl):
+    """Whether ``path`` is cached and was checked against the server less than ``ttl`` ago."""
+    return op.isfile(path) and time.time() - _read_metadata(path).get("checked", 0) < ttl
+
+
+def _download_or_revalidate(url, path, session, sha256=None):
+    metadata = {}
+    if op.isfile(path):
+        metadata = _read_metadata(path)
+        # Files cached without metadata are revalidated against their modification time
+        headers = {
+            "If-Modified-Since": metadata.get("last_modified")
+            or formatdate(op.getmtime(path), usegmt=True)
+        }
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        try:
+            response = download(url, path, session=session, headers=headers, sha256=sha256)
+        except (OSError, http.client.HTTPException) as exc:
+            LGR.warning("Could not revalidate %s, using the cached copy: %s", path, exc)
+            # The failed attempt is still recorded, so that the server is retried once per
+            # TTL rather than on every use (e.g. on compute nodes without network access)
+            response = None
+        else:
+            if response.status == 304:
+                LGR.debug("%s is up to date", path)
+            else:
+                LGR.info("Updated %s", path)
+                metadata.pop("sha256", None)
+    else:
+        response = download_ranges(url, path, session=session, sha256=sha256)
+
+    etag, last_modified = metadata.get("etag"), metadata.get("last_modified")
+    if response is not None:
+        etag = response.getheader("ETag", etag)
+        last_modified = response.getheader("Last-Modified", last_modified)
+    _write_metadata(
+        path,
+        {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "sha256": metadata.get("sha256") or file_checksum(path),
+            "checked": time.time(),
+        },
+    )
+
+
+def load_centroids(n_parcels=100, n_networks=7, cache_dir=None):
+    """
+    Load the centroid table of a Schaefer variant.
+
+    Returns
+    -------
+    centroids : pandas.DataFrame
+        Table with ``ROI Label``, ``ROI Name``, ``R``, ``A`` and ``S`` columns.
+    """
+    return pd.read_csv(fetch_file(centroid_url(n_parcels, n_networks), cache_dir))
+
+
+def decompressed_sidecar(path, cache_dir=None):
+    """
+    Return an uncompressed copy of a gzipped file, kept up to date in the cache directory.
+
+    The sidecar is named after a hash of the absolute path of its source, so that files
+    with the same name in different directories get sidecars of their own. It records the
+    SHA-256 checksum, size and modification time of its source.
+    It is reused as long as the source has the same size and modification time, or failing
+    that the same checksum, and rebuilt otherwise.
+
+    Parameters
+    ----------
+    path : str
+        Gzipped file, e.g. a ``.nii.gz`` image.
+    cache_dir : str or None, optional
+        Cache directory. See :func:`get_cache_dir`.
+
+    Returns
+    -------
+    sidecar : str
+        Path of the decompressed file.
+    """
+    directory = op.join(get_cache_dir(cache_dir), "decompressed")
+    os.makedirs(directory, exist_ok=True)
+    path = op.abspath(path)
+    key = hashlib.sha1(path.encode()).hexdigest()[:12]
+    sidecar = op.join(directory, f"{key}_{op.basename(path)[: -len('.gz')]}")
+    meta_path = f"{sidecar}.json"
+    stat = os.stat(path)
+
+    meta = None
+    if op.isfile(sidecar) and op.isfile(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+            return sidecar
+
+    checksum = file_checksum(path)
+    if meta is None or meta["sha256"] != checksum:
+        with gzip.open(path, "rb") as src, atomic_write(sidecar) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+
+    with atomic_write(meta_path, "w") as f:
+        json.dump({"sha256": checksum, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, f)
+    return sidecar
+
+
+def load_labels(n_parcels=100, n_networks=7, resolution=1, cache_dir=None, decompress=True):
+    """
+    Load the volumetric label image of a Schaefer variant.
+
+    Parameters
+    ----------
+    n_parcels : int, optional
+        Number of Schaefer parcels. Default is 100.
+    n_networks : int, optional
+        Number of Yeo networks. Default is 7.
+    resolution : {1, 2}, optional
+        Resolution of the label image, in mm. Default is 1.
+    cache_dir : str or None, optional
+        Cache directory. See :func:`get_cache_dir`.
+    decompress : bool, optional
+        Load the labels from an uncompressed sidecar of the ``.nii.gz`` file, which nibabel
+        memory-maps instead of decompressing the whole stream. See
+        :func:`decompressed_sidecar`. Default is True.
+
+    Returns
+    -------
+    labels_img : nibabel.Nifti1Image
+        Image where each voxel holds the ``ROI Label`` of its parcel, 0 being background.
+    """
+    path = fetch_file(labels_url(n_parcels, n_networks, resolution), cache_dir)
+    if decompress:
+        path = decompressed_sidecar(path, cache_dir)
+    return nib.load(path, mmap=True)
+
+
+def resample_labels(labels, labels_affine, target_shape, target_affine):
+    """
+    Resample a label volume to a target grid with nearest-neighbour interpolation.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        3D label volume.
+    labels_affine : (4, 4) array_like
+        Voxel-to-world affine of ``labels``.
+    target_shape : tuple of int
+        Spatial shape of the target grid.
+    target_affine : (4, 4) array_like
+        Voxel-to-world affine of the target grid.
+
+    Returns
+    -------
+    resampled : numpy.ndarray
+        Label volume of shape ``target_shape``, 0 outside of the source field of view.
+    """
+    target_shape = tuple(target_shape[:3])
+    if target_shape == labels.shape and np.allclose(labels_affine, target_affine):
+        return np.asarray(labels)
+
+    # Map target voxels to source voxels: inv(A_src) @ A_target
+    vox2vox = np.linalg.solve(np.asarray(labels_affine), np.asarray(target_affine))
+    return ndimage.affine_transform(
+        np.asarray(labels),
+        vox2vox[:3, :3],
+        offset=vox2vox[:3, 3],
+        output_shape=target_shape,
+        order=0,
+        mode="constant",
+        cval=0,
+    )
+
+
+def _touch(path):
+    """Mark a cache entry as recently used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _evict(directory, max_entries):
+    """Remove the least recently used ``.npy`` entries of ``directory`` beyond ``max_entries``."""
+    entries = [entry for entry in os.scandir(directory) if entry.name.endswith(".npy")]
+    if len(entries) <= max_entries:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[max_entries:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            # Already evicted by a concurrent process
+            pass
+
+
+def load_labels_on_grid(
+    target_shape,
+    target_affine,
+    n_parcels=100,
+    n_networks=7,
+    resolution=1,
+    cache_dir=None,
+    max_entries=None,
+):
+    """
+    Load the labels of a Schaefer variant resampled to a target grid, using an on-disk cache.
+
+    Resampled volumes are stored uncompressed as ``.npy`` files keyed by the atlas variant,
+    the target shape, a hash of the target affine and the checksum of the label image, and
+    memory-mapped on later calls, so that repeated runs on the same acquisition grid skip
+    resampling entirely until the atlas is updated.
+
+    Parameters
+    ----------
+    target_shape : tuple of int
+        Spatial shape of the target grid.
+    target_affine : (4, 4) array_like
+        Voxel-to-world affine of the target grid.
+    n_parcels : int, optional
+        Number of Schaefer parcels. Default is 100.
+    n_networks : int, optional
+        Number of Yeo networks. Default is 7.
+    resolution : {1, 2}, optional
+        Resolution (in mm) of the source label image. Default is 1.
+    cache_dir : str or None, optional
+        Cache directory. See :func:`get_cache_dir`.
+    max_entries : int or None, optional
+        Number of resampled volumes kept in the cache, least recently used ones being evicted
+        first. If None, the ``WALDO_RESAMPLE_CACHE_SIZE`` environment variable is used,
+        falling back to 32.
+
+    Returns
+    -------
+    labels : numpy.memmap
+        Read-only int16 label volume of shape ``target_shape``.
+    """
+    if max_entries is None:
+        max_entries = int(os.environ.get("WALDO_RESAMPLE_CACHE_SIZE", 32))
+    target_shape = tuple(int(dim) for dim in target_shape[:3])
+    # Round the affine so that float noise from different writers maps to the same entry
+    target_affine = np.round(np.asarray(target_affine, dtype=np.float64), 6) + 0.0
+    affine_hash = hashlib.sha1(target_affine.tobytes()).hexdigest()[:16]
+
+    directory = op.join(get_cache_dir(cache_dir), "resampled")
+    os.makedirs(directory, exist_ok=True)
+    source = fetch_file(labels_url(n_parcels, n_networks, resolution), cache_dir)
+    path = op.join(
+        directory,
+        f"{variant_name(n_parcels, n_networks)}_{resolution}mm_"
+        f"{'x'.join(map(str, target_shape))}_{affine_hash}_{source_digest(source)}.npy",
+    )
+
+    if not op.isfile(path):
+        labels_img = load_labels(n_parcels, n_networks, resolution, cache_dir)
+        resampled = resample_labels(
+            np.asarray(labels_img.dataobj, dtype=np.int16),
+            labels_img.affine,
+            target_shape,
+            target_affine,
+        )
+        with atomic_write(path) as f:
+            np.save(f, resampled.astype(np.int16, copy=False))
+        remove_stale(path)
+        _evict(directory, max_entries)
+    else:
+        _touch(path)
+
+    return np.load(path, mmap_mode="r")
@@ -0,0 +1,353 @@
+"""Cluster tables of thresholded statistical maps, annotated with Schaefer parcels."""
+import argparse
+import logging
+from functools import lru_cache
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy import ndimage
+
+from wheres_waldo import __version__
+from wheres_waldo.atlas import (
+    N_NETWORKS,
+    N_PARCELS,
+    cached_checksum,
+    fetch_file,
+    labels_url,
+    load_labels_on_grid,
+)
+from wheres_waldo.gzindex import indexed_image
+from wheres_waldo.logs import add_logging_arguments, setup_logging
+from wheres_waldo.registry import get_parcellation
+
+LGR = logging.getLogger(__name__)
+
+# Voxel connectivity (6, 18 or 26 neighbours) to scipy.ndimage structuring element rank
+CONNECTIVITY = {6: 1, 18: 2, 26: 3}
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="waldo clusters")
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group("Required Arguments:")
+
+    # Required arguments
+    required.add_argument(
+        "-i",
+        "--input",
+        help="Statistical map(s) to analyze.",
+        required=True,
+        type=str,
+        nargs="+",
+        dest="stat_imgs",
+    )
+    required.add_argument(
+        "-t",
+        "--threshold",
+        help="Statistical threshold defining the clusters.",
+        required=True,
+        type=float,
+        dest="threshold",
+    )
+    required.add_argument(
+        "-o",
+        "--output",
+        help="Output file name.",
+        required=True,
+        type=str,
+        dest="output",
+    )
+    # Optional arguments
+    optional.add_argument(
+        "-n",
+        "--networks",
+        help="Number of networks to use.",
+        required=False,
+        type=int,
+        default=7,
+        dest="n_networks",
+        choices=N_NETWORKS,
+    )
+    optional.add_argument(
+        "-p",
+        "--parcels",
+        help="Number of parcels to use.",
+        required=False,
+        type=int,
+        default=100,
+        dest="n_parcels",
+        choices=N_PARCELS,
+    )
+    optional.add_argument(
+        "--two-sided",
+        help="Also report clusters below -threshold.",
+        action="store_true",
+        dest="two_sided",
+    )
+    optional.add_argument(
+        "--min-size",
+        help="Minimum cluster size in voxels.",
+        required=False,
+        type=int,
+        default=1,
+        dest="min_size",
+    )
+    optional.add_argument(
+        "--connectivity",
+        help="Voxel connectivity used to define clusters.",
+        required=False,
+        type=int,
+        default=26,
+        dest="connectivity",
+        choices=sorted(CONNECTIVITY),
+    )
+    optional.add_argument(
+        "--volume",
+        help="Volume of 4D maps to analyze (0-based). Gzipped maps with a seek-point "
+        "index (see wheres_waldo.gzindex) are read without inflating the other volumes.",
+        required=False,
+        type=int,
+        default=None,
+        dest="volume",
+    )
+    optional.add_argument(
+        "-j",
+        "--n-jobs",
+        help="Number of maps processed in parallel.",
+        required=False,
+        type=int,
+        default=1,
+        dest="n_jobs",
+    )
+    add_logging_arguments(optional)
+    optional.add_argument("-v", "--version", action="version", version=("%(prog)s " + __version__))
+
+    parser._action_groups.append(optional)
+
+    return parser
+
+
+def _parcel_names(parcellation):
+    """Return the parcel names of a parcellation, ``names[label]`` being the name of a parcel."""
+    names = np.full(parcellation.labels.max() + 1, "Background", dtype=object)
+    names[parcellation.labels] = parcellation.short_names
+    return names
+
+
+@lru_cache(maxsize=8)
+def _atlas_on_grid(n_parcels, n_networks, shape, affine, checksum):
+    """
+    Return the atlas labels on a (hashable) target grid once per process and atlas version.
+
+    ``checksum`` is that of the cached label file, so that the labels are resampled again
+    once the file is updated.
+    """
+    return load_labels_on_grid(shape, affine, n_parcels, n_networks)
+
+
+def _read_map(img, volume=None):
+    """Read a 3D map, or one volume of a 4D map, as float32."""
+    if volume is not None and len(img.shape) == 4:
+        data = img.dataobj[..., volume]
+    else:
+        data = img.dataobj
+    data = np.asarray(data, dtype=np.float32)
+    if data.ndim == 4 and data.shape[3] == 1:
+        data = data[..., 0]
+    if data.ndim != 3:
+        raise ValueError(f"Statistical map must be 3D, got shape {data.shape}.")
+    return data
+
+
+def cluster_table(
+    stat_img,
+    threshold,
+    n_parcels=100,
+    n_networks=7,
+    two_sided=False,
+    min_size=1,
+    connectivity=26,
+    volume=None,
+):
+    """
+    Find the clusters of a thresholded statistical map and the parcels they overlap.
+
+    Parameters
+    ----------
+    stat_img : str or nibabel.Nifti1Image
+        3D statistical map, or 4D maps of which ``volume`` is analyzed. Gzipped files are
+        read through their seek-point index if they have one (see
+        :func:`wheres_waldo.gzindex.load_indexed`).
+    threshold : float
+        Voxels above ``threshold`` (and below ``-threshold`` if ``two_sided``) form clusters.
+    n_parcels : int, optional
+        Number of Schaefer parcels. Default is 100.
+    n_networks : int, optional
+        Number of Yeo networks. Default is 7.
+    two_sided : bool, optional
+        Also report negative clusters. Default is False.
+    min_size : int, optional
+        Clusters with fewer voxels are discarded. Default is 1.
+    connectivity : {6, 18, 26}, optional
+        Voxel connectivity used to define clusters. Default is 26.
+    volume : int or None, optional
+        Volume of a 4D map to analyze, 0-based. Default is None, for 3D maps.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        One row per cluster, sorted by decreasing size, with its peak value, peak MNI
+        coordinates, the parcel at the peak and the parcels it overlaps (with the
+        percentage of the cluster falling in each of them).
+
+    Notes
+    -----
+    Cluster/parcel overlaps are counted in a single ``np.bincount`` over the joint
+    ``cluster * (n_parcels + 1) + parcel`` index of all supra-threshold voxels.
+    """
+    if isinstance(stat_img, nib.spatialimages.SpatialImage):
+        data, affine = _read_map(stat_img, volume), stat_img.affine
+    else:
+        # Indices are not built here, to leave the directories of the maps untouched
+        with indexed_image(stat_img, build=False) as img:
+            data, affine = _read_map(img, volume), img.affine
+
+    names = _parcel_names(get_parcellation(n_parcels, n_networks))
+    checksum = cached_checksum(fetch_file(labels_url(n_parcels, n_networks)))
+    labels = _atlas_on_grid(n_parcels, n_networks, data.shape, tuple(map(tuple, affine)), checksum)
+
+    # Label positive and negative clusters separately so that they never merge
+    structure = ndimage.generate_binary_structure(3, CONNECTIVITY[connectivity])
+    clusters, n_clusters = ndimage.label(data > threshold, structure=structure)
+    signs = np.ones(n_clusters, dtype=np.int8)
+    if two_sided:
+        neg_clusters, n_neg = ndimage.label(data < -threshold, structure=structure)
+        clusters[neg_clusters > 0] = neg_clusters[neg_clusters > 0] + n_clusters
+        signs = np.concatenate([signs, -np.ones(n_neg, dtype=np.int8)])
+        n_clusters += n_neg
+
+    in_cluster = clusters > 0
+    cluster_ids = clusters[in_cluster]
+    n_labels = n_parcels + 1
+    overlap = np.bincount(
+        cluster_ids.astype(np.int64) * n_labels + labels[in_cluster],
+        minlength=(n_clusters + 1) * n_labels,
+    ).reshape(n_clusters + 1, n_labels)[1:]
+    sizes = overlap.sum(axis=1)
+
+    keep = np.flatnonzero(sizes >= min_size)
+    keep = keep[np.argsort(-sizes[keep], kind="stable")]
+
+    # Peak of each cluster, in absolute value so that negative clusters peak at their minimum
+    peaks = np.array(
+        ndimage.maximum_position(np.abs(data), clusters, index=keep + 1), dtype=float
+    ).reshape(-1, 3)
+    peak_vox = peaks.astype(int)
+    peak_mni = nib.affines.apply_affine(affine, peaks)
+    voxel_volume = abs(np.linalg.det(affine[:3, :3]))
+
+    table = pd.DataFrame(
+        {
+            "cluster": np.arange(1, keep.size + 1),
+            "sign": signs[keep],
+            "n_voxels": sizes[keep],
+            "volume_mm3": sizes[keep] * voxel_volume,
+            "peak_value": data[tuple(peak_vox.T)],
+            "peak_x": peak_mni[:, 0],
+            "peak_y": peak_mni[:, 1],
+            "peak_z": peak_mni[:, 2],
+            "peak_roi": names[labels[tuple(peak_vox.T)]],
+            "rois": [_format_overlap(overlap[c], names) for c in keep],
+        }
+    )
+    return table
+
+
+def _empty_table():
+    """Return a table with the columns of :func:`cluster_tables` and no clusters."""
+    dtypes = {
+        "map": np.int64,
+        "cluster": np.int64,
+        "sign": np.int8,
+        "n_voxels": np.int64,
+        "volume_mm3": np.float64,
+        "peak_value": np.float32,
+        "peak_x": np.float64,
+        "peak_y": np.float64,
+        "peak_z": np.float64,
+        "peak_roi": str,
+        "rois": str,
+    }
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+
+
+def _format_overlap(counts, names):
+    """Describe the parcels overlapped by a cluster, largest overlap first."""
+    total = counts.sum()
+    parcels = np.flatnonzero(counts[1:]) + 1
+    parcels = parcels[np.argsort(-counts[parcels], kind="stable")]
+    return "; ".join(f"{names[p]} ({100 * counts[p] / total:.1f}%)" for p in parcels)
+
+
+def _cluster_tables_chunk(stat_imgs, threshold, **kwargs):
+    return [cluster_table(stat_img, threshold, **kwargs) for stat_img in stat_imgs]
+
+
+def cluster_tables(stat_imgs, threshold, n_jobs=1, **kwargs):
+    """
+    Compute the cluster tables of many statistical maps in parallel.
+
+    Parameters
+    ----------
+    stat_imgs : list of str or nibabel.Nifti1Image
+        3D statistical maps.
+    threshold : float
+        Cluster-forming threshold.
+    n_jobs : int, optional
+        Number of worker processes. Default is 1.
+    **kwargs
+        Passed to :func:`cluster_table`.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        Concatenated cluster tables, with a ``map`` column holding the index of the input map.
+
+    Notes
+    -----
+    Maps are dispatched to the workers in chunks and the atlas is memoized in each worker
+    process, so that it is loaded (and resampled to each acquisition grid) only once per
+    worker rather than once per map.
+    """
+    stat_imgs = list(stat_imgs)
+    if not stat_imgs:
+        return _empty_table()
+    n_chunks = min(len(stat_imgs), 4 * effective_n_jobs(n_jobs))
+    bounds = np.linspace(0, len(stat_imgs), n_chunks + 1).astype(int)
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_cluster_tables_chunk)(stat_imgs[start:stop], threshold, **kwargs)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    )
+    tables = [table for chunk in results for table in chunk]
+    for i_map, table in enumerate(tables):
+        table.insert(0, "map", i_map)
+    return pd.concat(tables, ignore_index=True)
+
+
+def _main(argv=None):
+    options = vars(_get_parser().parse_args(argv))
+    setup_logging(quiet=options.pop("quiet"), log_json=options.pop("log_json"))
+    output = options.pop("output")
+    LGR.info("Computing cluster tables of %d map(s)...", len(options["stat_imgs"]))
+    table = cluster_tables(**options)
+    LGR.info("Saving results to %s...", output)
+    table.to_csv(output, index=False)
@@ -0,0 +1,304 @@
+"""Annotation and summaries of stacks of parcel connectivity matrices."""
+import argparse
+import contextlib
+import logging
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from wheres_waldo import __version__
+from wheres_waldo.atlas import N_NETWORKS, N_PARCELS
+from wheres_waldo.logs import Progress, add_logging_arguments, setup_logging
+from wheres_waldo.registry import get_parcellation
+from wheres_waldo.tables import TableWriter
+
+LGR = logging.getLogger(__name__)
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="waldo annotate-connectome")
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group("Required Arguments:")
+
+    # Required arguments
+    required.add_argument(
+        "-i",
+        "--input",
+        help=(
+            "Connectivity matrices in Schaefer order, as a .npy stack of shape "
+            "(subjects, parcels, parcels) or a single (parcels, parcels) matrix."
+        ),
+        required=True,
+        type=str,
+        dest="stack",
+    )
+    required.add_argument(
+        "-o",
+        "--output",
+        help=(
+            "Prefix of the output files: <prefix>_parcels, <prefix>_edges, <prefix>_blocks "
+            "and <prefix>_summary."
+        ),
+        required=True,
+        type=str,
+        dest="output_prefix",
+    )
+    # Optional arguments
+    optional.add_argument(
+        "-n",
+        "--networks",
+        help="Number of networks to use.",
+        required=False,
+        type=int,
+        default=7,
+        dest="n_networks",
+        choices=N_NETWORKS,
+    )
+    optional.add_argument(
+        "-k",
+        "--top-k",
+        help="Number of strongest edges reported per subject.",
+        required=False,
+        type=int,
+        default=10,
+        dest="top_k",
+    )
+    optional.add_argument(
+        "--absolute",
+        help="Rank edges by absolute weight.",
+        action="store_true",
+        dest="absolute",
+    )
+    optional.add_argument(
+        "--format",
+        help="Format of the output tables. Parquet requires pyarrow.",
+        required=False,
+        type=str,
+        default="csv",
+        dest="fmt",
+        choices=("csv", "parquet"),
+    )
+    optional.add_argument(
+        "--chunk-size",
+        help="Number of subjects processed at once.",
+        required=False,
+        type=int,
+        default=16,
+        dest="chunk_size",
+    )
+    add_logging_arguments(optional)
+    optional.add_argument("-v", "--version", action="version", version=("%(prog)s " + __version__))
+
+    parser._action_groups.append(optional)
+
+    return parser
+
+
+def load_stack(path):
+    """
+    Memory-map a ``.npy`` stack of connectivity matrices.
+
+    Returns
+    -------
+    stack : (n_subjects, n_parcels, n_parcels) numpy.memmap
+    """
+    stack = np.load(path, mmap_mode="r")
+    if stack.ndim == 2:
+        stack = stack[None]
+    if stack.ndim != 3 or stack.shape[1] != stack.shape[2]:
+        raise ValueError(f"{path} is not a stack of square matrices: {stack.shape}.")
+    if stack.shape[1] not in N_PARCELS:
+        raise ValueError(f"{path} has {stack.shape[1]} parcels, not a Schaefer variant.")
+    return stack
+
+
+@lru_cache(maxsize=None)
+def upper_triangle(n_parcels):
+    """Return the (read-only) row and column indices of the edges of a variant."""
+    rows, cols = np.triu_indices(n_parcels, 1)
+    rows.setflags(write=False)
+    cols.setflags(write=False)
+    return rows, cols
+
+
+def parcel_table(parcellation):
+    """Return the ROI labels, networks and coordinates of the parcels of a variant."""
+    return pd.DataFrame(
+        {
+            "roi": np.arange(parcellation.n_parcels),
+            "label": parcellation.labels,
+            "roi_label": parcellation.names,
+            "values": parcellation.short_names,
+            "network": parcellation.networks,
+            "hemisphere": parcellation.hemispheres,
+            "R": parcellation.coords[:, 0],
+            "A": parcellation.coords[:, 1],
+            "S": parcellation.coords[:, 2],
+        }
+    )
+
+
+def top_edges(matrices, k, absolute=False):
+    """
+    Find the ``k`` strongest edges of each matrix.
+
+    Parameters
+    ----------
+    matrices : (n, n_parcels, n_parcels) array_like
+    k : int
+    absolute : bool, optional
+        Rank edges by absolute weight. Default is False.
+
+    Returns
+    -------
+    edges : (n, k) numpy.ndarray of int
+        Indices of the edges in :func:`upper_triangle`, strongest first.
+    weights : (n, k) numpy.ndarray
+    """
+    rows, cols = upper_triangle(matrices.shape[1])
+    weights = np.asarray(matrices)[:, rows, cols]
+    keys = np.abs(weights) if absolute else weights
+    k = min(k, keys.shape[1])
+    edges = np.argpartition(-keys, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(keys, edges, axis=1), axis=1, kind="stable")
+    edges = np.take_along_axis(edges, order, axis=1)
+    return edges, np.take_along_axis(weights, edges, axis=1)
+
+
+def block_sums(matrices, codes, n_networks):
+    """
+    Sum the off-diagonal weights of each pair of networks.
+
+    Parameters
+    ----------
+    matrices : (n, n_parcels, n_parcels) array_like
+    codes : (n_parcels,) array_like of int
+        Network of each parcel, between 0 and ``n_networks - 1``.
+    n_networks : int
+
+    Returns
+    -------
+    sums : (n, n_networks, n_networks) numpy.ndarray
+    counts : (n_networks, n_networks) numpy.ndarray
+        Number of edges of each block.
+    """
+    matrices = np.asarray(matrices, dtype=np.float64)
+    onehot = np.zeros((len(codes), n_networks))
+    onehot[np.arange(len(codes)), codes] = 1
+    sums = onehot.T @ matrices @ onehot
+    diagonal = np.diagonal(matrices, axis1=1, axis2=2) @ onehot
+    sums[:, np.arange(n_networks), np.arange(n_networks)] -= diagonal
+
+    sizes = onehot.sum(axis=0)
+    counts = np.outer(sizes, sizes) - np.diag(sizes)
+    return sums, counts
+
+
+def annotate_connectome(
+    stack, parcellation, output_prefix, top_k=10, absolute=False, fmt="csv", chunk_size=16
+):
+    """
+    Annotate a stack of connectivity matrices with the parcels of a Schaefer variant.
+
+    Subjects are processed by chunks, and each table is written as chunks are processed,
+    so that the stack is never loaded as a whole:
+
+    - ``<prefix>_parcels``: ROI labels, networks and coordinates of the parcels.
+    - ``<prefix>_edges``: ``top_k`` strongest edges of each subject, with the labels and
+      networks of their ends.
+    - ``<prefix>_blocks``: mean weight of each pair of networks, for each subject.
+    - ``<prefix>_summary``: mean within- and between-network weights, for each subject.
+
+    Parameters
+    ----------
+    stack : (n_subjects, n_parcels, n_parcels) array_like
+        E.g. a memory-mapped stack (see :func:`load_stack`).
+    parcellation : wheres_waldo.parcellation.Parcellation
+    output_prefix : str
+    top_k : int, optional
+        Default is 10.
+    absolute : bool, optional
+        Rank edges by absolute weight. Default is False.
+    fmt : {"csv", "parquet"}, optional
+        Default is "csv".
+    chunk_size : int, optional
+        Number of subjects processed at once. Default is 16.
+    """
+    if stack.shape[1] != parcellation.n_parcels:
+        raise ValueError(
+            f"The matrices have {stack.shape[1]} parcels, but the parcellation has "
+            f"{parcellation.n_parcels}."
+        )
+    networks, codes = np.unique(parcellation.networks, return_inverse=True)
+    n_networks = len(networks)
+    rows, cols = upper_triangle(parcellation.n_parcels)
+    upper = np.triu_indices(n_networks)
+    within = np.eye(n_networks, dtype=bool)
+
+    with TableWriter(f"{output_prefix}_parcels.{fmt}") as writer:
+        writer.write(parcel_table(parcellation))
+
+    n_subjects = len(stack)
+    with contextlib.ExitStack() as context:
+        writers = {
+            table: context.enter_context(TableWriter(f"{output_prefix}_{table}.{fmt}"))
+            for table in ("edges", "blocks", "summary")
+        }
+        progress = context.enter_context(Progress(n_subjects, "Subjects", LGR))
+        for start in range(0, n_subjects, chunk_size):
+            chunk = np.asarray(stack[start : start + chunk_size])
+            subjects = np.arange(start, start + len(chunk))
+
+            edges, weights = top_edges(chunk, top_k, absolute)
+            source, target = rows[edges].ravel(), cols[edges].ravel()
+            writers["edges"].write(
+                pd.DataFrame(
+                    {
+                        "subject": np.repeat(subjects, edges.shape[1]),
+                        "rank": np.tile(np.arange(edges.shape[1]), len(chunk)),
+                        "source": source,
+                        "target": target,
+                        "source_label": parcellation.short_names[source],
+                        "target_label": parcellation.short_names[target],
+                        "source_network": parcellation.networks[source],
+                        "target_network": parcellation.networks[target],
+                        "weight": weights.ravel(),
+                    }
+                )
+            )
+
+            sums, counts = block_sums(chunk, codes, n_networks)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means = sums / counts
+                within_mean = sums[:, within].sum(axis=1) / counts[within].sum()
+                between_mean = sums[:, ~within].sum(axis=1) / counts[~within].sum()
+            writers["blocks"].write(
+                pd.DataFrame(
+                    {
+                        "subject": np.repeat(subjects, len(upper[0])),
+                        "network_a": np.tile(networks[upper[0]], len(chunk)),
+                        "network_b": np.tile(networks[upper[1]], len(chunk)),
+                        "mean": means[:, upper[0], upper[1]].ravel(),
+                    }
+                )
+            )
+            writers["summary"].write(
+                pd.DataFrame({"subject": subjects, "within": within_mean, "between": between_mean})
+            )
+            progress.update(len(chunk))
+
+
+def _main(argv=None):
+    options = vars(_get_parser().parse_args(argv))
+    setup_logging(quiet=options.pop("quiet"), log_json=options.pop("log_json"))
+    stack = load_stack(options.pop("stack"))
+    parcellation = get_parcellation(stack.shape[1], options.pop("n_networks"))
+    annotate_connectome(stack, parcellation, **options)
@@ -0,0 +1,314 @@
+"""Correspondence between the 7- and 17-network versions of Schaefer parcellations."""
+import argparse
+import logging
+import os
+import os.path as op
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from wheres_waldo import __version__
+from wheres_waldo.atlas import (
+    N_NETWORKS,
+    N_PARCELS,
+    fetch_file,
+    get_cache_dir,
+    labels_url,
+    load_labels,
+    load_labels_on_grid,
+    remove_stale,
+    source_digest,
+)
+from wheres_waldo.downloads import atomic_write
+from wheres_waldo.fetch import RESOLUTIONS
+from wheres_waldo.logs import add_logging_arguments, setup_logging
+from wheres_waldo.registry import get_parcellation
+
+LGR = logging.getLogger(__name__)
+
+# Number of slices of the label volumes counted at once
+SLAB_SIZE = 16
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="waldo translate")
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group("Required Arguments:")
+
+    # Required arguments
+    inputs = required.add_mutually_exclusive_group(required=True)
+    inputs.add_argument(
+        "-r",
+        "--rois",
+        help="ROIs to translate, as rows of the centroid table.",
+        type=int,
+        nargs="+",
+        dest="rois",
+    )
+    inputs.add_argument(
+        "-i",
+        "--input",
+        help=(
+            "CSV file of parcel maps to translate, with one row per parcel and one column "
+            "per map."
+        ),
+        type=str,
+        dest="maps",
+    )
+    required.add_argument(
+        "-o",
+        "--output",
+        help="Output file name.",
+        required=True,
+        type=str,
+        dest="output",
+    )
+    # Optional arguments
+    optional.add_argument(
+        "-p",
+        "--parcels",
+        help="Number of parcels to use.",
+        required=False,
+        type=int,
+        default=100,
+        dest="n_parcels",
+        choices=N_PARCELS,
+    )
+    optional.add_argument(
+        "--from",
+        help="Number of networks of the input.",
+        required=False,
+        type=int,
+        default=7,
+        dest="source_networks",
+        choices=N_NETWORKS,
+    )
+    optional.add_argument(
+        "--to",
+        help="Number of networks of the output.",
+        required=False,
+        type=int,
+        default=17,
+        dest="target_networks",
+        choices=N_NETWORKS,
+    )
+    optional.add_argument(
+        "--resolution",
+        help="Resolution (in mm) of the label images whose voxels are counted.",
+        required=False,
+        type=int,
+        default=1,
+        dest="resolution",
+        choices=RESOLUTIONS,
+    )
+    optional.add_argument(
+        "--min-overlap",
+        help="Proportion of a parcel that must be covered by the ROIs for it to be reported.",
+        required=False,
+        type=float,
+        default=0.5,
+        dest="min_overlap",
+    )
+    add_logging_arguments(optional)
+    optional.add_argument("-v", "--version", action="version", version=("%(prog)s " + __version__))
+
+    parser._action_groups.append(optional)
+
+    return parser
+
+
+def count_overlap(source, target, n_source, n_target):
+    """
+    Count the voxels shared by each pair of parcels of two label volumes.
+
+    Volumes are read by slabs, and the label pairs of each slab are counted with a single
+    ``bincount`` on joint indices.
+
+    Parameters
+    ----------
+    source, target : array_like of int
+        Label volumes on the same grid, e.g. memory-mapped. 0 is background.
+    n_source, n_target : int
+        Number of parcels of each volume.
+
+    Returns
+    -------
+    overlap : (n_source, n_target) scipy.sparse.csr_matrix of int64
+        Number of voxels of each pair, indexed by rows of the centroid tables (i.e.
+        ``ROI Label - 1``).
+    """
+    counts = np.zeros((n_source + 1) * (n_target + 1), dtype=np.int64)
+    for start in range(0, source.shape[0], SLAB_SIZE):
+        source_slab = np.asarray(source[start : start + SLAB_SIZE], dtype=np.int64)
+        target_slab = np.asarray(target[start : start + SLAB_SIZE], dtype=np.int64)
+        counts += np.bincount(
+            (source_slab * (n_target + 1) + target_slab).ravel(), minlength=counts.size
+        )
+    counts = counts.reshape(n_source + 1, n_target + 1)[1:, 1:]
+    return sparse.csr_matrix(counts)
+
+
+def network_overlap(
+    n_parcels=100, source_networks=7, target_networks=17, resolution=1, cache_dir=None
+):
+    """
+    Return the voxel overlap between the parcels of two network versions, using a cache.
+
+    Overlaps are computed from the label images of both versions (see
+    :func:`count_overlap`) and stored in the cache as sparse ``.npz`` files, once per
+    number of parcels and resolution and until either label image is updated: the other
+    direction is the transpose.
+
+    Parameters
+    ----------
+    n_parcels : int, optional
+        Number of Schaefer parcels. Default is 100.
+    source_networks, target_networks : int, optional
+        Number of Yeo networks of the source and target versions. Defaults are 7 and 17.
+    resolution : {1, 2}, optional
+        Resolution of the label images, in mm. Default is 1.
+    cache_dir : str or None, optional
+        Cache directory. See :func:`wheres_waldo.atlas.get_cache_dir`.
+
+    Returns
+    -------
+    overlap : (n_parcels, n_parcels) scipy.sparse.csr_matrix of int64
+        Number of voxels shared by each source (rows) and target (columns) parcel.
+    """
+    if source_networks == target_networks:
+        return sparse.identity(n_parcels, dtype=np.int64, format="csr")
+    if (source_networks, target_networks) != (7, 17):
+        return network_overlap(n_parcels, 7, 17, resolution, cache_dir).T.tocsr()
+
+    directory = op.join(get_cache_dir(cache_dir), "correspondence")
+    os.makedirs(directory, exist_ok=True)
+    sources = [fetch_file(labels_url(n_parcels, n, resolution), cache_dir) for n in (7, 17)]
+    path = op.join(
+        directory,
+        f"Schaefer2018_{n_parcels}Parcels_7to17Networks_{resolution}mm_"
+        f"{source_digest(*sources)}.npz",
+    )
+    if op.isfile(path):
+        return sparse.load_npz(path).tocsr()
+
+    LGR.info("Counting the overlap of the 7- and 17-network parcels (%d parcels)...", n_parcels)
+    source_img = load_labels(n_parcels, 7, resolution, cache_dir)
+    target_img = load_labels(n_parcels, 17, resolution, cache_dir)
+    if source_img.shape[:3] == target_img.shape[:3] and np.allclose(
+        source_img.affine, target_img.affine
+    ):
+        target = target_img.dataobj
+    else:
+        target = load_labels_on_grid(
+            source_img.shape[:3], source_img.affine, n_parcels, 17, resolution, cache_dir
+        )
+    overlap = count_overlap(source_img.dataobj, target, n_parcels, n_parcels)
+
+    with atomic_write(path) as f:
+        sparse.save_npz(f, overlap)
+    remove_stale(path)
+    return overlap
+
+
+def translate_values(values, n_parcels=100, source_networks=7, target_networks=17, **kwargs):
+    """
+    Translate parcel-valued maps from one network version to the other.
+
+    Each target parcel takes the mean of the source values over its voxels, i.e. the
+    average of the values of the source parcels it overlaps, weighted by their overlap.
+    All maps are translated in one sparse product.
+
+    Parameters
+    ----------
+    values : (n_parcels,) or (n_parcels, n_maps) array_like
+        Values of the source parcels, in the order of the centroid table.
+    n_parcels, source_networks, target_networks, **kwargs
+        See :func:`network_overlap`.
+
+    Returns
+    -------
+    translated : (n_parcels,) or (n_parcels, n_maps) numpy.ndarray
+        Values of the target parcels, NaN for parcels without any overlap.
+    """
+    overlap = network_overlap(n_parcels, source_networks, target_networks, **kwargs)
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[0] != n_parcels:
+        raise ValueError(f"values have {values.shape[0]} parcels, not {n_parcels}.")
+    sizes = np.asarray(overlap.sum(axis=0)).ravel()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = sparse.diags(1 / sizes) @ overlap.T
+    translated = weights @ values
+    translated[sizes == 0] = np.nan
+    return translated
+
+
+def translate_rois(
+    rois, n_parcels=100, source_networks=7, target_networks=17, min_overlap=0.5, **kwargs
+):
+    """
+    Translate a set of ROIs from one network version to the other.
+
+    Parameters
+    ----------
+    rois : array_like of int
+        Rows of the ROIs in the centroid table of the source version.
+    n_parcels, source_networks, target_networks, **kwargs
+        See :func:`network_overlap`.
+    min_overlap : float, optional
+        Proportion of the voxels of a target parcel that must belong to the ROIs for it to
+        be returned. Default is 0.5.
+
+    Returns
+    -------
+    translated : dict of numpy.ndarray
+        ``roi`` (rows of the target parcels in their centroid table) and ``overlap``
+        (proportion of each target parcel covered by the ROIs), by decreasing overlap.
+    """
+    overlap = network_overlap(n_parcels, source_networks, target_networks, **kwargs)
+    selected = np.zeros(n_parcels)
+    selected[np.asarray(rois, dtype=np.intp)] = 1
+    sizes = np.asarray(overlap.sum(axis=0)).ravel()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covered = (overlap.T @ selected) / sizes
+    covered[sizes == 0] = 0
+    rows = np.flatnonzero(covered >= min_overlap)
+    rows = rows[np.argsort(-covered[rows], kind="stable")]
+    return {"roi": rows, "overlap": covered[rows]}
+
+
+def _main(argv=None):
+    options = vars(_get_parser().parse_args(argv))
+    setup_logging(quiet=options.pop("quiet"), log_json=options.pop("log_json"))
+    variant = {
+        key: options[key]
+        for key in ("n_parcels", "source_networks", "target_networks", "resolution")
+    }
+    target = get_parcellation(options["n_parcels"], options["target_networks"])
+
+    if options["rois"] is not None:
+        translated = translate_rois(options["rois"], min_overlap=options["min_overlap"], **variant)
+        output_df = pd.DataFrame(
+            {
+                "roi": translated["roi"],
+                "values": target.short_names[translated["roi"]],
+                "overlap": translated["overlap"],
+            }
+        )
+    else:
+        maps = pd.read_csv(options["maps"])
+        output_df = pd.DataFrame(
+            translate_values(maps.to_numpy(), **variant),
+            index=pd.Index(target.short_names, name="values"),
+            columns=maps.columns,
+        ).reset_index()
+
+    LGR.info("Saving results to %s...", options["output"])
+    output_df.to_csv(options["output"], index=False)
@@ -0,0 +1,430 @@
+"""HTTP downloads over pooled keep-alive connections."""
+import contextlib
+import hashlib
+import http.client
+import json
+import logging
+import os
+import os.path as op
+import queue
+import tempfile
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+# Size of the byte ranges fetched in parallel by :func:`download_ranges`
+SEGMENT_SIZE = 4 << 20
+
+LGR = logging.getLogger(__name__)
+
+
+class Session:
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections.
+
+    Connections are reused across requests to the same host, and at most
+    ``max_connections`` requests per host are in flight at once.
+
+    Parameters
+    ----------
+    max_connections : int, optional
+        Maximum number of connections per host. Default is 8.
+    timeout : float, optional
+        Socket timeout, in seconds. Default is 60.
+    """
+
+    def __init__(self, max_connections=8, timeout=60):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def _pool(self, key):
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = (
+                    queue.LifoQueue(),
+                    threading.BoundedSemaphore(self.max_connections),
+                )
+            return self._pools[key]
+
+    def _new_connection(self, scheme, netloc):
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        if scheme == "http":
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+        raise ValueError(f"Unsupported URL scheme {scheme!r}.")
+
+    def _send(self, key, method, target, headers):
+        """Send a request, retrying once on a fresh connection if a pooled one went stale."""
+        idle, _ = self._pool(key)
+        try:
+            connection = idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            connection = self._new_connection(*key)
+            reused = False
+
+        try:
+            connection.request(method, target, headers=headers)
+            return connection, connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+            connection.close()
+            if not reused:
+                raise
+        connection = self._new_connection(*key)
+        connection.request(method, target, headers=headers)
+        return connection, connection.getresponse()
+
+    @contextlib.contextmanager
+    def request(self, url, method="GET", headers=None, max_redirects=5):
+        """
+        Send a request, following redirects, and yield its response.
+
+        The response body must be read within the ``with`` block; the connection is then
+        returned to the pool.
+
+        Parameters
+        ----------
+        url : str
+        method : str, optional
+            Default is "GET".
+        headers : dict or None, optional
+            Request headers.
+        max_redirects : int, optional
+            Default is 5.
+
+        Yields
+        ------
+        response : http.client.HTTPResponse
+
+        Raises
+        ------
+        urllib.error.HTTPError
+            If the server answers with a 4xx or 5xx status.
+        """
+        headers = dict(headers or {})
+        headers.setdefault("Connection", "keep-alive")
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.netloc)
+            target = parts.path + (f"?{parts.query}" if parts.query else "")
+            idle, slots = self._pool(key)
+
+            with slots:
+                connection, response = self._send(key, method, target, headers)
+                try:
+                    if response.status in REDIRECTS and response.getheader("Location"):
+                        response.read()
+                        url = urljoin(url, response.getheader("Location"))
+                        continue
+                    if response.status >= 400:
+                        raise urllib.error.HTTPError(
+                            url, response.status, response.reason, response.headers, None
+                        )
+                    yield response
+                    # Drain what the caller did not read, so that the connection can be reused
+                    response.read()
+                except BaseException:
+                    connection.close()
+                    raise
+                finally:
+                    if response.will_close:
+                        connection.close()
+                    elif connection.sock is not None:
+                        idle.put(connection)
+            return
+        raise urllib.error.URLError(f"Too many redirects for {url}.")
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for idle, _ in pools.values():
+            while not idle.empty():
+                idle.get_nowait().close()
+
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """Return the session shared by all downloads of the process."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = Session()
+        return _SESSION
+
+
+def atomic_writer(path, mode="wb"):
+    """
+    Open a temporary file next to ``path``, to be renamed over it once complete.
+
+    Parameters
+    ----------
+    path : str
+    mode : {"wb", "w"}, optional
+        Default is "wb".
+
+    Returns
+    -------
+    f : file object
+        File open for writing; its ``name`` is the temporary path, unique to the caller.
+    """
+    directory, name = op.split(op.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    os.close(fd)
+    return open(tmp_path, mode)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="wb"):
+    """
+    Write a file that appears at ``path`` only once complete.
+
+    The data is written to a temporary file of its own (see :func:`atomic_writer`) and
+    renamed over ``path`` when the ``with`` block exits, so that readers never see a partial
+    file, even when several threads or processes write the same path at once: the last
+    rename wins. The temporary file is removed if the block raises.
+
+    Parameters
+    ----------
+    path : str
+    mode : {"wb", "w"}, optional
+        Default is "wb".
+
+    Yields
+    ------
+    f : file object
+    """
+    with atomic_writer(path, mode) as f:
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """Return the SHA-256 checksum of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _verify(path, sha256):
+    """Remove ``path`` and raise if its checksum is not ``sha256``."""
+    if sha256 is None:
+        return
+    checksum = file_checksum(path)
+    if checksum != sha256:
+        os.remove(path)
+        raise ValueError(f"Checksum mismatch: expected {sha256}, got {checksum}.")
+
+
+def download(url, path, session=None, headers=None, sha256=None, chunk_size=1 << 20):
+    """
+    Download ``url`` to ``path`` atomically.
+
+    The file is written to a temporary file in the same directory and renamed over
+    ``path`` once complete, so that readers never see a partial file. If the server
+    answers a conditional request with 304 (Not Modified), ``path`` is left untouched.
+
+    Parameters
+    ----------
+    url : str
+    path : str
+    session : Session or None, optional
+        Session to use. Defaults to the shared session (see :func:`get_session`).
+    headers : dict or None, optional
+        Request headers, e.g. ``If-None-Match``.
+    sha256 : str or None, optional
+        Expected SHA-256 checksum of the file. If given, the download is discarded when
+        its checksum differs, and a ValueError is raised.
+    chunk_size : int, optional
+        Default is 1 MiB.
+
+    Returns
+    -------
+    response : http.client.HTTPResponse
+        Response of the server, whose body has been consumed.
+    """
+    session = get_session() if session is None else session
+    with session.request(url, headers=headers) as response:
+        if response.status == 304:
+            return response
+        with atomic_writer(path) as f:
+            try:
+                for chunk in iter(lambda: response.read(chunk_size), b""):
+                    f.write(chunk)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        _verify(f.name, sha256)
+        os.replace(f.name, path)
+    return response
+
+
+class _NotPartial(Exception):
+    """A range request was answered with the whole file, which repeating it cannot fix."""
+
+
+def _retryable(exc):
+    """Whether a failed request may succeed if repeated."""
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code >= 500 or exc.code == 429
+    return isinstance(exc, (OSError, http.client.HTTPException))
+
+
+def _fetch_segment(session, url, part, start, end, validator, retries, backoff):
+    """Write bytes ``start:end`` of ``url`` at the same offset of ``part``, with retries."""
+    headers = {"Range": f"bytes={start}-{end - 1}"}
+    if validator:
+        # The server answers with the whole file instead if it changed since the first request
+        headers["If-Range"] = validator
+    for attempt in range(retries + 1):
+        try:
+            with session.request(url, headers=headers) as response, open(part, "r+b") as f:
+                if response.status != 206:
+                    raise _NotPartial(
+                        f"{url} changed during the download or does not support ranges"
+                    )
+                f.seek(start)
+                for chunk in iter(lambda: response.read(1 << 20), b""):
+                    f.write(chunk)
+                if f.tell() != end:
+                    raise http.client.IncompleteRead(b"", end - f.tell())
+            return
+        except (OSError, http.client.HTTPException) as exc:
+            if attempt == retries or not _retryable(exc):
+                raise
+            delay = backoff * 2**attempt
+            LGR.warning(
+                "Retrying bytes %d-%d of %s in %.1f s: %s", start, end - 1, url, delay, exc
+            )
+            time.sleep(delay)
+
+
+def download_ranges(
+    url,
+    path,
+    session=None,
+    sha256=None,
+    segment_size=SEGMENT_SIZE,
+    n_jobs=4,
+    retries=3,
+    backoff=0.5,
+):
+    """
+    Download ``url`` to ``path`` as byte ranges fetched in parallel, resuming if interrupted.
+
+    The file is assembled in ``<path>.part``, and the segments already downloaded are
+    recorded in ``<path>.part.json``: a later call resumes an interrupted download, as long
+    as the file did not change on the server (same size, ``ETag`` or ``Last-Modified``).
+    Each segment is retried with exponential backoff if it fails. Once complete, the file
+    is verified and renamed to ``path``.
+
+    Files smaller than ``segment_size``, from servers that do not support range requests
+    or send no usable validator (a strong ``ETag`` or ``Last-Modified``), and files that
+    change during the download are downloaded in one request with :func:`download`.
+
+    Parameters
+    ----------
+    url : str
+    path : str
+    session : Session or None, optional
+        Session to use. Defaults to the shared session (see :func:`get_session`).
+    sha256 : str or None, optional
+        Expected SHA-256 checksum of the file. If given, the download is discarded when
+        its checksum differs, and a ValueError is raised.
+    segment_size : int, optional
+        Size of the byte ranges, in bytes. Default is 4 MiB.
+    n_jobs : int, optional
+        Number of segments downloaded in parallel. Default is 4.
+    retries : int, optional
+        Number of retries of each segment. Default is 3.
+    backoff : float, optional
+        Delay before the first retry, in seconds, doubled at each retry. Default is 0.5.
+
+    Returns
+    -------
+    response : http.client.HTTPResponse
+        Response of the server to the initial ``HEAD`` request (or to the ``GET``
+        request if the file was downloaded in one request).
+    """
+    session = get_session() if session is None else session
+    with session.request(url, method="HEAD") as response:
+        size = int(response.getheader("Content-Length", -1))
+        etag = response.getheader("ETag")
+        # Weak ETags cannot be used in If-Range (RFC 7233, section 3.2)
+        if etag is None or etag.startswith("W/"):
+            etag = None
+        validator = etag or response.getheader("Last-Modified")
+        ranges = response.getheader("Accept-Ranges", "").lower() == "bytes"
+    # Without a validator, segments of different versions of the file could be mixed
+    if not ranges or validator is None or size <= segment_size:
+        return download(url, path, session=session, sha256=sha256)
+
+    part = f"{path}.part"
+    state_path = f"{part}.json"
+    state = {"url": url, "size": size, "validator": validator, "done": []}
+    try:
+        with open(state_path) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+    if (
+        {key: previous.get(key) for key in ("url", "size", "validator")}
+        == {key: state[key] for key in ("url", "size", "validator")}
+        and op.isfile(part)
+        and op.getsize(part) == size
+    ):
+        state["done"] = previous["done"]
+    else:
+        with open(part, "wb") as f:
+            f.truncate(size)
+
+    done = {tuple(segment) for segment in state["done"]}
+    segments = [
+        (start, min(start + segment_size, size))
+        for start in range(0, size, segment_size)
+        if (start, min(start + segment_size, size)) not in done
+    ]
+    if done:
+        LGR.info("Resuming the download of %s (%d segments left)", url, len(segments))
+
+    lock = threading.Lock()
+
+    def fetch(segment):
+        _fetch_segment(session, url, part, *segment, validator, retries, backoff)
+        with lock:
+            state["done"].append(segment)
+            with atomic_write(state_path, "w") as f:
+                json.dump(state, f)
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            for _ in executor.map(fetch, segments):
+                pass
+    except _NotPartial as exc:
+        LGR.warning("%s, downloading it in one request", exc)
+        for leftover in (part, state_path):
+            if op.isfile(leftover):
+                os.remove(leftover)
+        return download(url, path, session=session, sha256=sha256)
+
+    os.remove(state_path)
+    _verify(part, sha256)
+    os.replace(part, path)
+    return response
@@ -0,0 +1,357 @@
+"""Thresholded, labeled edge lists of stacks of parcel connectivity matrices."""
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from wheres_waldo import __version__
+from wheres_waldo.atlas import N_NETWORKS
+from wheres_waldo.connectome import load_stack, upper_triangle
+from wheres_waldo.geodesic import geodesic_distances
+from wheres_waldo.logs import Progress, add_logging_arguments, setup_logging
+from wheres_waldo.registry import get_parcellation
+from wheres_waldo.surface import HEMISPHERES, MESHES
+from wheres_waldo.tables import TableWriter
+
+LGR = logging.getLogger(__name__)
+
+THRESHOLDS = ("absolute", "proportional", "top-k")
+
+
+def _proportion(value):
+    """Parse a proportion between 0 and 1."""
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise argparse.ArgumentTypeError(f"must be between 0 and 1, not {value}")
+    return value
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="waldo edges")
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group("Required Arguments:")
+
+    # Required arguments
+    required.add_argument(
+        "-i",
+        "--input",
+        help=(
+            "Connectivity matrices in Schaefer order, as a .npy stack of shape "
+            "(subjects, parcels, parcels) or a single (parcels, parcels) matrix."
+        ),
+        required=True,
+        type=str,
+        dest="stack",
+    )
+    required.add_argument(
+        "-o",
+        "--output",
+        help="Output edge list, as a .csv, .csv.gz or .parquet (requires pyarrow) file.",
+        required=True,
+        type=str,
+        dest="output",
+    )
+    threshold = required.add_mutually_exclusive_group(required=True)
+    threshold.add_argument(
+        "--min-weight",
+        help="Keep the edges whose weight is at least this value.",
+        type=float,
+        dest="min_weight",
+    )
+    threshold.add_argument(
+        "--density",
+        help="Keep this proportion (between 0 and 1) of the strongest edges of each subject.",
+        type=_proportion,
+        dest="density",
+    )
+    threshold.add_argument(
+        "--top-k",
+        help="Keep the edges among the k strongest edges of either of their parcels.",
+        type=int,
+        dest="top_k",
+    )
+    # Optional arguments
+    optional.add_argument(
+        "-n",
+        "--networks",
+        help="Number of networks to use.",
+        required=False,
+        type=int,
+        default=7,
+        dest="n_networks",
+        choices=N_NETWORKS,
+    )
+    optional.add_argument(
+        "--absolute",
+        help="Threshold and rank edges by absolute weight.",
+        action="store_true",
+        dest="absolute",
+    )
+    optional.add_argument(
+        "--geodesic",
+        help=(
+            "Surface files (left and right hemispheres) used to report geodesic instead of "
+            "Euclidean distances between parcels."
+        ),
+        required=False,
+        type=str,
+        nargs=2,
+        default=None,
+        dest="geodesic",
+        metavar=("LH_SURFACE", "RH_SURFACE"),
+    )
+    optional.add_argument(
+        "--mesh",
+        help="Mesh of the --geodesic surfaces.",
+        required=False,
+        type=str,
+        default="fsaverage",
+        dest="mesh",
+        choices=MESHES,
+    )
+    optional.add_argument(
+        "--chunk-size",
+        help="Number of subjects processed at once by a job.",
+        required=False,
+        type=int,
+        default=16,
+        dest="chunk_size",
+    )
+    optional.add_argument(
+        "-j",
+        "--n-jobs",
+        help="Number of parallel jobs.",
+        required=False,
+        type=int,
+        default=1,
+        dest="n_jobs",
+    )
+    add_logging_arguments(optional)
+    optional.add_argument("-v", "--version", action="version", version=("%(prog)s " + __version__))
+
+    parser._action_groups.append(optional)
+
+    return parser
+
+
+def edge_distances(parcellation, surfaces=None, mesh="fsaverage", cache_dir=None, n_jobs=1):
+    """
+    Return the distance between the parcels of each edge of a variant.
+
+    Parameters
+    ----------
+    parcellation : wheres_waldo.parcellation.Parcellation
+    surfaces : dict or None, optional
+        Surface of each hemisphere (``lh`` and ``rh``), to use geodesic distances (see
+        :func:`wheres_waldo.geodesic.geodesic_distances`), infinite between hemispheres.
+        By default, Euclidean distances between the centroids are used.
+    mesh, cache_dir, n_jobs
+        See :func:`wheres_waldo.geodesic.geodesic_distances`.
+
+    Returns
+    -------
+    distances : (n_edges,) numpy.ndarray of float32
+        Distances of the edges of :func:`wheres_waldo.connectome.upper_triangle`.
+    """
+    rows, cols = upper_triangle(parcellation.n_parcels)
+    if surfaces is None:
+        coords = parcellation.coords
+        return np.linalg.norm(coords[rows] - coords[cols], axis=1).astype(np.float32)
+    distances = geodesic_distances(
+        surfaces,
+        parcellation.n_parcels,
+        parcellation.n_networks,
+        mesh,
+        cache_dir=cache_dir,
+        n_jobs=n_jobs,
+    )
+    return np.asarray(distances[rows, cols])
+
+
+def threshold_edges(matrices, method, value, absolute=False):
+    """
+    Select the edges of each matrix that pass a threshold.
+
+    Parameters
+    ----------
+    matrices : (n, n_parcels, n_parcels) array_like
+    method : {"absolute", "proportional", "top-k"}
+        Keep the edges whose weight is at least ``value``, the proportion ``value`` of the
+        strongest edges, or the edges among the ``value`` strongest edges of either of
+        their parcels.
+    value : float or int
+    absolute : bool, optional
+        Threshold and rank edges by absolute weight. Default is False.
+
+    Returns
+    -------
+    selected : (n, n_edges) numpy.ndarray of bool
+        Selection of the edges of :func:`wheres_waldo.connectome.upper_triangle`.
+    """
+    if method not in THRESHOLDS:
+        raise ValueError(f"method must be one of {THRESHOLDS}, not {method!r}.")
+    if method == "proportional" and not 0 <= value <= 1:
+        raise ValueError(f"The proportion of edges must be between 0 and 1, not {value}.")
+    matrices = np.asarray(matrices)
+    rows, cols = upper_triangle(matrices.shape[1])
+    if method == "absolute":
+        keys = matrices[:, rows, cols]
+        return (np.abs(keys) if absolute else keys) >= value
+
+    if method == "proportional":
+        keys = matrices[:, rows, cols]
+        keys = np.abs(keys) if absolute else keys
+        n_kept = int(round(value * keys.shape[1]))
+        selected = np.zeros(keys.shape, dtype=bool)
+        if n_kept:
+            strongest = np.argpartition(-keys, n_kept - 1, axis=1)[:, :n_kept]
+            np.put_along_axis(selected, strongest, True, axis=1)
+        return selected
+
+    # Strongest off-diagonal edges of each parcel, made symmetric
+    keys = matrices.astype(np.float64)
+    keys = np.abs(keys, out=keys) if absolute else keys
+    n_parcels = matrices.shape[1]
+    keys[:, np.arange(n_parcels), np.arange(n_parcels)] = -np.inf
+    k = min(int(value), n_parcels - 1)
+    selected = np.zeros(keys.shape, dtype=bool)
+    if k:
+        strongest = np.argpartition(-keys, k - 1, axis=2)[:, :, :k]
+        np.put_along_axis(selected, strongest, True, axis=2)
+    selected |= selected.transpose(0, 2, 1)
+    return selected[:, rows, cols]
+
+
+def _edge_chunk(stack, start, stop, short_names, distances, method, value, absolute):
+    """Return the thresholded edges of a chunk of subjects as a DataFrame."""
+    chunk = np.asarray(stack[start:stop])
+    rows, cols = upper_triangle(chunk.shape[1])
+    subjects, edges = np.nonzero(threshold_edges(chunk, method, value, absolute))
+    source, target = rows[edges], cols[edges]
+    return pd.DataFrame(
+        {
+            "subject": start + subjects,
+            "source": source,
+            "target": target,
+            # Categoricals keep one copy of each label in memory and in Parquet files
+            "source_label": pd.Categorical.from_codes(source, short_names),
+            "target_label": pd.Categorical.from_codes(target, short_names),
+            "weight": chunk[subjects, source, target],
+            "distance": distances[edges],
+        }
+    )
+
+
+def export_edges(
+    stack,
+    parcellation,
+    output,
+    method="proportional",
+    value=0.1,
+    absolute=False,
+    distances=None,
+    chunk_size=16,
+    n_jobs=1,
+):
+    """
+    Write the thresholded edges of a stack of connectivity matrices as a labeled edge list.
+
+    Chunks of subjects are thresholded in parallel jobs, with vectorized operations on the
+    upper triangle of their matrices, and their edges are appended to ``output`` in order
+    as jobs complete, so that neither the stack nor the edge list is ever held in memory.
+
+    Parameters
+    ----------
+    stack : (n_subjects, n_parcels, n_parcels) array_like
+        E.g. a memory-mapped stack (see :func:`wheres_waldo.connectome.load_stack`).
+    parcellation : wheres_waldo.parcellation.Parcellation
+    output : str
+        ``.csv``, ``.csv.gz`` or ``.parquet`` file. See
+        :class:`wheres_waldo.tables.TableWriter`.
+    method : {"absolute", "proportional", "top-k"}, optional
+        See :func:`threshold_edges`. Default is "proportional".
+    value : float or int, optional
+        See :func:`threshold_edges`. Default is 0.1.
+    absolute : bool, optional
+        Threshold and rank edges by absolute weight. Default is False.
+    distances : (n_edges,) array_like or None, optional
+        Distances of the edges, see :func:`edge_distances`. Computed from the centroids if
+        None.
+    chunk_size : int, optional
+        Number of subjects processed at once by a job. Default is 16.
+    n_jobs : int, optional
+        Number of parallel jobs. Default is 1.
+
+    Returns
+    -------
+    n_edges : int
+        Number of edges written.
+    """
+    if stack.shape[1] != parcellation.n_parcels:
+        raise ValueError(
+            f"The matrices have {stack.shape[1]} parcels, but the parcellation has "
+            f"{parcellation.n_parcels}."
+        )
+    if distances is None:
+        distances = edge_distances(parcellation)
+
+    n_subjects = len(stack)
+    starts = range(0, n_subjects, chunk_size)
+    jobs = Parallel(n_jobs=n_jobs, return_as="generator")(
+        delayed(_edge_chunk)(
+            stack,
+            start,
+            min(start + chunk_size, n_subjects),
+            parcellation.short_names,
+            distances,
+            method,
+            value,
+            absolute,
+        )
+        for start in starts
+    )
+    n_edges = 0
+    with TableWriter(output) as writer, Progress(n_subjects, "Subjects", LGR) as progress:
+        for start, edges in zip(starts, jobs):
+            writer.write(edges)
+            n_edges += len(edges)
+            progress.update(min(chunk_size, n_subjects - start))
+    return n_edges
+
+
+def _main(argv=None):
+    options = vars(_get_parser().parse_args(argv))
+    setup_logging(quiet=options.pop("quiet"), log_json=options.pop("log_json"))
+    stack = load_stack(options["stack"])
+    parcellation = get_parcellation(stack.shape[1], options["n_networks"])
+
+    surfaces = options["geodesic"] and dict(zip(HEMISPHERES, options["geodesic"]))
+    distances = edge_distances(parcellation, surfaces, options["mesh"], n_jobs=options["n_jobs"])
+    if options["min_weight"] is not None:
+        method, value = "absolute", options["min_weight"]
+    elif options["density"] is not None:
+        method, value = "proportional", options["density"]
+    else:
+        method, value = "top-k", options["top_k"]
+
+    n_edges = export_edges(
+        stack,
+        parcellation,
+        options["output"],
+        method,
+        value,
+        options["absolute"],
+        distances,
+        options["chunk_size"],
+        options["n_jobs"],
+    )
+    LGR.info("Wrote %d edges to %s.", n_edges, options["output"])
@@ -0,0 +1,76 @@
+"""Enrichment of ROI sets in Yeo networks, with permutation tests."""
+import numpy as np
+import pandas as pd
+
+
+def _count(codes, sets, n_networks):
+    """Count the networks of each set in one ``bincount``, offsetting codes by set."""
+    offsets = n_networks * np.arange(len(sets))[:, None]
+    counts = np.bincount((codes[sets] + offsets).ravel(), minlength=n_networks * len(sets))
+    return counts.reshape(len(sets), n_networks)
+
+
+def network_enrichment(rois, parcellation, n_perm=10000, seed=0, perms=None, chunk_size=10000):
+    """
+    Test whether a set of ROIs is over-represented in each Yeo network.
+
+    Under the null of random sets of as many parcels, the network counts of a set follow
+    a multivariate hypergeometric distribution, from which they are drawn directly. Spin
+    permutations move the ROI set instead: network memberships are then coded once as
+    integers, so that the counts of the moved sets are obtained with ``bincount``. Null
+    counts are drawn by chunks of ``chunk_size`` permutations.
+
+    Parameters
+    ----------
+    rois : array_like of int
+        Rows of the ROIs in the centroid table. Duplicates are ignored.
+    parcellation : wheres_waldo.parcellation.Parcellation
+    n_perm : int, optional
+        Number of random sets. Ignored if ``perms`` is given. Default is 10000.
+    seed : int or None, optional
+        Seed of the random sets. Default is 0.
+    perms : (n_perm, n_parcels) array_like of int or None, optional
+        Spin permutations (see :func:`wheres_waldo.spins.spin_permutations`) used instead
+        of random sets, to account for spatial autocorrelation.
+    chunk_size : int, optional
+        Number of null sets drawn at once. Default is 10000.
+
+    Returns
+    -------
+    enrichment : pandas.DataFrame
+        One row per network, with the ``n_rois`` of the set in the network, their
+        ``expected`` number under the null, the ``enrichment`` ratio of both, and the
+        one-sided ``p_value`` of over-representation.
+    """
+    networks, codes = np.unique(parcellation.networks, return_inverse=True)
+    n_networks = len(networks)
+    rois = np.unique(np.asarray(rois, dtype=np.intp))
+    observed = np.bincount(codes[rois], minlength=n_networks)
+
+    sizes = np.bincount(codes, minlength=n_networks)
+    rng = np.random.default_rng(seed)
+    n_perm = n_perm if perms is None else len(perms)
+    exceed = np.zeros(n_networks, dtype=np.int64)
+    total = np.zeros(n_networks, dtype=np.int64)
+    for start in range(0, n_perm, chunk_size):
+        if perms is None:
+            size = min(chunk_size, n_perm - start)
+            counts = rng.multivariate_hypergeometric(sizes, rois.size, size=size)
+        else:
+            sets = np.asarray(perms[start : start + chunk_size])[:, rois]
+            counts = _count(codes, sets, n_networks)
+        exceed += (counts >= observed).sum(axis=0)
+        total += counts.sum(axis=0)
+
+    expected = total / n_perm
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = observed / expected
+    return pd.DataFrame(
+        {
+            "network": networks,
+            "n_rois": observed,
+            "expected": expected,
+            "enrichment": ratio,
+            "p_value": (1 + exceed) / (1 + n_perm),
+        }
+    )
@@ -0,0 +1,185 @@
+"""Concurrent prefetching of Schaefer atlas files into the cache."""
+import argparse
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from wheres_waldo import __version__
+from wheres_waldo.atlas import (
+    N_NETWORKS,
+    N_PARCELS,
+    centroid_url,
+    fetch_file,
+    get_cache_dir,
+    labels_url,
+)
+from wheres_waldo.downloads import Session
+from wheres_waldo.logs import Progress, add_logging_arguments, setup_logging
+
+LGR = logging.getLogger(__name__)
+
+# Resolutions (in mm) of the volumetric label images distributed by CBIG
+RESOLUTIONS = (1, 2)
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="waldo fetch")
+    optional = parser._action_groups.pop()
+
+    optional.add_argument(
+        "-p",
+        "--parcels",
+        help="Numbers of parcels of the variants to fetch. Default is all of them.",
+        required=False,
+        type=int,
+        nargs="+",
+        default=list(N_PARCELS),
+        dest="n_parcels",
+        choices=N_PARCELS,
+    )
+    optional.add_argument(
+        "-n",
+        "--networks",
+        help="Numbers of networks of the variants to fetch. Default is all of them.",
+        required=False,
+        type=int,
+        nargs="+",
+        default=list(N_NETWORKS),
+        dest="n_networks",
+        choices=N_NETWORKS,
+    )
+    optional.add_argument(
+        "--resolutions",
+        help="Resolutions (in mm) of the volumetric label images to fetch.",
+        required=False,
+        type=int,
+        nargs="+",
+        default=[1],
+        dest="resolutions",
+        choices=RESOLUTIONS,
+    )
+    optional.add_argument(
+        "--no-labels",
+        help="Only fetch the centroid tables, not the volumetric label images.",
+        action="store_false",
+        dest="labels",
+    )
+    optional.add_argument(
+        "-j",
+        "--n-jobs",
+        help="Maximum number of concurrent downloads.",
+        required=False,
+        type=int,
+        default=8,
+        dest="n_jobs",
+    )
+    add_logging_arguments(optional)
+    optional.add_argument("-v", "--version", action="version", version=("%(prog)s " + __version__))
+
+    return parser
+
+
+def atlas_urls(n_parcels=N_PARCELS, n_networks=N_NETWORKS, labels=True, resolutions=(1,)):
+    """
+    List the URLs of the files of a selection of Schaefer variants.
+
+    Parameters
+    ----------
+    n_parcels : iterable of int, optional
+        Numbers of parcels. Default is all of them.
+    n_networks : iterable of int, optional
+        Numbers of networks. Default is all of them.
+    labels : bool, optional
+        Include the volumetric label images. Default is True.
+    resolutions : iterable of int, optional
+        Resolutions of the label images, in mm. Default is (1,).
+
+    Returns
+    -------
+    urls : list of str
+        Centroid tables first, then label images.
+    """
+    variants = list(itertools.product(n_parcels, n_networks))
+    urls = [centroid_url(p, n) for p, n in variants]
+    if labels:
+        urls += [labels_url(p, n, res) for p, n in variants for res in resolutions]
+    return list(dict.fromkeys(urls))
+
+
+def fetch_atlases(
+    n_parcels=N_PARCELS,
+    n_networks=N_NETWORKS,
+    labels=True,
+    resolutions=(1,),
+    n_jobs=8,
+    cache_dir=None,
+):
+    """
+    Download the files of a selection of Schaefer variants into the cache, concurrently.
+
+    At most ``n_jobs`` files are downloaded at once, over a pool of keep-alive connections
+    shared by the workers. Files already in the cache are not downloaded again, and each
+    download is renamed into the cache only once complete.
+
+    Parameters
+    ----------
+    n_parcels, n_networks, labels, resolutions
+        Selection of files. See :func:`atlas_urls`.
+    n_jobs : int, optional
+        Maximum number of concurrent downloads. Default is 8.
+    cache_dir : str or None, optional
+        Cache directory. See :func:`wheres_waldo.atlas.get_cache_dir`.
+
+    Returns
+    -------
+    paths : list of str
+        Local paths of the cached files, in the order of :func:`atlas_urls`.
+
+    Raises
+    ------
+    RuntimeError
+        If any download failed, after all the others completed.
+    """
+    urls = atlas_urls(n_parcels, n_networks, labels, resolutions)
+    cache_dir = get_cache_dir(cache_dir)
+    n_jobs = max(1, min(n_jobs, len(urls)))
+    session = Session(max_connections=n_jobs)
+
+    paths = [None] * len(urls)
+    failures = []
+    try:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor, Progress(
+            len(urls), "Atlas files", logger=LGR
+        ) as progress:
+            futures = {
+                executor.submit(fetch_file, url, cache_dir, session): i
+                for i, url in enumerate(urls)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    paths[i] = future.result()
+                except Exception as exc:
+                    LGR.error("Could not fetch %s: %s", urls[i], exc)
+                    failures.append(urls[i])
+                progress.update()
+    finally:
+        session.close()
+
+    if failures:
+        raise RuntimeError(f"Could not fetch {len(failures)} of {len(urls)} atlas files.")
+    return paths
+
+
+def _main(argv=None):
+    options = vars(_get_parser().parse_args(argv))
+    setup_logging(quiet=options.pop("quiet"), log_json=options.pop("log_json"))
+    paths = fetch_atlases(**options)
+    LGR.info("%d atlas files in %s", len(paths), get_cache_dir())
@@ -0,0 +1,185 @@
+"""Geodesic distances between Schaefer parcels along the cortical surface."""
+import logging
+import os
+import os.path as op
+
+import numpy as np
+from joblib import Parallel, delayed
+from scipy import sparse
+from scipy.sparse.csgraph import dijkstra
+
+from wheres_waldo.atlas import get_cache_dir, remove_stale, variant_name
+from wheres_waldo.downloads import atomic_write
+from wheres_waldo.surface import (
+    HEMISPHERES,
+    labels_digest,
+    load_geometry,
+    load_surface_labels,
+    surfaces_digest,
+)
+
+LGR = logging.getLogger(__name__)
+
+
+def mesh_graph(coords, faces, mask=None):
+    """
+    Build the sparse graph of the edges of a triangular mesh, weighted by their length.
+
+    Parameters
+    ----------
+    coords : (n_vertices, 3) array_like
+    faces : (n_faces, 3) array_like of int
+    mask : (n_vertices,) array_like of bool or None, optional
+        Vertices to keep. Edges touching other vertices (e.g. the medial wall) are dropped,
+        so that no path goes through them.
+
+    Returns
+    -------
+    graph : (n_vertices, n_vertices) scipy.sparse.csr_matrix
+        Upper-triangular adjacency matrix, to be used as an undirected graph.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.intp)
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    if mask is not None:
+        edges = edges[np.asarray(mask)[edges].all(axis=1)]
+    lengths = np.linalg.norm(coords[edges[:, 0]] - coords[edges[:, 1]], axis=1)
+    n_vertices = len(coords)
+    return sparse.csr_matrix((lengths, (edges[:, 0], edges[:, 1])), shape=(n_vertices,) * 2)
+
+
+def centroid_vertices(coords, labels, n_labels):
+    """
+    Find the vertex of each parcel closest to the mean of its vertices.
+
+    Parameters
+    ----------
+    coords : (n_vertices, 3) array_like
+    labels : (n_vertices,) array_like of int
+        Label of each vertex, 0 being ignored.
+    n_labels : int
+        Number of labels, i.e. the largest label + 1.
+
+    Returns
+    -------
+    vertices : (n_labels,) numpy.ndarray of int
+        Centroid vertex of each label, -1 for labels without vertices.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.intp)
+    counts = np.bincount(labels, minlength=n_labels)
+    means = (
+        np.stack(
+            [np.bincount(labels, weights=coords[:, i], minlength=n_labels) for i in range(3)], 1
+        )
+        / np.maximum(counts, 1)[:, None]
+    )
+    distances = np.linalg.norm(coords - means[labels], axis=1)
+
+    # First vertex of each label once sorted by label, then by distance
+    order = np.lexsort((distances, labels))
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = labels[order][1:] != labels[order][:-1]
+    vertices = np.full(n_labels, -1, dtype=np.intp)
+    vertices[labels[order][first]] = order[first]
+    vertices[0] = -1
+    return vertices
+
+
+def _distances(graph, sources, targets):
+    """Dijkstra from a chunk of sources, keeping the distances to the targets only."""
+    return dijkstra(graph, directed=False, indices=sources)[:, targets].astype(np.float32)
+
+
+def geodesic_distances(
+    surfaces, n_parcels=100, n_networks=7, mesh="fsaverage", cache_dir=None, n_jobs=1
+):
+    """
+    Compute the geodesic distances between the centroid vertices of all parcels.
+
+    Distances are computed within each hemisphere by Dijkstra's algorithm on the graph of
+    mesh edges, excluding the medial wall, from the centroid vertex of each parcel (see
+    :func:`centroid_vertices`). Chunks of source parcels are processed in parallel. The
+    resulting matrix is cached as a float32 ``.npy`` file per variant, mesh and surfaces,
+    memory-mapped on later calls, and rebuilt when the label files or centroid table are
+    updated (see :func:`wheres_waldo.surface.labels_digest`).
+
+    Parameters
+    ----------
+    surfaces : dict
+        FreeSurfer geometry or GIFTI surface file of each hemisphere (``lh`` and ``rh``),
+        e.g. the ``pial`` or ``midthickness`` surfaces of ``mesh``.
+    n_parcels : int, optional
+        Number of Schaefer parcels. Default is 100.
+    n_networks : int, optional
+        Number of Yeo networks. Default is 7.
+    mesh : str, optional
+        Mesh of the surfaces. See :data:`wheres_waldo.surface.MESHES`. Default is
+        "fsaverage".
+    cache_dir : str or None, optional
+        Cache directory. See :func:`wheres_waldo.atlas.get_cache_dir`.
+    n_jobs : int, optional
+        Number of parallel jobs. Default is 1.
+
+    Returns
+    -------
+    distances : (n_parcels, n_parcels) numpy.memmap of float32
+        Distances in mm, indexed by rows of the centroid table. Distances between
+        hemispheres, or from parcels missing on the mesh, are infinite.
+    """
+    directory = op.join(get_cache_dir(cache_dir), "geodesic")
+    os.makedirs(directory, exist_ok=True)
+    path = op.join(
+        directory,
+        f"{variant_name(n_parcels, n_networks)}_{mesh}_{surfaces_digest(surfaces)}_"
+        f"{labels_digest(n_parcels, n_networks, mesh, cache_dir)}.npy",
+    )
+    if op.isfile(path):
+        return np.load(path, mmap_mode="r")
+
+    distances = np.full((n_parcels, n_parcels), np.inf, dtype=np.float32)
+    for hemi in HEMISPHERES:
+        labels = np.asarray(load_surface_labels(n_parcels, n_networks, mesh, hemi, cache_dir))
+        coords, faces = load_geometry(surfaces[hemi])
+        if len(coords) != len(labels):
+            raise ValueError(
+                f"{surfaces[hemi]} has {len(coords)} vertices, but the {mesh} {hemi} labels "
+                f"have {len(labels)}."
+            )
+        graph = mesh_graph(coords, faces, mask=labels > 0)
+
+        # ROI Labels are the rows of the centroid table + 1
+        vertices = centroid_vertices(coords, labels, n_parcels + 1)[1:]
+        rows = np.flatnonzero(vertices >= 0)
+        LGR.info("Computing geodesic distances between %d %s parcels...", rows.size, hemi)
+        chunks = np.array_split(rows, min(rows.size, 4 * max(n_jobs, 1)))
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(_distances)(graph, vertices[chunk], vertices[rows]) for chunk in chunks
+        )
+        distances[np.ix_(rows, rows)] = np.concatenate(results)
+
+    with atomic_write(path) as f:
+        np.save(f, distances)
+    remove_stale(path)
+    return np.load(path, mmap_mode="r")
+
+
+def parcel_distances(rois, surfaces, n_parcels=100, n_networks=7, mesh="fsaverage", **kwargs):
+    """
+    Return the geodesic distances between a selection of parcels.
+
+    Parameters
+    ----------
+    rois : array_like of int
+        Rows of the parcels in the centroid table.
+    surfaces, n_parcels, n_networks, mesh, **kwargs
+        See :func:`geodesic_distances`.
+
+    Returns
+    -------
+    distances : (n_rois, n_rois) numpy.ndarray of float32
+    """
+    distances = geodesic_distances(surfaces, n_parcels, n_networks, mesh, **kwargs)
+    rois = np.asarray(rois, dtype=np.intp)
+    return np.asarray(distances[np.ix_(rois, rois)])
@@ -0,0 +1,181 @@
+"""Seek-point indices giving random access into gzip-compressed NIfTI images.
+
+A gzip stream can only be decompressed from its start, so reading the last volume of a
+``.nii.gz`` run normally means inflating the whole file. A seek-point index stores, every
+``spacing`` bytes of uncompressed data, the compressed offset and the 32 KiB zlib window
+needed to resume inflation there, so that any volume or slab can be read after inflating at
+most ``spacing`` bytes.
+
+Indices are built with the ``zran`` implementation of the optional ``indexed_gzip`` package,
+and saved next to the image (``<image>.gzidx``) or, when its directory is not writable, in
+the cache directory.
+"""
+import contextlib
+import hashlib
+import os
+import os.path as op
+
+import nibabel as nib
+
+from wheres_waldo.atlas import get_cache_dir
+from wheres_waldo.downloads import atomic_write
+
+try:
+    import indexed_gzip as igzip
+except ImportError:  # pragma: no cover
+    igzip = None
+
+# Default distance between seek points, in bytes of uncompressed data
+SPACING = 4 * 1024 * 1024
+
+
+def index_path(path, cache_dir=None):
+    """
+    Return where the seek-point index of a gzipped file is stored.
+
+    Parameters
+    ----------
+    path : str
+        Gzipped file.
+    cache_dir : str or None, optional
+        Cache directory used when the directory of ``path`` is not writable.
+        See :func:`wheres_waldo.atlas.get_cache_dir`.
+
+    Returns
+    -------
+    index_path : str
+    """
+    path = op.abspath(path)
+    if os.access(op.dirname(path), os.W_OK):
+        return f"{path}.gzidx"
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+    directory = op.join(get_cache_dir(cache_dir), "gzindex")
+    os.makedirs(directory, exist_ok=True)
+    return op.join(directory, f"{key}.gzidx")
+
+
+def _is_current(path, idx_path):
+    """Whether an index exists and is more recent than the file it indexes."""
+    return op.isfile(idx_path) and os.stat(idx_path).st_mtime_ns >= os.stat(path).st_mtime_ns
+
+
+def build_index(path, spacing=SPACING, cache_dir=None, force=False):
+    """
+    Build and save the seek-point index of a gzipped file.
+
+    Parameters
+    ----------
+    path : str
+        Gzipped file.
+    spacing : int, optional
+        Distance between seek points, in bytes of uncompressed data. Smaller values make
+        random reads cheaper and the index larger (each point stores a 32 KiB window).
+        Default is 4 MiB.
+    cache_dir : str or None, optional
+        See :func:`index_path`.
+    force : bool, optional
+        Rebuild the index even if an up-to-date one exists. Default is False.
+
+    Returns
+    -------
+    index_path : str
+        Path of the saved index.
+    """
+    if igzip is None:
+        raise ImportError("Building gzip seek indices requires the indexed_gzip package.")
+
+    idx_path = index_path(path, cache_dir)
+    if force or not _is_current(path, idx_path):
+        with igzip.IndexedGzipFile(path, spacing=spacing) as f, atomic_write(idx_path) as dst:
+            f.build_full_index()
+            f.export_index(fileobj=dst)
+    return idx_path
+
+
+def open_indexed(path, cache_dir=None, build=True, spacing=SPACING):
+    """
+    Open a gzipped file for random access using its seek-point index.
+
+    Parameters
+    ----------
+    path : str
+        Gzipped file.
+    cache_dir : str or None, optional
+        See :func:`index_path`.
+    build : bool, optional
+        Build the index if it does not exist yet. Default is True.
+    spacing : int, optional
+        See :func:`build_index`.
+
+    Returns
+    -------
+    fobj : file-like
+        Seekable binary file object of the uncompressed data, owned by the caller, who must
+        close it (e.g. by using it as a context manager).
+    """
+    if igzip is None:
+        raise ImportError("Indexed gzip access requires the indexed_gzip package.")
+
+    idx_path = index_path(path, cache_dir)
+    if build:
+        build_index(path, spacing=spacing, cache_dir=cache_dir)
+    if _is_current(path, idx_path):
+        return igzip.IndexedGzipFile(path, index_file=idx_path)
+    return igzip.IndexedGzipFile(path, spacing=spacing)
+
+
+def load_indexed(path, cache_dir=None, build=True, spacing=SPACING):
+    """
+    Load a NIfTI image whose data can be sliced without decompressing the whole file.
+
+    Slicing the returned image's ``dataobj`` (e.g. ``img.dataobj[..., -1]`` for the last
+    volume) only inflates the data between the closest seek point and the requested
+    voxels. Uncompressed images, and gzipped images when ``indexed_gzip`` is not installed,
+    are loaded with :func:`nibabel.load`.
+
+    Parameters
+    ----------
+    path : str
+        NIfTI image.
+    cache_dir : str or None, optional
+        See :func:`index_path`.
+    build : bool, optional
+        Build the index if it does not exist yet. Default is True.
+    spacing : int, optional
+        See :func:`build_index`.
+
+    Returns
+    -------
+    img : nibabel.Nifti1Image
+        Image whose ``dataobj`` reads from an open file, closed when the image is garbage
+        collected. Use :func:`indexed_image` to close it deterministically.
+    """
+    if igzip is None or not path.endswith(".gz"):
+        return nib.load(path)
+    fobj = open_indexed(path, cache_dir=cache_dir, build=build, spacing=spacing)
+    try:
+        return nib.Nifti1Image.from_stream(fobj)
+    except BaseException:
+        fobj.close()
+        raise
+
+
+@contextlib.contextmanager
+def indexed_image(path, cache_dir=None, build=True, spacing=SPACING):
+    """
+    Load a NIfTI image with :func:`load_indexed`, closing its file on exit.
+
+    The data of the image must be read within the ``with`` block.
+
+    Yields
+    ------
+    img : nibabel.Nifti1Image
+    """
+    img = load_indexed(path, cache_dir=cache_dir, build=build, spacing=spacing)
+    try:
+        yield img
+    finally:
+        fobj = img.dataobj.file_like
+        if not isinstance(fobj, str):
+            fobj.close()
@@ -0,0 +1,99 @@
+"""Homologous parcels across hemispheres."""
+from functools import lru_cache
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from wheres_waldo.registry import get_parcellation
+
+# Number of contralateral candidates considered for each parcel
+N_CANDIDATES = 4
+# Distance (in mm) beyond the closest candidate within which names break ties
+TOLERANCE = 5.0
+# Reflection across the midsagittal plane
+_MIRROR = np.array([-1.0, 1.0, 1.0])
+
+
+def _name_stems(short_names):
+    """Strip the hemisphere and the parcel number from names, e.g. ``LH_Vis_1`` to ``Vis``."""
+    return np.array([name.split("_", 1)[1].rsplit("_", 1)[0] for name in short_names])
+
+
+def find_homologs(parcellation, match_names=True, tolerance=TOLERANCE):
+    """
+    Find the contralateral counterpart of each parcel.
+
+    The centroids of each hemisphere are mirrored across the midsagittal plane and matched
+    to the closest centroids of the other hemisphere with a KD-tree. With ``match_names``,
+    a candidate whose name (without hemisphere and number, e.g. ``DefaultA_PFCm``) is the
+    same as the parcel's is preferred to closer candidates, as long as it is at most
+    ``tolerance`` mm further than the closest one.
+
+    Parameters
+    ----------
+    parcellation : wheres_waldo.parcellation.Parcellation
+    match_names : bool, optional
+        Break ties between candidates by their names. Default is True.
+    tolerance : float, optional
+        Default is 5 mm.
+
+    Returns
+    -------
+    homologs : dict of numpy.ndarray
+        ``roi`` (row of each parcel in the centroid table), ``homolog`` (row of its
+        homolog, -1 if the other hemisphere is empty) and ``distance`` (between the
+        mirrored centroid and the homolog's centroid, in mm).
+    """
+    mirrored = parcellation.coords * _MIRROR
+    stems = _name_stems(parcellation.short_names)
+    homologs = np.full(parcellation.n_parcels, -1, dtype=np.intp)
+    distances = np.full(parcellation.n_parcels, np.nan)
+    for hemi, other in (("LH", "RH"), ("RH", "LH")):
+        rows = np.flatnonzero(parcellation.hemispheres == hemi)
+        candidates = np.flatnonzero(parcellation.hemispheres == other)
+        if not rows.size or not candidates.size:
+            continue
+        k = min(N_CANDIDATES if match_names else 1, candidates.size)
+        dist, nearest = cKDTree(parcellation.coords[candidates]).query(mirrored[rows], k=k)
+        dist, nearest = dist.reshape(rows.size, k), candidates[nearest.reshape(rows.size, k)]
+
+        choice = np.zeros(rows.size, dtype=np.intp)
+        if match_names:
+            preferred = (stems[nearest] == stems[rows, None]) & (dist <= dist[:, :1] + tolerance)
+            choice = np.where(preferred.any(axis=1), preferred.argmax(axis=1), 0)
+        homologs[rows] = np.take_along_axis(nearest, choice[:, None], axis=1)[:, 0]
+        distances[rows] = np.take_along_axis(dist, choice[:, None], axis=1)[:, 0]
+    return {"roi": np.arange(parcellation.n_parcels), "homolog": homologs, "distance": distances}
+
+
+def homolog_table(n_parcels=100, n_networks=7, match_names=True, tolerance=TOLERANCE):
+    """
+    Return the homologs of all parcels of a Schaefer variant, computed once per process.
+
+    Homologs are memoized per parcellation of the registry, so that they are computed
+    again once the centroid table is updated (see
+    :func:`wheres_waldo.registry.get_parcellation`).
+
+    Parameters
+    ----------
+    n_parcels : int, optional
+        Number of Schaefer parcels. Default is 100.
+    n_networks : int, optional
+        Number of Yeo networks. Default is 7.
+    match_names, tolerance
+        See :func:`find_homologs`.
+
+    Returns
+    -------
+    homologs : dict of numpy.ndarray
+        See :func:`find_homologs`. The arrays are read-only.
+    """
+    return _homologs(get_parcellation(n_parcels, n_networks), match_names, tolerance)
+
+
+@lru_cache(maxsize=16)
+def _homologs(parcellation, match_names, tolerance):
+    homologs = find_homologs(parcellation, match_names, tolerance)
+    for column in homologs.values():
+        column.setflags(write=False)
+    return homologs
@@ -0,0 +1,165 @@
+"""Inter-process file locks, usable on shared filesystems."""
+import errno
+import logging
+import os
+import socket
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LGR = logging.getLogger(__name__)
+
+# errno values of filesystems that do not support advisory locks (e.g. some NFS or Lustre
+# mounts), on which lock files are used instead
+_UNSUPPORTED = {errno.ENOLCK, errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL}
+
+
+class FileLock:
+    """
+    Exclusive lock shared by all processes that can see ``path``, used as a context manager.
+
+    The lock is an advisory ``flock`` on ``path``, released by the kernel if its holder
+    dies. Where advisory locks are not supported, it falls back to creating ``path``
+    exclusively: the holder then refreshes the modification time of the file while it
+    holds the lock, and a lock file that was not refreshed for ``stale`` seconds is
+    considered left over by a dead process, and broken.
+
+    Parameters
+    ----------
+    path : str
+        Lock file. Its directory must exist.
+    timeout : float or None, optional
+        Maximum time to wait for the lock, in seconds. Default is None (wait forever).
+    stale : float, optional
+        Age after which a lock file is broken, in seconds. Default is 60.
+    poll : float, optional
+        Time between two attempts to take the lock, in seconds. Default is 0.1.
+
+    Examples
+    --------
+    >>> with FileLock(f"{path}.lock"):
+    ...     if not op.isfile(path):
+    ...         download(url, path)
+    """
+
+    def __init__(self, path, timeout=None, stale=60, poll=0.1):
+        self.path = path
+        self.timeout = timeout
+        self.stale = stale
+        self.poll = poll
+        self._fd = None
+        self._heartbeat = None
+        self._released = threading.Event()
+
+    def _wait(self, start):
+        if self.timeout is not None and time.monotonic() - start >= self.timeout:
+            raise TimeoutError(f"Could not lock {self.path} within {self.timeout} s.")
+        time.sleep(self.poll)
+
+    def _flock(self, start):
+        """Take an advisory lock. Return False if the filesystem does not support them."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                try:
+                    self._wait(start)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except OSError as exc:
+                os.close(fd)
+                if exc.errno in _UNSUPPORTED:
+                    return False
+                raise
+            else:
+                self._fd = fd
+                return True
+
+    def _create(self, start):
+        """Take the lock by creating the lock file exclusively."""
+        path = f"{self.path}.excl"
+        while True:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except FileExistsError:
+                self._break_stale(path)
+                self._wait(start)
+            else:
+                os.write(fd, f"{socket.gethostname()}:{os.getpid()}\n".encode())
+                os.close(fd)
+                break
+
+        self._released.clear()
+        self._heartbeat = threading.Thread(target=self._refresh, args=(path,), daemon=True)
+        self._heartbeat.start()
+
+    def _break_stale(self, path):
+        try:
+            before = os.stat(path)
+        except FileNotFoundError:
+            return
+        age = time.time() - before.st_mtime
+        if age <= self.stale:
+            return
+        # Another waiter may break the same lock and take it between our stat and rename,
+        # so check that the file we moved away is still the stale one, and put it back if not
+        broken = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.stale"
+        try:
+            os.rename(path, broken)
+        except FileNotFoundError:
+            return
+        after = os.stat(broken)
+        if (after.st_ino, after.st_mtime_ns) != (before.st_ino, before.st_mtime_ns):
+            try:
+                os.link(broken, path)
+            except FileExistsError:
+                LGR.warning("Could not restore the lock file %s, which was taken again", path)
+            os.remove(broken)
+            return
+        os.remove(broken)
+        LGR.warning("Broke stale lock %s (%.0f s old)", path, age)
+
+    def _refresh(self, path):
+        while not self._released.wait(self.stale / 4):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Moved away for a moment by a waiter checking whether the lock is stale
+                continue
+            except OSError:
+                return
+
+    def acquire(self):
+        """Wait until the lock is taken."""
+        start = time.monotonic()
+        if fcntl is None or not self._flock(start):
+            self._create(start)
+        return self
+
+    def release(self):
+        """Release the lock."""
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        elif self._heartbeat is not None:
+            self._released.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+            try:
+                os.remove(f"{self.path}.excl")
+            except FileNotFoundError:
+                LGR.warning("Lock file %s.excl was removed while held", self.path)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
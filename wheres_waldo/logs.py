@@ -0,0 +1,153 @@
+"""Logging configuration and rate-limited progress reporting."""
+import json
+import logging
+import sys
+import time
+
+LGR = logging.getLogger(__name__)
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as one JSON object per line, for machine consumption."""
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        progress = getattr(record, "progress", None)
+        if progress is not None:
+            entry["progress"] = progress
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def add_logging_arguments(parser):
+    """Add the ``--quiet`` and ``--log-json`` options to a command line parser."""
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        help="Only report warnings and errors.",
+        action="store_true",
+        dest="quiet",
+    )
+    parser.add_argument(
+        "--log-json",
+        help="Write log messages as JSON lines.",
+        action="store_true",
+        dest="log_json",
+    )
+    return parser
+
+
+def setup_logging(quiet=False, log_json=False, stream=None):
+    """
+    Configure the logging of the ``wheres_waldo`` package.
+
+    Parameters
+    ----------
+    quiet : bool, optional
+        Only report warnings and errors. Default is False.
+    log_json : bool, optional
+        Write messages as JSON lines instead of plain text. Default is False.
+    stream : file-like or None, optional
+        Where to write messages. Default is stderr.
+    """
+    handler = logging.StreamHandler(sys.stderr if stream is None else stream)
+    if log_json:
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+    logger = logging.getLogger("wheres_waldo")
+    for previous in list(logger.handlers):
+        logger.removeHandler(previous)
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING if quiet else logging.INFO)
+    logger.propagate = False
+
+
+class Progress:
+    """
+    Report the progress of a loop at most every ``interval`` seconds.
+
+    Each report gives the number of processed items, the throughput and the estimated time
+    left. :meth:`update` only increments a counter and reads a monotonic clock, so it can
+    be called for every item of large loops.
+
+    Parameters
+    ----------
+    total : int
+        Number of items to process.
+    desc : str
+        Description of the items.
+    logger : logging.Logger, optional
+        Logger used for the reports. Default is the ``wheres_waldo.logs`` logger.
+    interval : float, optional
+        Minimum time between two reports, in seconds. Default is 0.5.
+    level : int, optional
+        Logging level of the reports. Default is ``logging.INFO``.
+
+    Examples
+    --------
+    >>> with Progress(len(rois), "ROIs") as progress:
+    ...     for roi in rois:
+    ...         progress.update()
+    """
+
+    __slots__ = ("total", "desc", "logger", "interval", "level", "count", "_start", "_next")
+
+    def __init__(self, total, desc, logger=LGR, interval=0.5, level=logging.INFO):
+        self.total = total
+        self.desc = desc
+        self.logger = logger
+        self.interval = interval
+        self.level = level
+        self.count = 0
+        self._start = self._next = None
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        self._next = self._start + self.interval
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self._report(time.monotonic())
+        return False
+
+    def update(self, n=1):
+        """Mark ``n`` more items as processed."""
+        self.count += n
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            self._report(now)
+
+    def _report(self, now):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        elapsed = now - self._start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.count) / rate if rate else 0.0
+        self.logger.log(
+            self.level,
+            "%s: %d/%d (%.1f/s, ETA %.1fs)",
+            self.desc,
+            self.count,
+            self.total,
+            rate,
+            eta,
+            extra={
+                "progress": {
+                    "desc": self.desc,
+                    "count": self.count,
+                    "total": self.total,
+                    "rate": rate,
+                    "eta_s": eta,
+                }
+            },
+        )
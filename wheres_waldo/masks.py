@@ -0,0 +1,172 @@
+"""Binary and label masks of Schaefer ROIs."""
+import gzip
+import hashlib
+import json
+import os
+import os.path as op
+
+import nibabel as nib
+import numpy as np
+from joblib import Parallel, delayed
+from scipy import ndimage
+
+from wheres_waldo.atlas import cached_checksum
+from wheres_waldo.downloads import atomic_write
+
+MASK_MODES = ("roi", "4d", "label")
+
+# Records which atlas/ROI/compression produced each mask of an output directory
+MANIFEST = ".waldo_masks.json"
+
+
+def save_nifti(img, path, compresslevel=6):
+    """
+    Save a NIfTI image with a given gzip compression level.
+
+    Parameters
+    ----------
+    img : nibabel.Nifti1Image
+        Image to save.
+    path : str
+        Output file name. Files ending in ``.nii`` are written uncompressed.
+    compresslevel : int, optional
+        gzip compression level (1-9) of ``.nii.gz`` files. Default is 6.
+    """
+    with atomic_write(path) as f:
+        if path.endswith(".gz"):
+            with gzip.GzipFile(path, "wb", compresslevel, fileobj=f) as gz:
+                gz.write(img.to_bytes())
+        else:
+            f.write(img.to_bytes())
+
+
+def _write_roi_mask(index, box, value, affine, header, path, compresslevel):
+    """Write the binary mask of the voxels of ``index`` equal to ``value``."""
+    mask = np.zeros(index.shape, dtype=np.uint8)
+    if box is not None:
+        mask[box] = index[box] == value
+    img = nib.Nifti1Image(mask, affine, header)
+    img.set_data_dtype(np.uint8)
+    save_nifti(img, path, compresslevel)
+
+
+def roi_masks(
+    labels_img,
+    roi_labels,
+    out_dir,
+    prefix="",
+    mode="roi",
+    compresslevel=6,
+    n_jobs=1,
+):
+    """
+    Write masks of the requested ROIs of a label image.
+
+    All masks are derived from a single lookup-table pass over the label volume, masks of
+    individual ROIs being filled only within their bounding boxes.
+
+    Parameters
+    ----------
+    labels_img : str or nibabel.Nifti1Image
+        Atlas label image.
+    roi_labels : list of int
+        Labels of the ROIs to extract. Masks of individual ROIs are named after their label
+        (``<prefix>roi-<label>_mask.nii.gz``).
+    out_dir : str
+        Output directory.
+    prefix : str, optional
+        Prefix of the output file names.
+    mode : {"roi", "4d", "label"}, optional
+        Write one binary mask per ROI ("roi"), a single 4D image with one binary volume per
+        ROI ("4d"), or a single label image restricted to the requested ROIs ("label").
+        Default is "roi".
+    compresslevel : int, optional
+        gzip compression level of the masks, 0 writing uncompressed ``.nii`` files.
+        Default is 6.
+    n_jobs : int, optional
+        Number of masks written in parallel. Default is 1.
+
+    Returns
+    -------
+    paths : list of str
+        Paths of the masks, written or already up to date.
+    """
+    if mode not in MASK_MODES:
+        raise ValueError(f"Unknown mask mode {mode!r}, expected one of {MASK_MODES}.")
+    if isinstance(labels_img, str):
+        source = labels_img
+        labels_img = nib.load(labels_img)
+    else:
+        source = labels_img.get_filename()
+    # Each ROI is written once, even if requested several times
+    roi_labels = np.asarray(list(dict.fromkeys(np.asarray(roi_labels, dtype=int).tolist())))
+    os.makedirs(out_dir, exist_ok=True)
+
+    # A mask is up to date if it was produced from the same atlas, ROI and compression
+    if source is not None:
+        atlas_key = cached_checksum(source)
+    else:
+        atlas_key = hashlib.sha1(np.ascontiguousarray(labels_img.dataobj).tobytes()).hexdigest()
+    extension = ".nii.gz" if compresslevel else ".nii"
+    if mode == "roi":
+        names = [f"{prefix}roi-{label}_mask{extension}" for label in roi_labels]
+        targets = [[label] for label in roi_labels]
+    else:
+        names = [f"{prefix}rois_{mode}{extension}"]
+        targets = [list(roi_labels)]
+    keys = [
+        hashlib.sha1(f"{atlas_key}|{mode}|{target}|{compresslevel}".encode()).hexdigest()
+        for target in targets
+    ]
+
+    manifest_path = op.join(out_dir, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        # Missing or corrupted: all masks are rewritten
+        manifest = {}
+    if not isinstance(manifest, dict):
+        manifest = {}
+    todo = [
+        i
+        for i, (name, key) in enumerate(zip(names, keys))
+        if manifest.get(name) != key or not op.isfile(op.join(out_dir, name))
+    ]
+    paths = [op.join(out_dir, name) for name in names]
+    if not todo:
+        return paths
+
+    # One gather over the volume: index[voxel] is the position (1-based) of its ROI
+    labels = np.asarray(labels_img.dataobj).astype(np.int64, copy=False)
+    lut = np.zeros(max(labels.max(), roi_labels.max()) + 1, dtype=np.int32)
+    lut[roi_labels] = np.arange(1, roi_labels.size + 1)
+    index = lut[labels]
+
+    header = labels_img.header.copy()
+    if mode == "roi":
+        boxes = ndimage.find_objects(index, max_label=roi_labels.size)
+        jobs = (
+            delayed(_write_roi_mask)(
+                index, boxes[i], i + 1, labels_img.affine, header, paths[i], compresslevel
+            )
+            for i in todo
+        )
+    else:
+        if mode == "label":
+            lut[roi_labels] = roi_labels
+            data = lut[labels].astype(labels_img.get_data_dtype())
+        else:
+            data = np.zeros(index.shape + (roi_labels.size,), dtype=np.uint8)
+            for i, box in enumerate(ndimage.find_objects(index, max_label=roi_labels.size)):
+                if box is not None:
+                    data[box + (i,)] = index[box] == i + 1
+        img = nib.Nifti1Image(data, labels_img.affine, header)
+        img.set_data_dtype(data.dtype)
+        jobs = [delayed(save_nifti)(img, paths[0], compresslevel)]
+    Parallel(n_jobs=n_jobs, prefer="threads")(jobs)
+
+    manifest.update({names[i]: keys[i] for i in todo})
+    with atomic_write(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return paths
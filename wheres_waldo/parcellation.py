@@ -0,0 +1,206 @@
+"""Array-backed Schaefer parcellations for repeated queries."""
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from wheres_waldo.atlas import centroid_url, fetch_file
+from wheres_waldo.utils import get_MNI_152
+
+
+class Parcellation:
+    """
+    Schaefer 2018 parcellation loaded once and queried in batches.
+
+    Parcels are stored in the order of the centroid table, as contiguous arrays. ROIs are
+    designated by their (0-based) row in this table, as in :func:`wheres_waldo`. Query
+    methods return dictionaries of arrays (columns); :meth:`to_frame` converts them to
+    pandas on demand.
+
+    Parameters
+    ----------
+    labels : (n_parcels,) array_like of int
+        ``ROI Label`` of each parcel, i.e. its value in the volumetric label images.
+    names : (n_parcels,) array_like of str
+        ``ROI Name`` of each parcel, e.g. ``7Networks_LH_Vis_1``.
+    coords : (n_parcels, 3) array_like of float
+        RAS centroid coordinates of each parcel.
+    n_networks : int
+        Number of Yeo networks.
+
+    Attributes
+    ----------
+    n_parcels, n_networks : int
+    labels : (n_parcels,) numpy.ndarray of int32
+    names : (n_parcels,) numpy.ndarray of str
+    short_names : (n_parcels,) numpy.ndarray of str
+        Names without the network prefix, e.g. ``LH_Vis_1``.
+    hemispheres : (n_parcels,) numpy.ndarray of str
+        ``LH`` or ``RH``.
+    networks : (n_parcels,) numpy.ndarray of str
+        Yeo network of each parcel, e.g. ``Vis``.
+    coords : (n_parcels, 3) numpy.ndarray of float64
+    """
+
+    __slots__ = (
+        "n_parcels",
+        "n_networks",
+        "labels",
+        "names",
+        "short_names",
+        "hemispheres",
+        "networks",
+        "coords",
+        "_tree",
+    )
+
+    def __init__(self, labels, names, coords, n_networks):
+        self.labels = np.ascontiguousarray(labels, dtype=np.int32)
+        self.names = np.asarray(names, dtype=str)
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.n_parcels = self.labels.size
+        self.n_networks = n_networks
+
+        prefix = f"{n_networks}Networks_"
+        self.short_names = np.array([name.rsplit(prefix, 1)[1] for name in self.names])
+        parts = np.char.split(self.short_names, "_")
+        self.hemispheres = np.array([part[0] for part in parts])
+        self.networks = np.array([part[1] for part in parts])
+        self._tree = None
+
+    @classmethod
+    def from_csv(cls, path, n_networks):
+        """Create a parcellation from a CBIG centroid table."""
+        table = pd.read_csv(path)
+        return cls(
+            table["ROI Label"].to_numpy(),
+            table["ROI Name"].to_numpy(),
+            table[["R", "A", "S"]].to_numpy(),
+            n_networks,
+        )
+
+    @classmethod
+    def load(cls, n_parcels=100, n_networks=7, cache_dir=None):
+        """
+        Load a Schaefer variant, downloading its centroid table into the cache if needed.
+
+        Parameters
+        ----------
+        n_parcels : int, optional
+            Number of Schaefer parcels. Default is 100.
+        n_networks : int, optional
+            Number of Yeo networks. Default is 7.
+        cache_dir : str or None, optional
+            Cache directory. See :func:`wheres_waldo.atlas.get_cache_dir`.
+
+        Returns
+        -------
+        parcellation : Parcellation
+        """
+        return cls.from_csv(fetch_file(centroid_url(n_parcels, n_networks), cache_dir), n_networks)
+
+    def freeze(self):
+        """
+        Make the arrays of the parcellation read-only, so that it can be shared safely.
+
+        Returns
+        -------
+        self : Parcellation
+        """
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+        return self
+
+    def __repr__(self):
+        return f"{type(self).__name__}(n_parcels={self.n_parcels}, n_networks={self.n_networks})"
+
+    def __len__(self):
+        return self.n_parcels
+
+    def _rows(self, rois):
+        rois = np.asarray(rois, dtype=np.intp)
+        if rois.size and (rois.min() < 0 or rois.max() >= self.n_parcels):
+            raise IndexError(f"ROIs must be between 0 and {self.n_parcels - 1}.")
+        return rois
+
+    def roi_details(self, rois):
+        """
+        Gather the details of a batch of ROIs.
+
+        Parameters
+        ----------
+        rois : array_like of int
+            Rows of the ROIs in the centroid table.
+
+        Returns
+        -------
+        details : dict of numpy.ndarray
+            ``values`` (short names), ``roi_label`` (full names), ``label`` (label values),
+            ``network``, ``hemisphere`` and ``FS_coords`` (homogeneous RAS coordinates,
+            shape ``(n_rois, 4)``).
+        """
+        rois = self._rows(rois)
+        fs_coords = np.ones((rois.size, 4))
+        fs_coords[:, :3] = self.coords[rois]
+        return {
+            "values": self.short_names[rois],
+            "roi_label": self.names[rois],
+            "label": self.labels[rois],
+            "network": self.networks[rois],
+            "hemisphere": self.hemispheres[rois],
+            "FS_coords": fs_coords,
+        }
+
+    @staticmethod
+    def to_mni(fs_coords):
+        """
+        Transform a batch of coordinates to MNI152 space.
+
+        Parameters
+        ----------
+        fs_coords : (n, 3) or (n, 4) array_like
+            RAS coordinates, homogeneous or not.
+
+        Returns
+        -------
+        mni_coords : (n, 3) numpy.ndarray
+        """
+        fs_coords = np.asarray(fs_coords, dtype=np.float64)
+        if fs_coords.shape[-1] == 3:
+            fs_coords = np.concatenate([fs_coords, np.ones(fs_coords.shape[:-1] + (1,))], -1)
+        return get_MNI_152(fs_coords)
+
+    def lookup(self, coords):
+        """
+        Find the parcels whose centroids are the closest to a batch of coordinates.
+
+        Parameters
+        ----------
+        coords : (n, 3) array_like
+            RAS coordinates, in the space of the centroid table.
+
+        Returns
+        -------
+        result : dict of numpy.ndarray
+            ``roi`` (row of the closest parcel), ``values`` (its short name) and
+            ``distance`` (to its centroid, in mm).
+        """
+        if self._tree is None:
+            self._tree = cKDTree(self.coords)
+        distance, rois = self._tree.query(np.asarray(coords, dtype=np.float64).reshape(-1, 3))
+        return {"roi": rois, "values": self.short_names[rois], "distance": distance}
+
+    @staticmethod
+    def to_frame(columns):
+        """
+        Convert columnar results to a pandas DataFrame.
+
+        Two-dimensional columns (e.g. coordinates) become columns of per-row lists.
+        """
+        return pd.DataFrame(
+            {
+                key: value.tolist() if np.ndim(value) > 1 else value
+                for key, value in columns.items()
+            }
+        )
@@ -0,0 +1,252 @@
+"""Sampling of probabilistic atlases at batches of coordinates."""
+import argparse
+import logging
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+
+from wheres_waldo import __version__
+from wheres_waldo.atlas import decompressed_sidecar
+from wheres_waldo.logs import add_logging_arguments, setup_logging
+
+LGR = logging.getLogger(__name__)
+
+# Offsets of the 8 voxels surrounding a point
+_CORNERS = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)])
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="waldo sample")
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group("Required Arguments:")
+
+    # Required arguments
+    required.add_argument(
+        "-c",
+        "--coordinates",
+        help="CSV file of coordinates in the space of the atlas, with x, y and z columns.",
+        required=True,
+        type=str,
+        dest="coordinates",
+    )
+    required.add_argument(
+        "-a",
+        "--atlas",
+        help="4D probabilistic atlas, with one probability map per region.",
+        required=True,
+        type=str,
+        dest="atlas",
+    )
+    required.add_argument(
+        "-l",
+        "--labels",
+        help="Text file with the name of each region of the atlas, one per line.",
+        required=True,
+        type=str,
+        dest="labels",
+    )
+    required.add_argument(
+        "-o",
+        "--output",
+        help="Output file name.",
+        required=True,
+        type=str,
+        dest="output",
+    )
+    # Optional arguments
+    optional.add_argument(
+        "-k",
+        "--top-k",
+        help="Number of most probable regions reported per coordinate.",
+        required=False,
+        type=int,
+        default=3,
+        dest="top_k",
+    )
+    add_logging_arguments(optional)
+    optional.add_argument("-v", "--version", action="version", version=("%(prog)s " + __version__))
+
+    parser._action_groups.append(optional)
+
+    return parser
+
+
+def read_region_names(path):
+    """Read the names of the regions of an atlas from a text file, one per line."""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class ProbabilisticAtlas:
+    """
+    4D probabilistic atlas, memory-mapped and sampled at batches of coordinates.
+
+    Parameters
+    ----------
+    maps : (X, Y, Z, n_regions) array_like
+        Probability of each region at each voxel, e.g. memory-mapped.
+    affine : (4, 4) array_like
+        Voxel-to-world affine of the maps.
+    labels : (n_regions,) array_like of str
+        Name of each region.
+    scale : float or None, optional
+        Factor turning the values of the maps into probabilities. By default, 1/100 for
+        integer maps (stored as percentages, e.g. Harvard-Oxford) and 1 otherwise.
+    offset : float, optional
+        Probability added to ``scale`` times the values of the maps, e.g. to apply the
+        intercept of scaled NIfTI images. Default is 0.
+    """
+
+    __slots__ = ("maps", "affine", "labels", "scale", "offset", "_inverse")
+
+    def __init__(self, maps, affine, labels, scale=None, offset=0.0):
+        if maps.ndim != 4:
+            raise ValueError(f"Probabilistic atlases must be 4D, not {maps.ndim}D.")
+        if maps.shape[3] != len(labels):
+            raise ValueError(f"The atlas has {maps.shape[3]} regions, but {len(labels)} labels.")
+        self.maps = maps
+        self.affine = np.asarray(affine, dtype=np.float64)
+        self.labels = np.asarray(labels, dtype=str)
+        if scale is None:
+            scale = 0.01 if np.issubdtype(maps.dtype, np.integer) else 1.0
+        self.scale = scale
+        self.offset = offset
+        self._inverse = np.linalg.inv(self.affine)
+
+    @classmethod
+    def load(cls, path, labels, scale=None, cache_dir=None):
+        """
+        Memory-map a probabilistic atlas.
+
+        Parameters
+        ----------
+        path : str
+            4D NIfTI image. Gzipped images are read from an uncompressed sidecar in the
+            cache (see :func:`wheres_waldo.atlas.decompressed_sidecar`). The stored values
+            are memory-mapped as is, the ``scl_slope`` and ``scl_inter`` of the header
+            being folded into ``scale`` and ``offset`` rather than applied to the maps.
+        labels : str or list of str
+            Names of the regions, or text file holding them (see :func:`read_region_names`).
+        scale : float or None, optional
+            Factor turning the (scaled) values of the image into probabilities. See
+            :class:`ProbabilisticAtlas`.
+        cache_dir : str or None, optional
+            Cache directory. See :func:`wheres_waldo.atlas.get_cache_dir`.
+
+        Returns
+        -------
+        atlas : ProbabilisticAtlas
+        """
+        if path.endswith(".gz"):
+            path = decompressed_sidecar(path, cache_dir)
+        img = nib.load(path, mmap=True)
+        if isinstance(labels, str):
+            labels = read_region_names(labels)
+        # Applying the scaling would load the whole atlas in memory
+        maps = img.dataobj.get_unscaled()
+        slope, inter = float(img.dataobj.slope), float(img.dataobj.inter)
+        if (slope, inter) == (1.0, 0.0):
+            return cls(maps, img.affine, labels, scale)
+        # Scaled images hold real values, probabilities unless stated otherwise
+        scale = 1.0 if scale is None else scale
+        return cls(maps, img.affine, labels, scale * slope, scale * inter)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(n_regions={len(self.labels)})"
+
+    def __len__(self):
+        return len(self.labels)
+
+    def probabilities(self, coords):
+        """
+        Interpolate the probability of every region at a batch of coordinates.
+
+        Probabilities are interpolated trilinearly, with one gather of the 8 voxels
+        surrounding all points across all regions, rather than one interpolation of each
+        3D map. Voxels outside of the atlas have a probability of 0.
+
+        Parameters
+        ----------
+        coords : (n, 3) array_like
+            World coordinates, in the space of the atlas.
+
+        Returns
+        -------
+        probabilities : (n, n_regions) numpy.ndarray
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        voxels = coords @ self._inverse[:3, :3].T + self._inverse[:3, 3]
+        base = np.floor(voxels).astype(np.intp)
+        fractions = voxels - base
+
+        # (n, 8, 3) neighbouring voxels and (n, 8) trilinear weights
+        neighbours = base[:, None, :] + _CORNERS
+        weights = np.where(_CORNERS, fractions[:, None, :], 1 - fractions[:, None, :]).prod(axis=2)
+        shape = np.array(self.maps.shape[:3])
+        inside = ((neighbours >= 0) & (neighbours < shape)).all(axis=2)
+        weights[~inside] = 0
+        neighbours = np.clip(neighbours, 0, shape - 1)
+
+        values = self.maps[neighbours[..., 0], neighbours[..., 1], neighbours[..., 2]]
+        probabilities = self.scale * np.einsum("nc,ncr->nr", weights, values)
+        if self.offset:
+            probabilities += self.offset * weights.sum(axis=1, keepdims=True)
+        return probabilities
+
+    def sample(self, coords, top_k=3, chunk_size=4096):
+        """
+        Find the most probable regions at a batch of coordinates.
+
+        Parameters
+        ----------
+        coords : (n, 3) array_like
+            World coordinates, in the space of the atlas.
+        top_k : int, optional
+            Number of regions reported per coordinate. Default is 3.
+        chunk_size : int, optional
+            Number of coordinates interpolated at once, bounding the memory used to
+            ``chunk_size * 8 * n_regions`` values. Default is 4096.
+
+        Returns
+        -------
+        result : dict of numpy.ndarray
+            ``label`` (names of the regions, empty for zero probabilities) and
+            ``probability``, both of shape ``(n, top_k)``, by decreasing probability.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        top_k = min(top_k, len(self.labels))
+        regions = np.empty((len(coords), top_k), dtype=np.intp)
+        probabilities = np.empty((len(coords), top_k))
+        for start in range(0, len(coords), chunk_size):
+            chunk = self.probabilities(coords[start : start + chunk_size])
+            top = np.argpartition(-chunk, top_k - 1, axis=1)[:, :top_k]
+            order = np.argsort(-np.take_along_axis(chunk, top, axis=1), axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            regions[start : start + len(chunk)] = top
+            probabilities[start : start + len(chunk)] = np.take_along_axis(chunk, top, axis=1)
+
+        labels = self.labels[regions]
+        labels[probabilities <= 0] = ""
+        return {"label": labels, "probability": probabilities}
+
+
+def _main(argv=None):
+    options = vars(_get_parser().parse_args(argv))
+    setup_logging(quiet=options.pop("quiet"), log_json=options.pop("log_json"))
+    atlas = ProbabilisticAtlas.load(options["atlas"], options["labels"])
+    coordinates = pd.read_csv(options["coordinates"])
+    result = atlas.sample(coordinates[["x", "y", "z"]].to_numpy(), options["top_k"])
+
+    for rank in range(result["label"].shape[1]):
+        coordinates[f"label_{rank + 1}"] = result["label"][:, rank]
+        coordinates[f"probability_{rank + 1}"] = result["probability"][:, rank]
+    LGR.info("Saving results to %s...", options["output"])
+    coordinates.to_csv(options["output"], index=False)
@@ -0,0 +1,162 @@
+"""Lightweight per-stage timing and memory instrumentation."""
+import json
+import sys
+import time
+import tracemalloc
+
+
+class _NullSpan:
+    """Span of a disabled profiler: a shared object on which everything is a no-op."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def rows(self):
+        return None
+
+    @rows.setter
+    def rows(self, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """
+    Instrumented section of code, used as a context manager.
+
+    Attributes
+    ----------
+    name : str
+    rows : int or None
+        Number of items processed in the span, to be set by the instrumented code.
+    wall, cpu : float
+        Wall and CPU (process) time spent in the span, in seconds.
+    allocated : int
+        Net memory allocated in the span and still alive at its end, in bytes.
+    peak : int
+        Peak of traced memory during the span, in bytes.
+    error : str or None
+        Name of the exception raised in the span, if any.
+    """
+
+    __slots__ = ("name", "rows", "wall", "cpu", "allocated", "peak", "error", "_start")
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.wall = self.cpu = 0.0
+        self.allocated = self.peak = 0
+        self.error = None
+        self._start = None
+
+    def __enter__(self):
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self._start = (
+            time.perf_counter(),
+            time.process_time(),
+            tracemalloc.get_traced_memory()[0],
+        )
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        wall, cpu, memory = self._start
+        self.wall = time.perf_counter() - wall
+        self.cpu = time.process_time() - cpu
+        current, self.peak = tracemalloc.get_traced_memory()
+        self.allocated = current - memory
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        return False
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "wall_s": self.wall,
+            "cpu_s": self.cpu,
+            "allocated_bytes": self.allocated,
+            "peak_bytes": self.peak,
+            "rows": self.rows,
+            "error": self.error,
+        }
+
+
+class Profiler:
+    """
+    Collect :class:`Span` measurements and report them as JSON.
+
+    When disabled, :meth:`span` returns a shared no-op object, so instrumented code pays
+    only for a method call per span. Used as a context manager, the profiler reports on
+    exit, including when the enclosed code raises.
+
+    Parameters
+    ----------
+    output : str or None, optional
+        Where to write the report: a file name, ``"-"`` for stderr, or None to disable
+        profiling. Default is None.
+
+    Examples
+    --------
+    >>> with Profiler("-") as profiler:
+    ...     with profiler.span("transform") as span:
+    ...         mni_coords = get_MNI_152(fs_coords)
+    ...         span.rows = len(mni_coords)
+    """
+
+    def __init__(self, output=None):
+        self.output = output
+        self.spans = []
+        self._started_tracemalloc = False
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    @property
+    def enabled(self):
+        return self.output is not None
+
+    def span(self, name, rows=None):
+        """Return a context manager measuring the enclosed code as stage ``name``."""
+        if not self.enabled:
+            return _NULL_SPAN
+        span = Span(name, rows)
+        self.spans.append(span)
+        return span
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.report()
+        return False
+
+    def report(self):
+        """Write the collected spans as JSON, and stop tracing memory allocations."""
+        if not self.enabled:
+            return
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+        spans = [span.to_dict() for span in self.spans]
+        report = {
+            "spans": spans,
+            "total": {
+                "wall_s": sum(span["wall_s"] for span in spans),
+                "cpu_s": sum(span["cpu_s"] for span in spans),
+            },
+        }
+        if self.output == "-":
+            json.dump(report, sys.stderr, indent=1)
+            sys.stderr.write("\n")
+        else:
+            with open(self.output, "w") as f:
+                json.dump(report, f, indent=1)
@@ -0,0 +1,262 @@
+"""Correlation of parcel maps with libraries of reference maps."""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import os.path as op
+
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+from wheres_waldo import __version__
+from wheres_waldo.atlas import get_cache_dir
+from wheres_waldo.downloads import atomic_write
+from wheres_waldo.logs import Progress, add_logging_arguments, setup_logging
+
+LGR = logging.getLogger(__name__)
+
+METHODS = ("pearson", "spearman")
+# Memory used by a chunk of standardized reference maps
+MAX_MEMORY = 256 << 20
+
+
+def _get_parser():
+    """
+    Parse command line inputs for this function.
+
+    Returns
+    -------
+    parser.parse_args() : argparse dict
+    """
+    parser = argparse.ArgumentParser(prog="waldo compare")
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group("Required Arguments:")
+
+    # Required arguments
+    required.add_argument(
+        "-i",
+        "--input",
+        help="CSV file(s) of query maps, with one row per parcel and one column per map.",
+        required=True,
+        type=str,
+        nargs="+",
+        dest="queries",
+    )
+    required.add_argument(
+        "-r",
+        "--references",
+        help=(
+            "Reference library (.npy file, see --library), or CSV file(s) of reference maps "
+            "with one row per parcel and one column per map."
+        ),
+        required=True,
+        type=str,
+        nargs="+",
+        dest="references",
+    )
+    required.add_argument(
+        "-o",
+        "--output",
+        help="Output file name.",
+        required=True,
+        type=str,
+        dest="output",
+    )
+    # Optional arguments
+    optional.add_argument(
+        "--method",
+        help="Correlation coefficient.",
+        required=False,
+        type=str,
+        default="pearson",
+        dest="method",
+        choices=METHODS,
+    )
+    optional.add_argument(
+        "--library",
+        help=(
+            "Where to store the library built from CSV reference maps, for later runs. "
+            "Defaults to the cache directory."
+        ),
+        required=False,
+        type=str,
+        default=None,
+        dest="library",
+    )
+    optional.add_argument(
+        "--max-memory",
+        help="Memory used by a chunk of reference maps, in MiB.",
+        required=False,
+        type=int,
+        default=MAX_MEMORY >> 20,
+        dest="max_memory",
+    )
+    add_logging_arguments(optional)
+    optional.add_argument("-v", "--version", action="version", version=("%(prog)s " + __version__))
+
+    parser._action_groups.append(optional)
+
+    return parser
+
+
+def read_maps(paths):
+    """
+    Read parcel maps from CSV files with one row per parcel and one column per map.
+
+    Returns
+    -------
+    maps : pandas.DataFrame
+        Columns of all files, side by side.
+    """
+    return pd.concat([pd.read_csv(path) for path in paths], axis=1)
+
+
+def build_library(paths, library):
+    """
+    Store reference maps as a single parcels×maps float32 matrix.
+
+    Maps are copied file by file into a memory-mapped ``.npy`` file, and their names are
+    stored in a ``.json`` sidecar.
+
+    Parameters
+    ----------
+    paths : list of str
+        CSV files with one row per parcel and one column per map.
+    library : str
+        Path of the ``.npy`` file.
+    """
+    names = []
+    n_parcels = None
+    for path in paths:
+        columns = pd.read_csv(path, nrows=0).columns
+        names += list(columns)
+        with open(path) as f:
+            n_rows = sum(1 for _ in f) - 1
+        if n_parcels is not None and n_rows != n_parcels:
+            raise ValueError(f"{path} has {n_rows} parcels, not {n_parcels}.")
+        n_parcels = n_rows
+
+    with atomic_write(f"{library}.json", "w") as f:
+        json.dump({"names": names}, f)
+    with atomic_write(library) as f:
+        matrix = np.lib.format.open_memmap(
+            f.name, mode="w+", dtype=np.float32, shape=(n_parcels, len(names))
+        )
+        start = 0
+        for path in paths:
+            maps = pd.read_csv(path).to_numpy(dtype=np.float32)
+            matrix[:, start : start + maps.shape[1]] = maps
+            start += maps.shape[1]
+        matrix.flush()
+        del matrix
+
+
+def load_library(references, library=None, cache_dir=None):
+    """
+    Load a library of reference maps, building it in the cache from CSV files if needed.
+
+    Parameters
+    ----------
+    references : str or list of str
+        ``.npy`` library (see :func:`build_library`), or CSV files of reference maps.
+    library : str or None, optional
+        Where to build the library from CSV files. By default, it is built in the cache
+        directory, keyed by the paths, sizes and modification times of the files.
+    cache_dir : str or None, optional
+        Cache directory. See :func:`wheres_waldo.atlas.get_cache_dir`.
+
+    Returns
+    -------
+    matrix : (n_parcels, n_maps) numpy.memmap of float32
+    names : list of str
+    """
+    if isinstance(references, str):
+        references = [references]
+    if len(references) == 1 and references[0].endswith(".npy"):
+        library = references[0]
+    elif library is not None:
+        LGR.info("Building a library of reference maps in %s...", library)
+        build_library(references, library)
+    else:
+        key = hashlib.sha1()
+        for path in references:
+            stat = os.stat(path)
+            key.update(f"{op.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        directory = op.join(get_cache_dir(cache_dir), "references")
+        os.makedirs(directory, exist_ok=True)
+        library = op.join(directory, f"{key.hexdigest()[:16]}.npy")
+        if not op.isfile(library):
+            LGR.info("Building a library of reference maps from %d file(s)...", len(references))
+            build_library(references, library)
+
+    with open(f"{library}.json") as f:
+        names = json.load(f)["names"]
+    return np.load(library, mmap_mode="r"), names
+
+
+def _standardize(maps, method):
+    """Center and scale each column to unit norm, after ranking it for Spearman."""
+    maps = np.asarray(maps, dtype=np.float64)
+    if method == "spearman":
+        maps = rankdata(maps, axis=0)
+    maps = maps - maps.mean(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return maps / np.linalg.norm(maps, axis=0)
+
+
+def correlate_maps(queries, references, method="pearson", max_memory=MAX_MEMORY):
+    """
+    Correlate a batch of query maps with every map of a reference library.
+
+    Query and reference maps are standardized, so that all correlations of a chunk of
+    references are one matrix product. References are read by chunks of at most
+    ``max_memory`` bytes, so the library may exceed the available memory.
+
+    Parameters
+    ----------
+    queries : (n_parcels, n_queries) array_like
+    references : (n_parcels, n_maps) array_like
+        E.g. a memory-mapped library (see :func:`load_library`).
+    method : {"pearson", "spearman"}, optional
+        Default is "pearson".
+    max_memory : int, optional
+        Memory used by a chunk of standardized references, in bytes. Default is 256 MiB.
+
+    Returns
+    -------
+    correlations : (n_queries, n_maps) numpy.ndarray
+        NaN for constant maps.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, not {method!r}.")
+    queries = np.asarray(queries).reshape(len(queries), -1)
+    if len(queries) != references.shape[0]:
+        raise ValueError(
+            f"Query maps have {len(queries)} parcels, but reference maps have "
+            f"{references.shape[0]}."
+        )
+    queries = _standardize(queries, method)
+
+    n_maps = references.shape[1]
+    chunk_size = max(1, max_memory // (8 * references.shape[0]))
+    correlations = np.empty((queries.shape[1], n_maps))
+    with Progress(n_maps, "Reference maps", LGR) as progress:
+        for start in range(0, n_maps, chunk_size):
+            chunk = _standardize(references[:, start : start + chunk_size], method)
+            correlations[:, start : start + chunk.shape[1]] = queries.T @ chunk
+            progress.update(chunk.shape[1])
+    return correlations
+
+
+def _main(argv=None):
+    options = vars(_get_parser().parse_args(argv))
+    setup_logging(quiet=options.pop("quiet"), log_json=options.pop("log_json"))
+    queries = read_maps(options["queries"])
+    references, names = load_library(options["references"], options["library"])
+    correlations = correlate_maps(
+        queries.to_numpy(), references, options["method"], options["max_memory"] << 20
+    )
+    LGR.info("Saving results to %s...", options["output"])
+    pd.DataFrame(correlations, index=queries.columns, columns=names).to_csv(options["output"])
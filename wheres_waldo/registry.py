@@ -0,0 +1,87 @@
+"""Process-wide registry of loaded parcellations."""
+import threading
+
+from wheres_waldo.atlas import cached_checksum, centroid_url, fetch_file
+from wheres_waldo.parcellation import Parcellation
+
+_LOCK = threading.Lock()
+# (n_parcels, n_networks, checksum of the centroid table) to loaded parcellation
+_REGISTRY = {}
+# (n_parcels, n_networks, checksum of the centroid table) to the load in progress
+_IN_FLIGHT = {}
+
+
+class _Flight:
+    """Load in progress, awaited by the threads that did not start it."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def get_parcellation(n_parcels=100, n_networks=7, cache_dir=None):
+    """
+    Return the parcellation of a Schaefer variant, loading it at most once per process.
+
+    Loading is single-flight: when several threads request a variant that is not loaded
+    yet, only the first one loads it while the others wait for its result. The returned
+    parcellation is shared between all callers, and its arrays are read-only.
+
+    Parcellations are keyed by the checksum of their cached centroid table, so that the
+    variant is loaded again once the table is updated on the server (see
+    :func:`wheres_waldo.atlas.fetch_file`).
+
+    Parameters
+    ----------
+    n_parcels : int, optional
+        Number of Schaefer parcels. Default is 100.
+    n_networks : int, optional
+        Number of Yeo networks. Default is 7.
+    cache_dir : str or None, optional
+        Cache directory. See :func:`wheres_waldo.atlas.get_cache_dir`.
+
+    Returns
+    -------
+    parcellation : Parcellation
+    """
+    path = fetch_file(centroid_url(n_parcels, n_networks), cache_dir)
+    key = (n_parcels, n_networks, cached_checksum(path))
+    with _LOCK:
+        parcellation = _REGISTRY.get(key)
+        if parcellation is not None:
+            return parcellation
+        flight = _IN_FLIGHT.get(key)
+        leader = flight is None
+        if leader:
+            flight = _IN_FLIGHT[key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = Parcellation.from_csv(path, n_networks).freeze()
+    except BaseException as error:
+        flight.error = error
+        raise
+    finally:
+        with _LOCK:
+            if flight.error is None:
+                # Forget the versions of the variant loaded before the update
+                for stale in [other for other in _REGISTRY if other[:2] == key[:2]]:
+                    del _REGISTRY[stale]
+                _REGISTRY[key] = flight.result
+            del _IN_FLIGHT[key]
+        flight.done.set()
+    return flight.result
+
+
+def clear_registry():
+    """Forget all loaded parcellations, e.g. to release their memory."""
+    with _LOCK:
+        _REGISTRY.clear()
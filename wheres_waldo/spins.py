@@ -0,0 +1,242 @@
+"""Spin-test null models for parcel-level maps."""
+import logging
+import os
+import os.path as op
+
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.spatial import cKDTree
+
+from wheres_waldo.atlas import get_cache_dir, remove_stale, variant_name
+from wheres_waldo.downloads import atomic_write
+from wheres_waldo.surface import (
+    HEMISPHERES,
+    labels_digest,
+    load_mesh,
+    load_surface_labels,
+    surfaces_digest,
+)
+
+LGR = logging.getLogger(__name__)
+
+# Reflection across the midsagittal plane, mapping left-hemisphere rotations to the right
+_FLIP = np.diag([-1.0, 1.0, 1.0])
+
+
+def random_rotations(n_rotations, seed=None):
+    """
+    Draw uniformly distributed random 3D rotations.
+
+    Parameters
+    ----------
+    n_rotations : int
+    seed : int, numpy.random.Generator or None, optional
+        Seed of the random number generator.
+
+    Returns
+    -------
+    rotations : (n_rotations, 3, 3) numpy.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    # QR decomposition of Gaussian matrices, with the signs fixed to get the Haar measure
+    q, r = np.linalg.qr(rng.standard_normal((n_rotations, 3, 3)))
+    q = q * np.sign(np.diagonal(r, axis1=1, axis2=2))[:, None, :]
+    # Turn improper rotations (reflections) into proper ones
+    q[np.linalg.det(q) < 0, :, 0] *= -1
+    return q
+
+
+def sphere_centroids(spheres, n_parcels=100, n_networks=7, mesh="fsaverage", cache_dir=None):
+    """
+    Compute the centroids of the parcels on the spherical surfaces of both hemispheres.
+
+    Parameters
+    ----------
+    spheres : dict
+        Spherical surface (e.g. ``lh.sphere``) of each hemisphere (``lh`` and ``rh``), on
+        ``mesh``. See :func:`wheres_waldo.surface.load_mesh`.
+    n_parcels, n_networks, mesh, cache_dir
+        See :func:`wheres_waldo.surface.load_surface_labels`.
+
+    Returns
+    -------
+    centroids : (n_parcels, 3) numpy.ndarray
+        Centroids projected back onto the sphere, indexed by rows of the centroid table.
+        Parcels missing from the mesh are NaN.
+    hemispheres : (n_parcels,) numpy.ndarray of str
+        Hemisphere (``lh`` or ``rh``) in which each parcel was found.
+    """
+    centroids = np.full((n_parcels, 3), np.nan)
+    hemispheres = np.full(n_parcels, "", dtype="<U2")
+    for hemi in HEMISPHERES:
+        labels = np.asarray(load_surface_labels(n_parcels, n_networks, mesh, hemi, cache_dir))
+        coords = load_mesh(spheres[hemi])
+        coords = coords - coords.mean(axis=0)
+        radius = np.linalg.norm(coords, axis=1).mean()
+
+        counts = np.bincount(labels, minlength=n_parcels + 1)[1:]
+        sums = np.stack(
+            [np.bincount(labels, weights=coords[:, i], minlength=n_parcels + 1) for i in range(3)],
+            axis=1,
+        )[1:]
+        # ROI Labels are the rows of the centroid table + 1
+        rows = np.flatnonzero(counts)
+        means = sums[rows] / counts[rows, None]
+        centroids[rows] = radius * means / np.linalg.norm(means, axis=1, keepdims=True)
+        hemispheres[rows] = hemi
+    return centroids, hemispheres
+
+
+def _spin_chunk(centroids, hemispheres, rotations):
+    """Match the rotated centroids of each hemisphere to the closest original centroids."""
+    perms = np.tile(np.arange(len(centroids), dtype=np.int32), (len(rotations), 1))
+    for hemi in HEMISPHERES:
+        rows = np.flatnonzero(hemispheres == hemi)
+        if not rows.size:
+            continue
+        hemi_rotations = rotations if hemi == "lh" else _FLIP @ rotations @ _FLIP
+        # (n_rotations, n_rows, 3) rotated centroids, queried all at once
+        rotated = np.einsum("rij,nj->rni", hemi_rotations, centroids[rows])
+        _, nearest = cKDTree(centroids[rows]).query(rotated.reshape(-1, 3))
+        perms[:, rows] = rows[nearest].reshape(len(rotations), rows.size)
+    return perms
+
+
+def spin_permutations(
+    spheres,
+    n_perm=1000,
+    seed=0,
+    n_parcels=100,
+    n_networks=7,
+    mesh="fsaverage",
+    cache_dir=None,
+    n_jobs=1,
+):
+    """
+    Generate spin-test permutations of the parcels, using an on-disk cache.
+
+    Each permutation rotates the parcel centroids on the sphere by a random rotation
+    (mirrored for the right hemisphere) and reassigns each parcel to the closest original
+    centroid of the same hemisphere. Rotations are drawn in one batch, and matched by
+    chunks in parallel. Permutations are cached as int16 ``.npy`` files per variant,
+    mesh, spheres, ``n_perm`` and ``seed``, memory-mapped on later calls, and rebuilt when
+    the label files or centroid table are updated.
+
+    Parameters
+    ----------
+    spheres : dict
+        Spherical surface of each hemisphere. See :func:`sphere_centroids`.
+    n_perm : int, optional
+        Number of permutations. Default is 1000.
+    seed : int, optional
+        Seed of the random rotations. Default is 0.
+    n_parcels, n_networks, mesh, cache_dir
+        See :func:`wheres_waldo.surface.load_surface_labels`.
+    n_jobs : int, optional
+        Number of parallel jobs. Default is 1.
+
+    Returns
+    -------
+    perms : (n_perm, n_parcels) numpy.memmap of int16
+        ``perms[i, j]`` is the row of the parcel whose value parcel ``j`` takes in the
+        ``i``-th null map, i.e. null maps are ``data[perms]``. Parcels missing from the mesh
+        are left in place.
+    """
+    directory = op.join(get_cache_dir(cache_dir), "spins")
+    os.makedirs(directory, exist_ok=True)
+    path = op.join(
+        directory,
+        f"{variant_name(n_parcels, n_networks)}_{mesh}_{surfaces_digest(spheres)}_"
+        f"{n_perm}perm_seed{seed}_{labels_digest(n_parcels, n_networks, mesh, cache_dir)}.npy",
+    )
+    if op.isfile(path):
+        return np.load(path, mmap_mode="r")
+
+    centroids, hemispheres = sphere_centroids(spheres, n_parcels, n_networks, mesh, cache_dir)
+    rotations = random_rotations(n_perm, seed)
+    LGR.info("Matching %d spun parcellations...", n_perm)
+    chunks = np.array_split(rotations, min(n_perm, 4 * max(n_jobs, 1)))
+    perms = np.concatenate(
+        Parallel(n_jobs=n_jobs)(
+            delayed(_spin_chunk)(centroids, hemispheres, chunk) for chunk in chunks
+        )
+    ).astype(np.int16)
+
+    with atomic_write(path) as f:
+        np.save(f, perms)
+    remove_stale(path)
+    return np.load(path, mmap_mode="r")
+
+
+def _null_chunk(statistic, data, perms, args):
+    return statistic(data[perms], *args)
+
+
+def null_distribution(statistic, data, perms, *args, n_jobs=1, chunk_size=256):
+    """
+    Evaluate a statistic on spun versions of a parcel map.
+
+    Parameters
+    ----------
+    statistic : callable
+        Called as ``statistic(null_maps, *args)`` with a ``(n, n_parcels)`` array of null
+        maps, and returning ``n`` values.
+    data : (n_parcels,) array_like
+        Parcel map.
+    perms : (n_perm, n_parcels) array_like of int
+        Permutations, see :func:`spin_permutations`.
+    *args
+        Additional arguments of ``statistic``.
+    n_jobs : int, optional
+        Number of worker processes. Default is 1.
+    chunk_size : int, optional
+        Number of null maps per call of ``statistic``. Default is 256.
+
+    Returns
+    -------
+    nulls : (n_perm,) numpy.ndarray
+    """
+    data = np.asarray(data)
+    chunks = [perms[start : start + chunk_size] for start in range(0, len(perms), chunk_size)]
+    return np.concatenate(
+        Parallel(n_jobs=n_jobs)(
+            delayed(_null_chunk)(statistic, data, np.asarray(chunk), args) for chunk in chunks
+        )
+    )
+
+
+def _correlations(x, y):
+    """Pearson correlation of each row of ``x`` with ``y``."""
+    x = x - x.mean(axis=-1, keepdims=True)
+    y = y - y.mean()
+    return x @ y / (np.linalg.norm(x, axis=-1) * np.linalg.norm(y))
+
+
+def spin_test(x, y, perms, n_jobs=1):
+    """
+    Test the correlation of two parcel maps against spin-test nulls.
+
+    Parameters
+    ----------
+    x, y : (n_parcels,) array_like
+        Parcel maps. ``x`` is spun.
+    perms : (n_perm, n_parcels) array_like of int
+        Permutations, see :func:`spin_permutations`.
+    n_jobs : int, optional
+        Number of worker processes. Default is 1.
+
+    Returns
+    -------
+    r : float
+        Pearson correlation of ``x`` and ``y``.
+    p : float
+        Two-sided p-value.
+    nulls : (n_perm,) numpy.ndarray
+        Null correlations.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    r = _correlations(x, y)
+    nulls = null_distribution(_correlations, x, perms, y, n_jobs=n_jobs)
+    p = (1 + np.sum(np.abs(nulls) >= np.abs(r))) / (1 + len(nulls))
+    return float(r), float(p), nulls
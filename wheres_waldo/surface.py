@@ -0,0 +1,287 @@
+"""Surface-space Schaefer parcellations on fsaverage and fsLR meshes."""
+import hashlib
+import os
+import os.path as op
+
+import nibabel as nib
+import numpy as np
+from scipy.spatial import cKDTree
+
+from wheres_waldo.atlas import (
+    GH_URL,
+    centroid_url,
+    fetch_file,
+    get_cache_dir,
+    remove_stale,
+    source_digest,
+    variant_name,
+)
+from wheres_waldo.downloads import atomic_write, file_checksum
+from wheres_waldo.registry import get_parcellation
+
+MESHES = ("fsaverage", "fsaverage5", "fsaverage6", "fslr32k")
+HEMISPHERES = ("lh", "rh")
+
+
+def get_surface_url():
+    """
+    Return the base URL of the Schaefer parcellation files.
+
+    The ``WALDO_SURFACE_URL`` environment variable overrides the CBIG GitHub repository.
+    """
+    default = GH_URL.rsplit("/", 1)[0]
+    return os.environ.get("WALDO_SURFACE_URL", default).rstrip("/")
+
+
+def _check(mesh, hemi):
+    if mesh not in MESHES:
+        raise ValueError(f"mesh must be one of {MESHES}, not {mesh!r}.")
+    if hemi not in HEMISPHERES:
+        raise ValueError(f"hemi must be one of {HEMISPHERES}, not {hemi!r}.")
+
+
+def surface_labels_url(n_parcels=100, n_networks=7, mesh="fsaverage", hemi="lh"):
+    """
+    Return the URL of the surface label file of a Schaefer variant.
+
+    FreeSurfer meshes use ``.annot`` files, and fsLR uses GIFTI label files.
+    """
+    _check(mesh, hemi)
+    name = variant_name(n_parcels, n_networks)
+    if mesh == "fslr32k":
+        return f"{get_surface_url()}/HCP/fslr32k/gifti/{name}_{hemi}.label.gii"
+    return f"{get_surface_url()}/FreeSurfer5.3/{mesh}/label/{hemi}.{name}.annot"
+
+
+def read_surface_labels(path):
+    """
+    Read a FreeSurfer ``.annot`` or GIFTI label file.
+
+    Returns
+    -------
+    labels : (n_vertices,) numpy.ndarray of int
+        Key of the label of each vertex.
+    names : dict
+        Name of each key.
+    """
+    if path.endswith(".gii"):
+        img = nib.load(path)
+        return np.asarray(img.darrays[0].data), img.labeltable.get_labels_as_dict()
+    labels, _, names = nib.freesurfer.read_annot(path)
+    return labels, {key: name.decode() for key, name in enumerate(names)}
+
+
+def load_surface_labels(n_parcels=100, n_networks=7, mesh="fsaverage", hemi="lh", cache_dir=None):
+    """
+    Load the parcel of each vertex of a hemisphere, using an on-disk cache.
+
+    Label files number parcels per hemisphere; they are converted to the ``ROI Label`` of
+    the centroid table by name, and cached as int16 ``.npy`` files memory-mapped on later
+    calls. Cached labels are keyed by the checksums of the label file and centroid table,
+    so that they are rebuilt when either is updated.
+
+    Parameters
+    ----------
+    n_parcels : int, optional
+        Number of Schaefer parcels. Default is 100.
+    n_networks : int, optional
+        Number of Yeo networks. Default is 7.
+    mesh : {"fsaverage", "fsaverage5", "fsaverage6", "fslr32k"}, optional
+        Default is "fsaverage".
+    hemi : {"lh", "rh"}, optional
+        Default is "lh".
+    cache_dir : str or None, optional
+        Cache directory. See :func:`wheres_waldo.atlas.get_cache_dir`.
+
+    Returns
+    -------
+    labels : (n_vertices,) numpy.memmap of int16
+        ``ROI Label`` of each vertex, 0 on the medial wall.
+    """
+    _check(mesh, hemi)
+    directory = op.join(get_cache_dir(cache_dir), "surface")
+    os.makedirs(directory, exist_ok=True)
+    source = fetch_file(surface_labels_url(n_parcels, n_networks, mesh, hemi), cache_dir)
+    centroids = fetch_file(centroid_url(n_parcels, n_networks), cache_dir)
+    path = op.join(
+        directory,
+        f"{variant_name(n_parcels, n_networks)}_{mesh}_{hemi}_"
+        f"{source_digest(source, centroids)}.npy",
+    )
+
+    if not op.isfile(path):
+        keys, names = read_surface_labels(source)
+        parcellation = get_parcellation(n_parcels, n_networks, cache_dir)
+        by_name = dict(zip(parcellation.names, parcellation.labels))
+        lut = np.zeros(max(max(names), keys.max()) + 1, dtype=np.int16)
+        for key, name in names.items():
+            lut[key] = by_name.get(name, 0)
+        # Unlabeled vertices are -1 in .annot files
+        labels = np.where(keys >= 0, lut[keys], 0).astype(np.int16)
+
+        with atomic_write(path) as f:
+            np.save(f, labels)
+        remove_stale(path)
+
+    return np.load(path, mmap_mode="r")
+
+
+def load_mesh(surface):
+    """
+    Return the vertex coordinates of a surface.
+
+    Parameters
+    ----------
+    surface : str or (n_vertices, 3) array_like
+        FreeSurfer geometry file (e.g. ``lh.pial``), GIFTI surface, or coordinates.
+
+    Returns
+    -------
+    coords : (n_vertices, 3) numpy.ndarray of float64
+    """
+    if not isinstance(surface, str):
+        return np.asarray(surface, dtype=np.float64).reshape(-1, 3)
+    return load_geometry(surface)[0]
+
+
+def load_geometry(path):
+    """
+    Read the vertices and triangles of a FreeSurfer geometry or GIFTI surface file.
+
+    Returns
+    -------
+    coords : (n_vertices, 3) numpy.ndarray of float64
+    faces : (n_faces, 3) numpy.ndarray of int
+    """
+    if path.endswith(".gii"):
+        coords, faces = nib.load(path).agg_data(("pointset", "triangle"))
+    else:
+        coords, faces = nib.freesurfer.read_geometry(path)
+    return np.asarray(coords, dtype=np.float64), np.asarray(faces, dtype=np.intp)
+
+
+def surfaces_digest(surfaces):
+    """Return a short digest of the contents of the surface files of both hemispheres."""
+    digest = hashlib.sha1()
+    for hemi in HEMISPHERES:
+        digest.update(file_checksum(surfaces[hemi]).encode())
+    return digest.hexdigest()[:16]
+
+
+def labels_digest(n_parcels=100, n_networks=7, mesh="fsaverage", cache_dir=None):
+    """
+    Return a short digest of the label files of both hemispheres and of the centroid table.
+
+    Entries derived from the surface labels are keyed by this digest, so that they are
+    rebuilt when either file is updated (see :func:`wheres_waldo.atlas.source_digest`).
+    """
+    paths = [
+        fetch_file(surface_labels_url(n_parcels, n_networks, mesh, hemi), cache_dir)
+        for hemi in HEMISPHERES
+    ]
+    return source_digest(*paths, fetch_file(centroid_url(n_parcels, n_networks), cache_dir))
+
+
+class SurfaceParcellation:
+    """
+    Schaefer 2018 parcellation on a surface mesh, queried in batches.
+
+    Parcels are designated by their (0-based) row in the centroid table, as in
+    :class:`wheres_waldo.parcellation.Parcellation`, or -1 on the medial wall.
+
+    Parameters
+    ----------
+    parcellation : wheres_waldo.parcellation.Parcellation
+        Parcellation of the same variant, giving parcel names.
+    mesh : str
+        Name of the mesh, e.g. ``fsaverage5``.
+    labels : dict
+        ``ROI Label`` of each vertex, per hemisphere (``lh`` and ``rh``).
+    """
+
+    __slots__ = ("parcellation", "mesh", "labels", "_rows", "_trees")
+
+    def __init__(self, parcellation, mesh, labels):
+        self.parcellation = parcellation
+        self.mesh = mesh
+        self.labels = labels
+        # ROI Label to row of the centroid table
+        self._rows = np.full(max(parcellation.labels.max(), 0) + 1, -1, dtype=np.intp)
+        self._rows[parcellation.labels] = np.arange(parcellation.n_parcels)
+        self._trees = {}
+
+    @classmethod
+    def load(cls, n_parcels=100, n_networks=7, mesh="fsaverage", cache_dir=None):
+        """Load a Schaefer variant on ``mesh``. See :func:`load_surface_labels`."""
+        return cls(
+            get_parcellation(n_parcels, n_networks, cache_dir),
+            mesh,
+            {
+                hemi: load_surface_labels(n_parcels, n_networks, mesh, hemi, cache_dir)
+                for hemi in HEMISPHERES
+            },
+        )
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(n_parcels={self.parcellation.n_parcels}, "
+            f"n_networks={self.parcellation.n_networks}, mesh={self.mesh!r})"
+        )
+
+    def parcels(self, vertices, hemi):
+        """
+        Find the parcels of a batch of vertices.
+
+        Parameters
+        ----------
+        vertices : array_like of int
+            Vertex indices.
+        hemi : {"lh", "rh"}
+
+        Returns
+        -------
+        result : dict of numpy.ndarray
+            ``roi`` (row of the parcel in the centroid table, -1 on the medial wall),
+            ``label`` (``ROI Label``, 0 on the medial wall) and ``values`` (short name of
+            the parcel, empty on the medial wall).
+        """
+        _check(self.mesh, hemi)
+        labels = np.asarray(self.labels[hemi])[np.asarray(vertices, dtype=np.intp)]
+        rois = self._rows[labels]
+        names = np.where(rois >= 0, self.parcellation.short_names[rois], "")
+        return {"roi": rois, "label": labels, "values": names}
+
+    def nearest_vertices(self, coords, hemi, surface):
+        """
+        Find the closest vertices to a batch of coordinates, and their parcels.
+
+        Parameters
+        ----------
+        coords : (n, 3) array_like
+            Coordinates, in the space of ``surface``.
+        hemi : {"lh", "rh"}
+        surface : str or (n_vertices, 3) array_like
+            Surface of the hemisphere on the mesh of the parcellation (e.g. its ``pial`` or
+            ``white`` surface). See :func:`load_mesh`. The KD-tree of a surface file is
+            built once and reused.
+
+        Returns
+        -------
+        result : dict of numpy.ndarray
+            ``vertex`` and ``distance`` (in mm), with the columns of :meth:`parcels`.
+        """
+        _check(self.mesh, hemi)
+        key = (hemi, surface) if isinstance(surface, str) else None
+        tree = self._trees.get(key)
+        if tree is None:
+            vertices = load_mesh(surface)
+            if len(vertices) != len(self.labels[hemi]):
+                raise ValueError(
+                    f"The surface has {len(vertices)} vertices, but the {self.mesh} {hemi} "
+                    f"labels have {len(self.labels[hemi])}."
+                )
+            tree = cKDTree(vertices)
+            if key is not None:
+                self._trees[key] = tree
+        distance, vertex = tree.query(np.asarray(coords, dtype=np.float64).reshape(-1, 3))
+        return {"vertex": vertex, "distance": distance, **self.parcels(vertex, hemi)}
@@ -0,0 +1,83 @@
+"""Incremental writing of columnar tables to CSV or Parquet files."""
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
+
+from wheres_waldo.downloads import atomic_writer
+
+
+class TableWriter:
+    """
+    Append pandas DataFrames with the same columns to a CSV or Parquet file.
+
+    Chunks are written as they come, so that tables larger than memory can be produced
+    chunk by chunk. The file is written under a temporary name, and renamed once
+    :meth:`close` is called.
+
+    Parameters
+    ----------
+    path : str
+        Output file. Its format is given by its extension (``.csv``, ``.csv.gz`` or
+        ``.parquet``); Parquet requires the optional ``pyarrow`` package.
+
+    Examples
+    --------
+    >>> with TableWriter("edges.parquet") as writer:
+    ...     for chunk in chunks:
+    ...         writer.write(chunk)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = "parquet" if path.endswith(".parquet") else "csv"
+        if self.format == "parquet" and pq is None:
+            raise ImportError("Writing Parquet files requires the pyarrow package.")
+        with atomic_writer(path) as f:
+            self._tmp_path = f.name
+        self._writer = None
+        self._header = True
+
+    def write(self, table):
+        """Append a DataFrame to the file."""
+        if self.format == "parquet":
+            batch = pa.Table.from_pandas(table, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self._tmp_path, batch.schema)
+            self._writer.write_table(batch)
+        else:
+            # Appended chunks are separate gzip members, which form a valid gzip file
+            compression = "gzip" if self.path.endswith(".gz") else None
+            table.to_csv(
+                self._tmp_path,
+                mode="w" if self._header else "a",
+                header=self._header,
+                index=False,
+                compression=compression,
+            )
+            self._header = False
+
+    def close(self):
+        """Finish the file and move it into place."""
+        if self._writer is not None:
+            self._writer.close()
+        if self._header and self._writer is None:
+            # Nothing was written
+            os.remove(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            if self._writer is not None:
+                self._writer.close()
+            os.remove(self._tmp_path)
+        return False
@@ -0,0 +1,66 @@
+"""Fixtures shared by the tests: a local server standing in for the CBIG repository."""
+import threading
+
+import pytest
+
+from wheres_waldo.downloads import Session
+from wheres_waldo.tests.utils import (
+    AtlasHandler,
+    AtlasServer,
+    RangeHandler,
+    write_surface_atlas,
+)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Use an empty cache directory, with the default revalidation TTL."""
+    directory = tmp_path / "cache"
+    monkeypatch.setenv("WALDO_CACHE_DIR", str(directory))
+    monkeypatch.delenv("WALDO_CACHE_TTL", raising=False)
+    return str(directory)
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    """Directory served by :func:`atlas_server`."""
+    directory = tmp_path / "upstream"
+    directory.mkdir()
+    return str(directory)
+
+
+@pytest.fixture
+def atlas_server(upstream):
+    """Serve ``upstream``, with ``WALDO_ATLAS_URL`` pointing to the server."""
+    with AtlasServer(upstream, AtlasHandler) as server:
+        server.server.requests = []
+        yield server
+
+
+@pytest.fixture
+def range_server(upstream):
+    """Serve ``upstream`` like :func:`atlas_server`, also answering range requests."""
+    with AtlasServer(upstream, RangeHandler) as server:
+        server.server.requests = []
+        server.server.lock = threading.Lock()
+        server.server.served = 0
+        server.server.weak_etag = False
+        server.server.ranges = True
+        server.server.changed = False
+        server.server.fail_after = None
+        server.server.failures = 0
+        yield server
+
+
+@pytest.fixture
+def surface_atlas(atlas_server, upstream, tmp_path, monkeypatch):
+    """Toy fsaverage labels served by :func:`atlas_server`. See :func:`write_surface_atlas`."""
+    monkeypatch.setenv("WALDO_SURFACE_URL", atlas_server.url)
+    return write_surface_atlas(atlas_server, upstream, str(tmp_path))
+
+
+@pytest.fixture
+def session():
+    session = Session()
+    yield session
+    session.close()
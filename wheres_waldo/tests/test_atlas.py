@@ -0,0 +1,189 @@
+"""Tests for the atlas cache of wheres_waldo.atlas."""
+import gzip
+import logging
+import os
+import os.path as op
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from wheres_waldo import atlas
+from wheres_waldo.downloads import file_checksum
+from wheres_waldo.tests.utils import (
+    AtlasHandler,
+    AtlasServer,
+    age,
+    cached_metadata,
+    requests_to,
+    validators,
+    write_upstream,
+)
+
+
+def test_fetch_file_stores_validators(atlas_server, upstream, session):
+    url = atlas.centroid_url()
+    source = write_upstream(atlas_server, upstream, url, b"ROI Label,ROI Name,R,A,S\n")
+
+    path = atlas.fetch_file(url, session=session)
+    with open(path, "rb") as f:
+        assert f.read() == b"ROI Label,ROI Name,R,A,S\n"
+    assert len(requests_to(atlas_server)) == 1
+
+    metadata = cached_metadata(path)
+    etag, last_modified = validators(source)
+    assert metadata["url"] == url
+    assert metadata["etag"] == etag
+    assert metadata["last_modified"] == last_modified
+    assert metadata["sha256"] == file_checksum(source)
+    assert time.time() - metadata["checked"] < 60
+
+
+def test_fetch_file_respects_ttl(atlas_server, upstream, session):
+    url = atlas.centroid_url()
+    write_upstream(atlas_server, upstream, url, b"version 1\n")
+    path = atlas.fetch_file(url, session=session)
+    n_requests = len(atlas_server.server.requests)
+
+    # Checked less than a TTL ago: no request at all
+    age(path, 100)
+    assert atlas.fetch_file(url, session=session, ttl=200) == path
+    assert len(atlas_server.server.requests) == n_requests
+
+    # Checked more than a TTL ago: one conditional request
+    assert atlas.fetch_file(url, session=session, ttl=50) == path
+    assert len(atlas_server.server.requests) == n_requests + 1
+    # The revalidation restarted the TTL
+    assert atlas.fetch_file(url, session=session, ttl=50) == path
+    assert len(atlas_server.server.requests) == n_requests + 1
+
+
+def test_fetch_file_not_modified(atlas_server, upstream, session):
+    url = atlas.centroid_url()
+    write_upstream(atlas_server, upstream, url, b"version 1\n")
+    path = atlas.fetch_file(url, session=session)
+    stat = os.stat(path)
+    etag = cached_metadata(path)["etag"]
+    age(path, 100)
+
+    atlas.fetch_file(url, session=session, ttl=50)
+    _, _, headers = requests_to(atlas_server)[-1]
+    assert headers["If-None-Match"] == etag
+    assert "If-Modified-Since" in headers
+    # A 304 is a cache hit: the cached copy is not rewritten
+    assert os.stat(path).st_ino == stat.st_ino
+    assert os.stat(path).st_mtime_ns == stat.st_mtime_ns
+    assert time.time() - cached_metadata(path)["checked"] < 60
+
+
+def test_fetch_file_updated(atlas_server, upstream, session):
+    url = atlas.centroid_url()
+    source = write_upstream(atlas_server, upstream, url, b"version 1\n")
+    path = atlas.fetch_file(url, session=session)
+    age(path, 100)
+
+    write_upstream(atlas_server, upstream, url, b"version 2, corrected\n")
+    os.utime(source, (time.time() + 10, time.time() + 10))
+    atlas.fetch_file(url, session=session, ttl=50)
+    with open(path, "rb") as f:
+        assert f.read() == b"version 2, corrected\n"
+    metadata = cached_metadata(path)
+    assert metadata["sha256"] == file_checksum(source)
+    assert metadata["etag"] == validators(source)[0]
+
+
+def test_fetch_file_without_metadata(atlas_server, upstream, cache_dir, session):
+    url = atlas.centroid_url()
+    source = write_upstream(atlas_server, upstream, url, b"version 1\n")
+    # A copy placed in the cache by hand is revalidated against its modification time
+    os.makedirs(cache_dir)
+    shutil.copy(source, cache_dir)
+    path = atlas.fetch_file(url, session=session)
+
+    (request,) = atlas_server.server.requests
+    assert "If-Modified-Since" in request[2]
+    assert "If-None-Match" not in request[2]
+    assert cached_metadata(path)["sha256"] == file_checksum(source)
+
+
+def test_fetch_file_offline(upstream, session, caplog, monkeypatch):
+    with AtlasServer(upstream, AtlasHandler) as server:
+        server.server.requests = []
+        url = atlas.centroid_url()
+        write_upstream(server, upstream, url, b"version 1\n")
+        path = atlas.fetch_file(url, session=session)
+    age(path, 100)
+    etag = cached_metadata(path)["etag"]
+
+    # The server is gone: the cached copy is used, and the attempt is recorded
+    with caplog.at_level(logging.WARNING, logger="wheres_waldo.atlas"):
+        assert atlas.fetch_file(url, session=session, ttl=50) == path
+    assert "Could not revalidate" in caplog.text
+    metadata = cached_metadata(path)
+    assert time.time() - metadata["checked"] < 60
+    assert metadata["etag"] == etag
+
+    # Later uses within the TTL do not try the server again
+    def download(*args, **kwargs):
+        pytest.fail("The server was contacted within the TTL.")
+
+    monkeypatch.setattr(atlas, "download", download)
+    monkeypatch.setattr(atlas, "download_ranges", download)
+    for _ in range(3):
+        assert atlas.fetch_file(url, session=session, ttl=50) == path
+
+
+def test_get_cache_ttl(monkeypatch):
+    assert atlas.get_cache_ttl(10) == 10
+    monkeypatch.setenv("WALDO_CACHE_TTL", "inf")
+    assert atlas.get_cache_ttl() == float("inf")
+    monkeypatch.delenv("WALDO_CACHE_TTL")
+    assert atlas.get_cache_ttl() == atlas.CACHE_TTL
+
+
+def test_cache_dir(cache_dir):
+    assert atlas.get_cache_dir() == cache_dir
+    assert op.isdir(cache_dir)
+
+
+def test_decompressed_sidecar_threads(tmp_path):
+    data = os.urandom(4 << 20)
+    source = str(tmp_path / "labels.nii.gz")
+    with gzip.open(source, "wb") as f:
+        f.write(data)
+
+    # Threads building the sidecar of a cold cache at once each write a file of their own
+    barrier = threading.Barrier(8)
+
+    def build(_):
+        barrier.wait()
+        return atlas.decompressed_sidecar(source)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sidecars = set(executor.map(build, range(8)))
+    (sidecar,) = sidecars
+    with open(sidecar, "rb") as f:
+        assert f.read() == data
+    name = op.basename(sidecar)
+    assert name.endswith("_labels.nii")
+    assert sorted(os.listdir(op.dirname(sidecar))) == [name, f"{name}.json"]
+
+
+def test_decompressed_sidecar_same_name(tmp_path):
+    # Atlases with the same file name in different directories do not share a sidecar
+    sources = []
+    for directory in ("first", "second"):
+        (tmp_path / directory).mkdir()
+        sources.append(str(tmp_path / directory / "labels.nii.gz"))
+        with gzip.open(sources[-1], "wb") as f:
+            f.write(directory.encode())
+
+    sidecars = [atlas.decompressed_sidecar(source) for source in sources]
+    assert sidecars[0] != sidecars[1]
+    for _ in range(2):
+        for sidecar, expected in zip(sidecars, (b"first", b"second")):
+            with open(sidecar, "rb") as f:
+                assert f.read() == expected
+        assert [atlas.decompressed_sidecar(source) for source in sources] == sidecars
@@ -0,0 +1,76 @@
+"""Tests for the cluster tables of wheres_waldo.clusters."""
+import nibabel as nib
+import numpy as np
+import pytest
+
+from wheres_waldo import atlas, clusters, registry
+from wheres_waldo.gzindex import build_index
+from wheres_waldo.tests.utils import (
+    AFFINE,
+    SHAPE,
+    update,
+    write_centroids,
+    write_labels,
+)
+
+
+@pytest.fixture
+def stat_path(atlas_server, upstream, tmp_path):
+    """4D gzipped map of two volumes, the second one with a cluster of 8 voxels."""
+    clusters._atlas_on_grid.cache_clear()
+    registry.clear_registry()
+    write_labels(atlas_server, upstream, 7, np.arange(np.prod(SHAPE)).reshape(SHAPE) % 101)
+    write_centroids(atlas_server, upstream, 7, "Vis")
+    data = np.zeros(SHAPE + (2,), dtype=np.float32)
+    data[:2, :2, :2, 1] = 5
+    path = str(tmp_path / "zstat.nii.gz")
+    nib.save(nib.Nifti1Image(data, AFFINE), path)
+    yield path
+    clusters._atlas_on_grid.cache_clear()
+    registry.clear_registry()
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_cluster_table_volume(stat_path, indexed):
+    if indexed:
+        pytest.importorskip("indexed_gzip")
+        build_index(stat_path, spacing=1 << 16)
+
+    table = clusters.cluster_table(stat_path, 3, volume=1)
+    assert table.shape[0] == 1
+    assert table.loc[0, "n_voxels"] == 8
+    assert table.loc[0, "peak_value"] == 5
+    assert clusters.cluster_table(stat_path, 3, volume=0).empty
+
+    with pytest.raises(ValueError, match="must be 3D"):
+        clusters.cluster_table(stat_path, 3)
+
+
+@pytest.mark.parametrize("n_jobs", [1, -1])
+def test_cluster_tables(stat_path, tmp_path, n_jobs):
+    data = np.zeros(SHAPE, dtype=np.float32)
+    data[3:, 3:, 3:] = -4
+    other = str(tmp_path / "other.nii")
+    nib.save(nib.Nifti1Image(data, AFFINE), other)
+
+    table = clusters.cluster_tables([stat_path, other], 3, n_jobs=n_jobs, two_sided=True, volume=1)
+    assert table["map"].tolist() == [0, 1]
+    assert table["sign"].tolist() == [1, -1]
+    assert table["n_voxels"].tolist() == [8, 60]
+
+    # No maps: no clusters, with the same columns
+    empty = clusters.cluster_tables([], 3, n_jobs=n_jobs)
+    assert empty.empty
+    assert empty.dtypes.to_dict() == table.dtypes.to_dict()
+
+
+def test_cluster_table_follows_updates(atlas_server, upstream, stat_path):
+    peak_roi = clusters.cluster_table(stat_path, 3, volume=1).loc[0, "peak_roi"]
+    assert "_Vis_" in peak_roi
+
+    write_centroids(atlas_server, upstream, 7, "Default")
+    write_labels(atlas_server, upstream, 7, np.full(SHAPE, 100))
+    update(atlas.centroid_url(), atlas.labels_url())
+    table = clusters.cluster_table(stat_path, 3, volume=1)
+    assert table.loc[0, "peak_roi"] == "RH_Default_100"
+    assert table.loc[0, "rois"] == "RH_Default_100 (100.0%)"
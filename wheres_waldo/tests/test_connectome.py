@@ -0,0 +1,75 @@
+"""Tests for the connectivity-matrix annotations of wheres_waldo.connectome."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from wheres_waldo import connectome
+from wheres_waldo.parcellation import Parcellation
+
+NETWORKS = ["Vis", "Vis", "Default", "Default", "Default", "Cont"]
+
+
+@pytest.fixture
+def matrices():
+    rng = np.random.default_rng(0)
+    matrices = rng.normal(size=(5, 6, 6))
+    return matrices + matrices.transpose(0, 2, 1)
+
+
+@pytest.fixture
+def parcellation():
+    names = [f"7Networks_LH_{network}_{i + 1}" for i, network in enumerate(NETWORKS)]
+    return Parcellation(np.arange(1, 7), names, np.zeros((6, 3)), 7)
+
+
+@pytest.mark.parametrize("absolute", [False, True])
+def test_top_edges(matrices, absolute):
+    edges, weights = connectome.top_edges(matrices, 4, absolute)
+    rows, cols = connectome.upper_triangle(6)
+    for matrix, subject_edges, subject_weights in zip(matrices, edges, weights):
+        all_weights = matrix[rows, cols]
+        keys = np.abs(all_weights) if absolute else all_weights
+        expected = np.argsort(-keys, kind="stable")[:4]
+        np.testing.assert_array_equal(subject_edges, expected)
+        np.testing.assert_array_equal(subject_weights, all_weights[expected])
+    # No more edges than the matrices have
+    assert connectome.top_edges(matrices, 100)[0].shape == (5, 15)
+
+
+def test_block_sums(matrices):
+    codes = np.array([0, 0, 1, 1, 1, 2])
+    sums, counts = connectome.block_sums(matrices, codes, 3)
+    expected = np.zeros((5, 3, 3))
+    expected_counts = np.zeros((3, 3))
+    for i in range(6):
+        for j in range(6):
+            if i != j:
+                expected[:, codes[i], codes[j]] += matrices[:, i, j]
+                expected_counts[codes[i], codes[j]] += 1
+    np.testing.assert_allclose(sums, expected)
+    np.testing.assert_array_equal(counts, expected_counts)
+
+
+def test_annotate_connectome(matrices, parcellation, tmp_path):
+    prefix = str(tmp_path / "sub")
+    connectome.annotate_connectome(matrices, parcellation, prefix, top_k=3, chunk_size=2)
+
+    parcels = pd.read_csv(f"{prefix}_parcels.csv")
+    assert parcels["network"].tolist() == NETWORKS
+    edges = pd.read_csv(f"{prefix}_edges.csv")
+    assert edges["subject"].tolist() == np.repeat(np.arange(5), 3).tolist()
+    first = edges.iloc[0]
+    np.testing.assert_allclose(first["weight"], matrices[0][np.triu_indices(6, 1)].max())
+    assert first["weight"] == matrices[0, first["source"], first["target"]]
+    assert first["source_network"] == NETWORKS[first["source"]]
+
+    blocks = pd.read_csv(f"{prefix}_blocks.csv").set_index(["subject", "network_a", "network_b"])
+    assert len(blocks) == 5 * 6
+    # Mean of the edges between the two Vis parcels, counted in both directions
+    assert blocks.loc[(1, "Vis", "Vis"), "mean"] == pytest.approx(matrices[1, 0, 1])
+    # A single parcel has no edges within its network
+    assert np.isnan(blocks.loc[(1, "Cont", "Cont"), "mean"])
+    summary = pd.read_csv(f"{prefix}_summary.csv")
+    within = [(0, 1), (2, 3), (2, 4), (3, 4)]
+    expected = np.mean([matrices[:, i, j] for i, j in within], axis=0)
+    np.testing.assert_allclose(summary["within"], expected)
@@ -0,0 +1,83 @@
+"""Tests for the 7/17-network correspondences of wheres_waldo.correspondence."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from wheres_waldo import correspondence, registry
+from wheres_waldo.tests.utils import SHAPE, write_centroids, write_labels
+
+LABELS_7 = np.arange(np.prod(SHAPE)).reshape(SHAPE) % 101
+# Parcels of the 17-network version straddle pairs of 7-network parcels
+LABELS_17 = np.roll(LABELS_7, 1, axis=2)
+
+
+@pytest.fixture(autouse=True)
+def labels(atlas_server, upstream):
+    registry.clear_registry()
+    write_labels(atlas_server, upstream, 7, LABELS_7)
+    write_labels(atlas_server, upstream, 17, LABELS_17)
+    yield
+    registry.clear_registry()
+
+
+def _mean_over_voxels(values, source, target):
+    """Mean of the values of the source parcels over the voxels of each target parcel."""
+    expected = np.full((100,) + values.shape[1:], np.nan)
+    for label in range(1, 101):
+        voxels = (target == label) & (source > 0)
+        if voxels.any():
+            expected[label - 1] = values[source[voxels] - 1].mean(axis=0)
+    return expected
+
+
+def test_count_overlap():
+    overlap = correspondence.count_overlap(LABELS_7, LABELS_17, 100, 100).toarray()
+    for source, target in [(1, 1), (3, 7), (100, 100)]:
+        assert overlap[source - 1, target - 1] == np.sum(
+            (LABELS_7 == source) & (LABELS_17 == target)
+        )
+    assert overlap.sum() == np.sum((LABELS_7 > 0) & (LABELS_17 > 0))
+
+
+def test_translate_values():
+    values = np.random.default_rng(0).normal(size=(100, 2))
+    translated = correspondence.translate_values(values)
+    np.testing.assert_allclose(translated, _mean_over_voxels(values, LABELS_7, LABELS_17))
+    # Back to the 7-network version, and single maps
+    translated = correspondence.translate_values(
+        values[:, 0], source_networks=17, target_networks=7
+    )
+    np.testing.assert_allclose(translated, _mean_over_voxels(values[:, 0], LABELS_17, LABELS_7))
+    np.testing.assert_array_equal(
+        correspondence.translate_values(values, target_networks=7), values
+    )
+    with pytest.raises(ValueError, match="values have 10 parcels"):
+        correspondence.translate_values(values[:10])
+
+
+def test_translate_rois():
+    rois = [0, 1, 2]
+    translated = correspondence.translate_rois(rois, min_overlap=0.1)
+    selected = np.isin(LABELS_7, np.array(rois) + 1) & (LABELS_17 > 0)
+    expected = {
+        label
+        - 1: selected[LABELS_17 == label].sum() / np.sum((LABELS_17 == label) & (LABELS_7 > 0))
+        for label in range(1, 101)
+        if selected[LABELS_17 == label].any()
+    }
+    assert sorted(translated["roi"]) == sorted(
+        row for row, value in expected.items() if value >= 0.1
+    )
+    np.testing.assert_allclose(translated["overlap"], [expected[row] for row in translated["roi"]])
+    assert (np.diff(translated["overlap"]) <= 0).all()
+    assert set(correspondence.translate_rois(rois)["roi"]) <= set(translated["roi"])
+
+
+def test_main(atlas_server, upstream, tmp_path):
+    write_centroids(atlas_server, upstream, 17, "VisCent")
+    output = str(tmp_path / "translated.csv")
+    correspondence._main(["-r", "0", "1", "2", "-o", output, "--min-overlap", "0.1", "-q"])
+    table = pd.read_csv(output)
+    translated = correspondence.translate_rois([0, 1, 2], min_overlap=0.1)
+    assert table["roi"].tolist() == translated["roi"].tolist()
+    assert table["values"].tolist() == [f"LH_VisCent_{roi + 1}" for roi in translated["roi"]]
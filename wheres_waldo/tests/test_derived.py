@@ -0,0 +1,81 @@
+"""Tests that the caches derived from atlas files are rebuilt when the files are updated."""
+import os
+
+import numpy as np
+import pytest
+
+from wheres_waldo import atlas, registry
+from wheres_waldo.correspondence import network_overlap
+from wheres_waldo.surface import load_surface_labels, surface_labels_url
+from wheres_waldo.tests.utils import (
+    AFFINE,
+    SHAPE,
+    update,
+    write_centroids,
+    write_labels,
+    write_surface_labels,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    registry.clear_registry()
+    yield
+    registry.clear_registry()
+
+
+def _entries(directory):
+    return sorted(os.listdir(os.path.join(atlas.get_cache_dir(), directory)))
+
+
+def test_labels_on_grid_follow_updates(atlas_server, upstream):
+    labels = np.arange(np.prod(SHAPE)).reshape(SHAPE) % 101
+    write_labels(atlas_server, upstream, 7, labels)
+    first = np.array(atlas.load_labels_on_grid(SHAPE, AFFINE))
+    np.testing.assert_array_equal(first, labels)
+
+    write_labels(atlas_server, upstream, 7, 100 - labels)
+    # Within the TTL, the cached copy and the volume resampled from it are still used
+    np.testing.assert_array_equal(atlas.load_labels_on_grid(SHAPE, AFFINE), labels)
+    update(atlas.labels_url(100, 7))
+    np.testing.assert_array_equal(atlas.load_labels_on_grid(SHAPE, AFFINE), 100 - labels)
+    assert len(_entries("resampled")) == 1
+
+
+def test_network_overlap_follows_updates(atlas_server, upstream):
+    labels = np.arange(np.prod(SHAPE)).reshape(SHAPE) % 101
+    write_labels(atlas_server, upstream, 7, labels)
+    write_labels(atlas_server, upstream, 17, labels)
+    assert network_overlap().diagonal().sum() == np.count_nonzero(labels)
+
+    write_labels(atlas_server, upstream, 17, np.zeros(SHAPE))
+    update(atlas.labels_url(100, 17))
+    assert network_overlap().sum() == 0
+    assert len(_entries("correspondence")) == 1
+
+
+def test_registry_follows_updates(atlas_server, upstream):
+    write_centroids(atlas_server, upstream, 7, "Vis")
+    parcellation = registry.get_parcellation()
+    assert registry.get_parcellation() is parcellation
+
+    write_centroids(atlas_server, upstream, 7, "Default")
+    update(atlas.centroid_url(100, 7))
+    updated = registry.get_parcellation()
+    assert set(updated.networks) == {"Default"}
+    assert len(registry._REGISTRY) == 1
+
+
+def test_surface_labels_follow_updates(atlas_server, upstream, monkeypatch):
+    monkeypatch.setenv("WALDO_SURFACE_URL", atlas_server.url)
+    write_centroids(atlas_server, upstream, 7, "Vis")
+    names = ["Unknown"] + [f"7Networks_LH_Vis_{label}" for label in range(1, 51)]
+
+    keys = np.arange(200) % 51
+    write_surface_labels(atlas_server, upstream, "lh", keys, names)
+    np.testing.assert_array_equal(load_surface_labels(), keys)
+
+    write_surface_labels(atlas_server, upstream, "lh", 50 - keys, names)
+    update(surface_labels_url())
+    np.testing.assert_array_equal(load_surface_labels(), 50 - keys)
+    assert len(_entries("surface")) == 1
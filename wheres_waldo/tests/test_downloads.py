@@ -0,0 +1,132 @@
+"""Tests of the ranged downloads, against a local server answering range requests."""
+import hashlib
+import logging
+import os
+import os.path as op
+
+import pytest
+
+from wheres_waldo.downloads import download_ranges
+from wheres_waldo.tests.utils import requests_to, validators, write_upstream
+
+SEGMENT = 1 << 16
+DATA = os.urandom(10 * SEGMENT + 123)
+
+
+@pytest.fixture
+def served(range_server, upstream):
+    """URL of a file of 11 segments, and its local copy on the server."""
+    url = f"{range_server.url}/labels.nii.gz"
+    return url, write_upstream(range_server, upstream, url, DATA)
+
+
+def _ranges(server):
+    return [request for request in requests_to(server) if "Range" in request[2]]
+
+
+def _download(url, path, session, **kwargs):
+    kwargs = {"segment_size": SEGMENT, "n_jobs": 4, "retries": 2, "backoff": 0.01, **kwargs}
+    return download_ranges(url, path, session=session, **kwargs)
+
+
+def test_download_ranges(range_server, served, session, tmp_path):
+    url, source = served
+    path = str(tmp_path / "labels.nii.gz")
+
+    _download(url, path, session, sha256=hashlib.sha256(DATA).hexdigest())
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not op.exists(f"{path}.part") and not op.exists(f"{path}.part.json")
+    requests = _ranges(range_server)
+    assert len(requests) == 11
+    assert {request[2]["If-Range"] for request in requests} == {validators(source)[0]}
+
+
+def test_download_ranges_weak_etag(range_server, served, session, tmp_path):
+    url, source = served
+    range_server.server.weak_etag = True
+    path = str(tmp_path / "labels.nii.gz")
+
+    _download(url, path, session)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    requests = _ranges(range_server)
+    assert len(requests) == 11
+    assert {request[2]["If-Range"] for request in requests} == {validators(source)[1]}
+
+
+def test_download_ranges_retries(range_server, served, session, tmp_path, caplog):
+    url, _ = served
+    range_server.server.failures = 3
+    path = str(tmp_path / "labels.nii.gz")
+
+    with caplog.at_level(logging.WARNING, logger="wheres_waldo.downloads"):
+        _download(url, path, session)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert len(_ranges(range_server)) == 11 + 3
+    assert sum("Retrying bytes" in record.message for record in caplog.records) == 3
+
+
+def test_download_ranges_resumes(range_server, served, session, tmp_path, caplog):
+    url, _ = served
+    range_server.server.fail_after = 4
+    path = str(tmp_path / "labels.nii.gz")
+
+    with pytest.raises(OSError):
+        _download(url, path, session, n_jobs=1, retries=0)
+    assert not op.exists(path)
+    assert op.isfile(f"{path}.part") and op.isfile(f"{path}.part.json")
+
+    range_server.server.fail_after = None
+    range_server.server.requests.clear()
+    with caplog.at_level(logging.INFO, logger="wheres_waldo.downloads"):
+        _download(url, path, session)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert len(_ranges(range_server)) == 11 - 4
+    assert "7 segments left" in caplog.text
+
+
+def test_download_ranges_checksum(range_server, served, session, tmp_path):
+    url, _ = served
+    path = str(tmp_path / "labels.nii.gz")
+
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        _download(url, path, session, sha256="0" * 64)
+    assert not op.exists(path) and not op.exists(f"{path}.part")
+
+
+def test_download_ranges_whole_file(range_server, served, session, tmp_path, caplog):
+    url, _ = served
+    range_server.server.changed = True
+    path = str(tmp_path / "labels.nii.gz")
+
+    with caplog.at_level(logging.WARNING, logger="wheres_waldo.downloads"):
+        _download(url, path, session, n_jobs=1)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not op.exists(f"{path}.part") and not op.exists(f"{path}.part.json")
+    # The first answer without a range cancels the pending segments, without retries
+    n_ranges = len(_ranges(range_server))
+    assert n_ranges <= 2
+    assert len(requests_to(range_server)) == n_ranges + 1
+    assert "Retrying bytes" not in caplog.text
+
+
+def test_download_ranges_unsupported(range_server, served, session, tmp_path):
+    url, _ = served
+    range_server.server.ranges = False
+    path = str(tmp_path / "labels.nii.gz")
+
+    _download(url, path, session)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert len(requests_to(range_server)) == 1
+    assert not _ranges(range_server)
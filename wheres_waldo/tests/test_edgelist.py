@@ -0,0 +1,38 @@
+"""Tests for the edge thresholds of wheres_waldo.edgelist."""
+import numpy as np
+import pytest
+
+from wheres_waldo import edgelist
+
+
+def test_threshold_edges_proportional():
+    matrices = np.random.default_rng(0).normal(size=(2, 10, 10))
+    matrices = matrices + matrices.transpose(0, 2, 1)
+    selected = edgelist.threshold_edges(matrices, "proportional", 0.2)
+    assert selected.shape == (2, 45)
+    assert (selected.sum(axis=1) == 9).all()
+    assert not edgelist.threshold_edges(matrices, "proportional", 0).any()
+    assert edgelist.threshold_edges(matrices, "proportional", 1).all()
+
+    for density in (-0.1, 1.5):
+        with pytest.raises(ValueError, match="between 0 and 1"):
+            edgelist.threshold_edges(matrices, "proportional", density)
+
+
+def test_threshold_edges_top_k_integers():
+    # Integer weights, e.g. streamline counts, ranked by absolute weight
+    matrix = np.array([[0, -5, 1, 2], [-5, 0, 3, -1], [1, 3, 0, 4], [2, -1, 4, 0]])
+    selected = edgelist.threshold_edges(matrix[np.newaxis], "top-k", 1, absolute=True)
+    # Edges (0, 1), (0, 2), (0, 3), (1, 2), (1, 3) and (2, 3)
+    assert selected.tolist() == [[True, False, False, False, False, True]]
+    selected = edgelist.threshold_edges(matrix[np.newaxis], "top-k", 1)
+    assert selected.tolist() == [[False, False, True, True, False, True]]
+
+
+@pytest.mark.parametrize("density", ["-0.1", "1.5", "20"])
+def test_parser_rejects_densities(density, capsys):
+    with pytest.raises(SystemExit):
+        edgelist._get_parser().parse_args(
+            ["-i", "stack.npy", "-o", "edges.csv", "--density", density]
+        )
+    assert "must be between 0 and 1" in capsys.readouterr().err
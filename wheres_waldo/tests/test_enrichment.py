@@ -0,0 +1,56 @@
+"""Tests for the network enrichment of wheres_waldo.enrichment."""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from wheres_waldo.enrichment import network_enrichment
+from wheres_waldo.parcellation import Parcellation
+
+NETWORKS = ["Vis", "Vis", "Vis", "Default", "Default", "Default", "Cont", "Cont"]
+
+
+@pytest.fixture
+def parcellation():
+    names = [f"7Networks_LH_{network}_{i + 1}" for i, network in enumerate(NETWORKS)]
+    return Parcellation(np.arange(1, 9), names, np.zeros((8, 3)), 7)
+
+
+@pytest.mark.parametrize("rois", [[0, 1, 6], [0, 1, 2, 3, 6, 7]])
+def test_network_enrichment_random_sets(parcellation, rois):
+    enrichment = network_enrichment(rois, parcellation, n_perm=20000).set_index("network")
+
+    # Exact null of all the sets of as many parcels
+    networks = np.array(NETWORKS)
+    observed = pd.Series(networks[rois]).value_counts()
+    counts = pd.DataFrame(
+        [
+            pd.Series(networks[list(subset)]).value_counts()
+            for subset in itertools.combinations(range(8), len(rois))
+        ]
+    ).fillna(0)
+    for network in ("Cont", "Default", "Vis"):
+        assert enrichment.loc[network, "n_rois"] == observed.get(network, 0)
+        null = counts[network]
+        p_value = (null >= observed.get(network, 0)).mean()
+        assert enrichment.loc[network, "p_value"] == pytest.approx(p_value, abs=0.01)
+        assert enrichment.loc[network, "expected"] == pytest.approx(null.mean(), abs=0.02)
+
+
+def test_network_enrichment_spins(parcellation):
+    # Spinning a set onto each of the others in turn
+    perms = np.array([np.roll(np.arange(8), shift) for shift in range(1, 8)])
+    enrichment = network_enrichment([0, 1], parcellation, perms=perms).set_index("network")
+    # Sets {7, 0}, {6, 7}, ..., {1, 2}: both parcels are in Vis in the last one only
+    assert enrichment.loc["Vis", "p_value"] == (1 + 1) / (1 + 7)
+    assert enrichment.loc["Vis", "expected"] == pytest.approx(4 / 7)
+
+
+def test_network_enrichment_seed(parcellation):
+    first = network_enrichment([0, 3], parcellation, n_perm=100, seed=1, chunk_size=30)
+    pd.testing.assert_frame_equal(
+        network_enrichment([0, 3], parcellation, n_perm=100, seed=1, chunk_size=30), first
+    )
+    other = network_enrichment([0, 3], parcellation, n_perm=100, seed=2, chunk_size=30)
+    assert not first["expected"].equals(other["expected"])
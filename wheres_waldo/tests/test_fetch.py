@@ -0,0 +1,69 @@
+"""Tests for wheres_waldo.fetch."""
+import os.path as op
+
+import pytest
+
+from wheres_waldo import fetch
+from wheres_waldo.atlas import centroid_url, labels_url
+from wheres_waldo.tests.utils import requests_to, write_upstream
+
+
+def test_atlas_urls():
+    urls = fetch.atlas_urls([100, 200], [7], labels=True, resolutions=(1, 2))
+    assert urls == [
+        centroid_url(100, 7),
+        centroid_url(200, 7),
+        labels_url(100, 7, 1),
+        labels_url(100, 7, 2),
+        labels_url(200, 7, 1),
+        labels_url(200, 7, 2),
+    ]
+    assert fetch.atlas_urls([100], [7, 17], labels=False) == [
+        centroid_url(100, 7),
+        centroid_url(100, 17),
+    ]
+    # Repeated selections are fetched once
+    assert len(fetch.atlas_urls([100, 100], [7], labels=False)) == 1
+
+
+def test_fetch_atlases(atlas_server, upstream, cache_dir):
+    urls = fetch.atlas_urls([100, 200, 300], [7, 17], labels=True)
+    contents = {url: f"contents of {op.basename(url)}".encode() for url in urls}
+    for url, data in contents.items():
+        write_upstream(atlas_server, upstream, url, data)
+
+    paths = fetch.fetch_atlases([100, 200, 300], [7, 17], labels=True, n_jobs=4)
+    assert [op.basename(path) for path in paths] == [op.basename(url) for url in urls]
+    for url, path in zip(urls, paths):
+        assert op.dirname(path) == cache_dir
+        with open(path, "rb") as f:
+            assert f.read() == contents[url]
+    assert sorted(request[1] for request in requests_to(atlas_server)) == sorted(
+        url[len(atlas_server.url) :] for url in urls
+    )
+
+    # Cached files are not downloaded again
+    n_requests = len(atlas_server.server.requests)
+    assert fetch.fetch_atlases([100, 200, 300], [7, 17], labels=True, n_jobs=4) == paths
+    assert len(atlas_server.server.requests) == n_requests
+
+
+def test_fetch_atlases_failure(atlas_server, upstream, cache_dir):
+    urls = fetch.atlas_urls([100, 200], [7], labels=False)
+    write_upstream(atlas_server, upstream, urls[0], b"only the first file exists")
+
+    with pytest.raises(RuntimeError, match="1 of 2"):
+        fetch.fetch_atlases([100, 200], [7], labels=False, n_jobs=2)
+    # The other downloads completed
+    assert op.isfile(op.join(cache_dir, op.basename(urls[0])))
+    assert not op.isfile(op.join(cache_dir, op.basename(urls[1])))
+
+
+def test_main(atlas_server, upstream, cache_dir):
+    for url in fetch.atlas_urls([100], [7, 17], labels=False):
+        write_upstream(atlas_server, upstream, url, b"ROI Label,ROI Name,R,A,S\n")
+
+    fetch._main(["-p", "100", "--no-labels", "-q"])
+    assert op.isfile(op.join(cache_dir, op.basename(centroid_url(100, 7))))
+    assert op.isfile(op.join(cache_dir, op.basename(centroid_url(100, 17))))
+    assert all(".nii.gz" not in request[1] for request in atlas_server.server.requests)
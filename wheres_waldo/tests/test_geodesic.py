@@ -0,0 +1,76 @@
+"""Tests for the geodesic distances of wheres_waldo.geodesic."""
+import os
+
+import numpy as np
+from scipy.sparse import csgraph, csr_matrix
+
+from wheres_waldo import atlas
+from wheres_waldo.geodesic import geodesic_distances, mesh_graph, parcel_distances
+from wheres_waldo.surface import load_geometry, surface_labels_url
+from wheres_waldo.tests.utils import update, write_surface_labels
+
+
+def test_mesh_graph():
+    # Two triangles sharing the edge (1, 2) of a unit square
+    coords = [[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 1, 0]]
+    faces = [[0, 1, 2], [1, 3, 2]]
+    graph = mesh_graph(coords, faces).toarray()
+    expected = np.zeros((4, 4))
+    expected[0, 1] = expected[0, 2] = expected[1, 3] = expected[2, 3] = 1
+    expected[1, 2] = np.sqrt(2)
+    np.testing.assert_allclose(graph, expected)
+    # Edges of masked vertices are dropped
+    graph = mesh_graph(coords, faces, mask=[True, True, True, False]).toarray()
+    expected[:, 3] = 0
+    np.testing.assert_allclose(graph, expected)
+
+
+def test_geodesic_distances(surface_atlas):
+    spheres, keys = surface_atlas
+    distances = geodesic_distances(spheres, n_jobs=2)
+    assert distances.shape == (100, 100)
+    assert distances.dtype == np.float32
+
+    for hemi, first in (("lh", 0), ("rh", 50)):
+        # Dense Dijkstra on the edges between labeled vertices
+        coords, faces = load_geometry(spheres[hemi])
+        labeled = keys[hemi] > 0
+        edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+        edges = np.unique(np.sort(edges[labeled[edges].all(axis=1)], axis=1), axis=0)
+        lengths = np.linalg.norm(coords[edges[:, 0]] - coords[edges[:, 1]], axis=1)
+        graph = csr_matrix((lengths, edges.T), shape=(len(coords),) * 2)
+        # Centroid vertex: the vertex of the parcel closest to the mean of its vertices
+        centroids = []
+        for key in range(1, 21):
+            vertices = np.flatnonzero(keys[hemi] == key)
+            mean = coords[vertices].mean(axis=0)
+            centroids.append(vertices[np.argmin(np.linalg.norm(coords[vertices] - mean, axis=1))])
+        expected = csgraph.dijkstra(graph, directed=False, indices=centroids)[:, centroids]
+        rows = slice(first, first + 20)
+        np.testing.assert_allclose(distances[rows, rows], expected, rtol=1e-5)
+        np.testing.assert_array_equal(np.diagonal(distances)[rows], 0)
+
+    # No paths between hemispheres or to parcels missing from the mesh
+    assert np.isinf(distances[:50, 50:]).all()
+    assert np.isinf(distances[20:50]).all()
+    # Cached distances are memory-mapped
+    assert isinstance(geodesic_distances(spheres), np.memmap)
+    np.testing.assert_array_equal(
+        parcel_distances([3, 55, 1], spheres), distances[np.ix_([3, 55, 1], [3, 55, 1])]
+    )
+
+
+def test_geodesic_distances_follow_updates(atlas_server, upstream, surface_atlas):
+    spheres, keys = surface_atlas
+    first = np.array(geodesic_distances(spheres))
+    assert np.isfinite(first[:20, :20]).all()
+    assert np.isinf(first[:20, 50:]).all()
+
+    # The right hemisphere now has a single parcel
+    names = ["Unknown", "7Networks_RH_Vis_51"]
+    write_surface_labels(atlas_server, upstream, "rh", np.minimum(keys["rh"], 1), names)
+    update(surface_labels_url(hemi="rh"))
+    updated = geodesic_distances(spheres)
+    np.testing.assert_array_equal(updated[:50, :50], first[:50, :50])
+    assert np.isfinite(updated[50:, 50:]).sum() == 1
+    assert len(os.listdir(os.path.join(atlas.get_cache_dir(), "geodesic"))) == 1
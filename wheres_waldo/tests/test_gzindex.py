@@ -0,0 +1,23 @@
+"""Tests for the seek-point indices of wheres_waldo.gzindex."""
+import nibabel as nib
+import numpy as np
+import pytest
+
+from wheres_waldo import gzindex
+
+pytest.importorskip("indexed_gzip")
+
+
+def test_indexed_image(tmp_path):
+    data = np.arange(10 * 10 * 10 * 100, dtype=np.float32).reshape(10, 10, 10, 100)
+    path = str(tmp_path / "run.nii.gz")
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+    idx_path = gzindex.build_index(path, spacing=1 << 16)
+    assert idx_path == f"{path}.gzidx"
+
+    with gzindex.indexed_image(path, build=False) as img:
+        np.testing.assert_array_equal(img.dataobj[..., -1], data[..., -1])
+        np.testing.assert_array_equal(img.dataobj[:, :, 2:4, 10:20], data[:, :, 2:4, 10:20])
+        fobj = img.dataobj.file_like
+        assert not fobj.closed
+    assert fobj.closed
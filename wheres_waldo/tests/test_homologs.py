@@ -0,0 +1,75 @@
+"""Tests for the homologous parcels of wheres_waldo.homologs."""
+import numpy as np
+import pytest
+
+from wheres_waldo import atlas, registry
+from wheres_waldo.homologs import find_homologs, homolog_table
+from wheres_waldo.parcellation import Parcellation
+from wheres_waldo.tests.utils import update, write_upstream
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    registry.clear_registry()
+    yield
+    registry.clear_registry()
+
+
+@pytest.fixture
+def parcellation():
+    names = [
+        "7Networks_LH_Vis_1",
+        "7Networks_LH_Default_2",
+        "7Networks_RH_Default_3",
+        "7Networks_RH_Vis_4",
+    ]
+    # The mirrored Vis parcel is closer to the Default parcel of the other hemisphere
+    coords = [[-30, 0, 0], [-30, 40, 0], [30, 0, 0], [30, 3, 0]]
+    return Parcellation([1, 2, 3, 4], names, coords, 7)
+
+
+def test_find_homologs_prefers_names(parcellation):
+    homologs = find_homologs(parcellation)
+    np.testing.assert_array_equal(homologs["roi"], [0, 1, 2, 3])
+    # Default_3 is too far from the mirrored Vis_1 to be preferred to it
+    np.testing.assert_array_equal(homologs["homolog"], [3, 2, 0, 0])
+    np.testing.assert_allclose(homologs["distance"], [3, 40, 0, 3])
+
+
+def test_find_homologs_nearest(parcellation):
+    # Beyond the tolerance, or without names, the closest parcel is chosen
+    for homologs in (find_homologs(parcellation, tolerance=1), find_homologs(parcellation, False)):
+        np.testing.assert_array_equal(homologs["homolog"], [2, 3, 0, 0])
+        np.testing.assert_allclose(homologs["distance"], [0, 37, 0, 3])
+
+
+def test_find_homologs_single_hemisphere():
+    parcellation = Parcellation([1], ["7Networks_LH_Vis_1"], [[-30, 0, 0]], 7)
+    homologs = find_homologs(parcellation)
+    assert homologs["homolog"].tolist() == [-1]
+    assert np.isnan(homologs["distance"]).all()
+
+
+def _write_mirrored_centroids(server, upstream, reverse):
+    """Serve parcels along y, the right hemisphere being in reverse order if ``reverse``."""
+    rows = ["ROI Label,ROI Name,R,A,S"]
+    for label in range(1, 101):
+        hemi, position = ("LH", label) if label <= 50 else ("RH", label - 50)
+        if hemi == "RH" and reverse:
+            position = 51 - position
+        x = -30 if hemi == "LH" else 30
+        rows.append(f"{label},7Networks_{hemi}_Vis_{label},{x},{10 * position},0")
+    write_upstream(server, upstream, atlas.centroid_url(), "\n".join(rows).encode())
+
+
+def test_homolog_table_follows_updates(atlas_server, upstream):
+    _write_mirrored_centroids(atlas_server, upstream, reverse=False)
+    homologs = homolog_table()
+    np.testing.assert_array_equal(homologs["homolog"][:50], np.arange(50, 100))
+    assert homolog_table() is homologs
+    with pytest.raises(ValueError, match="read-only"):
+        homologs["homolog"][0] = 0
+
+    _write_mirrored_centroids(atlas_server, upstream, reverse=True)
+    update(atlas.centroid_url())
+    np.testing.assert_array_equal(homolog_table()["homolog"][:50], np.arange(99, 49, -1))
@@ -0,0 +1,153 @@
+"""Tests for wheres_waldo.locking, including a multi-process stress test of the cache."""
+import logging
+import os
+import os.path as op
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from wheres_waldo import locking
+from wheres_waldo.atlas import centroid_url
+from wheres_waldo.locking import FileLock
+from wheres_waldo.tests.utils import (
+    AtlasHandler,
+    AtlasServer,
+    requests_to,
+    write_upstream,
+)
+
+N_PROCESSES = 8
+
+# Each process waits for all the others to be ready, then fetches the same file
+_FETCH = textwrap.dedent(
+    """
+    import os, os.path as op, sys, time
+    import wheres_waldo.locking
+    from wheres_waldo.atlas import centroid_url, fetch_file
+
+    if sys.argv[1] == "excl":
+        wheres_waldo.locking.fcntl = None
+    open(op.join(sys.argv[2], f"ready.{os.getpid()}"), "w").close()
+    while not op.exists(op.join(sys.argv[2], "go")):
+        time.sleep(0.01)
+    with open(fetch_file(centroid_url()), "rb") as f:
+        sys.stdout.write(f.read().decode())
+    """
+)
+
+
+class SlowHandler(AtlasHandler):
+    """Answer slowly, so that all processes ask for the file during its download."""
+
+    def _serve(self, body):
+        time.sleep(0.5)
+        super()._serve(body)
+
+
+@pytest.fixture(params=["flock", "excl"])
+def lock_mode(request, monkeypatch):
+    if request.param == "excl":
+        monkeypatch.setattr(locking, "fcntl", None)
+    elif locking.fcntl is None:
+        pytest.skip("Advisory locks are not available.")
+    return request.param
+
+
+def test_file_lock_excludes(tmp_path, lock_mode):
+    path = str(tmp_path / "file.lock")
+    with FileLock(path):
+        with pytest.raises(TimeoutError):
+            FileLock(path, timeout=0.3, poll=0.05).acquire()
+    # Released locks can be taken again
+    with FileLock(path, timeout=0.3):
+        pass
+    assert not op.exists(f"{path}.excl")
+
+
+def test_file_lock_breaks_stale_locks(tmp_path, caplog, monkeypatch):
+    monkeypatch.setattr(locking, "fcntl", None)
+    path = str(tmp_path / "file.lock")
+    # Lock file left over by a process that died 2 minutes ago
+    with open(f"{path}.excl", "w") as f:
+        f.write("elsewhere:12345\n")
+    os.utime(f"{path}.excl", (time.time() - 120, time.time() - 120))
+
+    with caplog.at_level(logging.WARNING, logger="wheres_waldo.locking"):
+        with FileLock(path, timeout=5, stale=60, poll=0.05):
+            with open(f"{path}.excl") as f:
+                assert f.read().endswith(f":{os.getpid()}\n")
+    assert "Broke stale lock" in caplog.text
+    assert not op.exists(f"{path}.excl")
+
+
+def test_file_lock_restores_retaken_locks(tmp_path, caplog, monkeypatch):
+    path = str(tmp_path / "file.lock.excl")
+    with open(path, "w") as f:
+        f.write("elsewhere:12345\n")
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    rename = os.rename
+
+    def race(src, dst):
+        # Another waiter breaks the stale lock and takes it between our stat and rename
+        os.remove(src)
+        with open(src, "w") as f:
+            f.write("elsewhere:67890\n")
+        rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", race)
+    with caplog.at_level(logging.WARNING, logger="wheres_waldo.locking"):
+        FileLock(str(tmp_path / "file.lock"))._break_stale(path)
+    with open(path) as f:
+        assert f.read() == "elsewhere:67890\n"
+    assert os.listdir(tmp_path) == ["file.lock.excl"]
+    assert "Broke stale lock" not in caplog.text
+
+
+def test_file_lock_release_tolerates_removed_lock(tmp_path, monkeypatch):
+    monkeypatch.setattr(locking, "fcntl", None)
+    path = str(tmp_path / "file.lock")
+    with FileLock(path):
+        os.remove(f"{path}.excl")
+
+
+def test_file_lock_keeps_live_locks(tmp_path, monkeypatch):
+    monkeypatch.setattr(locking, "fcntl", None)
+    path = str(tmp_path / "file.lock")
+    with FileLock(path, stale=0.4):
+        # The holder refreshes its lock file, which is never considered stale
+        with pytest.raises(TimeoutError):
+            FileLock(path, timeout=1.2, stale=0.4, poll=0.05).acquire()
+
+
+@pytest.mark.parametrize("mode", ["flock", "excl"])
+def test_concurrent_fetches_download_once(mode, upstream, cache_dir, tmp_path):
+    if mode == "flock" and locking.fcntl is None:
+        pytest.skip("Advisory locks are not available.")
+    sync = tmp_path / "sync"
+    sync.mkdir()
+    with AtlasServer(upstream, SlowHandler) as server:
+        server.server.requests = []
+        write_upstream(server, upstream, centroid_url(), b"ROI Label,ROI Name,R,A,S\n")
+        processes = [
+            subprocess.Popen(
+                [sys.executable, "-c", _FETCH, mode, str(sync)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for _ in range(N_PROCESSES)
+        ]
+        deadline = time.monotonic() + 120
+        while len(os.listdir(sync)) < N_PROCESSES and time.monotonic() < deadline:
+            time.sleep(0.05)
+        (sync / "go").touch()
+        outputs = [process.communicate(timeout=120) for process in processes]
+
+        assert [process.returncode for process in processes] == [0] * N_PROCESSES, outputs
+        assert all(stdout == "ROI Label,ROI Name,R,A,S\n" for stdout, _ in outputs)
+        # A single process downloaded the file, the others waited for it
+        assert len(requests_to(server)) == 1
+    assert not [name for name in os.listdir(cache_dir) if name.endswith(".tmp")]
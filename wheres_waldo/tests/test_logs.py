@@ -0,0 +1,88 @@
+"""Tests for the logging setup and progress reports of wheres_waldo.logs."""
+import io
+import json
+import logging
+
+import pytest
+
+from wheres_waldo.logs import Progress, setup_logging
+
+
+@pytest.fixture
+def stream():
+    stream = io.StringIO()
+    yield stream
+    logger = logging.getLogger("wheres_waldo")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.propagate = True
+    logger.setLevel(logging.NOTSET)
+
+
+def test_plain_logs(stream):
+    setup_logging(stream=stream)
+    logger = logging.getLogger("wheres_waldo.test")
+    logger.info("Found %d ROIs", 3)
+    logger.debug("hidden")
+    assert stream.getvalue() == "Found 3 ROIs\n"
+
+    # Set up again: messages are not duplicated, and quiet hides info messages
+    setup_logging(quiet=True, stream=stream)
+    logger.info("hidden")
+    logger.warning("shown")
+    assert stream.getvalue() == "Found 3 ROIs\nshown\n"
+
+
+def test_json_logs(stream):
+    setup_logging(log_json=True, stream=stream)
+    logger = logging.getLogger("wheres_waldo.test")
+    logger.info("Found %d ROIs", 3)
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("Failed")
+
+    first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert first["level"] == "INFO"
+    assert first["logger"] == "wheres_waldo.test"
+    assert first["message"] == "Found 3 ROIs"
+    assert isinstance(first["time"], float)
+    assert "progress" not in first and "exception" not in first
+    assert second["level"] == "ERROR"
+    assert "ZeroDivisionError" in second["exception"]
+
+
+def test_progress_is_rate_limited(stream):
+    setup_logging(log_json=True, stream=stream)
+    logger = logging.getLogger("wheres_waldo.test")
+    with Progress(1000, "ROIs", logger, interval=3600) as progress:
+        for _ in range(1000):
+            progress.update()
+    # A single report, when the loop ends
+    (line,) = stream.getvalue().splitlines()
+    entry = json.loads(line)
+    assert entry["message"].startswith("ROIs: 1000/1000 (")
+    assert entry["progress"]["count"] == entry["progress"]["total"] == 1000
+    assert entry["progress"]["eta_s"] == 0
+
+    stream.truncate(0)
+    stream.seek(0)
+    with Progress(4, "Maps", logger, interval=0) as progress:
+        progress.update(2)
+        progress.update(2)
+    counts = [json.loads(line)["progress"]["count"] for line in stream.getvalue().splitlines()]
+    assert counts == [2, 4, 4]
+
+
+def test_progress_quiet_and_failures(stream):
+    setup_logging(quiet=True, stream=stream)
+    with Progress(10, "ROIs", logging.getLogger("wheres_waldo.test"), interval=0) as progress:
+        progress.update(10)
+    assert stream.getvalue() == ""
+
+    setup_logging(stream=stream)
+    # Interrupted loops are not reported as done
+    with pytest.raises(KeyError):
+        with Progress(10, "ROIs", logging.getLogger("wheres_waldo.test"), interval=3600):
+            raise KeyError("roi")
+    assert stream.getvalue() == ""
@@ -0,0 +1,76 @@
+"""Tests for the ROI masks of wheres_waldo.masks."""
+import os
+import os.path as op
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from wheres_waldo import masks
+from wheres_waldo.tests.utils import AFFINE, SHAPE
+
+LABELS = np.arange(np.prod(SHAPE)).reshape(SHAPE) % 5
+
+
+@pytest.fixture
+def labels_path(tmp_path):
+    path = str(tmp_path / "labels.nii.gz")
+    nib.save(nib.Nifti1Image(LABELS.astype(np.int32), AFFINE), path)
+    return path
+
+
+@pytest.mark.parametrize("compresslevel", [0, 6])
+def test_roi_masks(labels_path, tmp_path, compresslevel):
+    out_dir = str(tmp_path / "masks")
+    paths = masks.roi_masks(labels_path, [3, 1, 3], out_dir, compresslevel=compresslevel)
+    extension = ".nii.gz" if compresslevel else ".nii"
+    assert paths == [op.join(out_dir, f"roi-{label}_mask{extension}") for label in (3, 1)]
+    for path, label in zip(paths, (3, 1)):
+        img = nib.load(path)
+        assert img.get_data_dtype() == np.uint8
+        np.testing.assert_array_equal(img.affine, AFFINE)
+        np.testing.assert_array_equal(np.asarray(img.dataobj), LABELS == label)
+
+
+def test_roi_masks_4d_and_label(labels_path, tmp_path):
+    (path,) = masks.roi_masks(labels_path, [2, 4], str(tmp_path), prefix="x_", mode="4d")
+    assert op.basename(path) == "x_rois_4d.nii.gz"
+    data = np.asarray(nib.load(path).dataobj)
+    np.testing.assert_array_equal(data, np.stack([LABELS == 2, LABELS == 4], axis=-1))
+
+    (path,) = masks.roi_masks(labels_path, [2, 4], str(tmp_path), mode="label")
+    data = np.asarray(nib.load(path).dataobj)
+    np.testing.assert_array_equal(data, np.where(np.isin(LABELS, [2, 4]), LABELS, 0))
+
+
+def test_roi_masks_reuses_manifest(labels_path, tmp_path, monkeypatch):
+    out_dir = str(tmp_path / "masks")
+    masks.roi_masks(labels_path, [1, 2], out_dir)
+    written = []
+    save_nifti = masks.save_nifti
+
+    def record(img, path, *args):
+        written.append(path)
+        save_nifti(img, path, *args)
+
+    monkeypatch.setattr(masks, "save_nifti", record)
+
+    # Up to date masks are kept, new ones are written
+    masks.roi_masks(labels_path, [1, 2, 3], out_dir)
+    assert written == [op.join(out_dir, "roi-3_mask.nii.gz")]
+    # Other compression levels and atlases are different masks
+    masks.roi_masks(labels_path, [1], out_dir, compresslevel=1)
+    assert written[1:] == [op.join(out_dir, "roi-1_mask.nii.gz")]
+    nib.save(nib.Nifti1Image((4 - LABELS).astype(np.int32), AFFINE), labels_path)
+    masks.roi_masks(labels_path, [1], out_dir, compresslevel=1)
+    assert len(written) == 3
+    np.testing.assert_array_equal(np.asarray(nib.load(written[-1]).dataobj), LABELS == 3)
+
+    # Corrupted manifests are ignored
+    with open(op.join(out_dir, masks.MANIFEST), "w") as f:
+        f.write("{")
+    masks.roi_masks(labels_path, [1, 2, 3], out_dir, compresslevel=1)
+    assert len(written) == 6
+    masks.roi_masks(labels_path, [1, 2, 3], out_dir, compresslevel=1)
+    assert len(written) == 6
+    assert not [name for name in os.listdir(out_dir) if name.endswith(".tmp")]
@@ -0,0 +1,22 @@
+"""Tests for the array-backed parcellations of wheres_waldo.parcellation."""
+import pytest
+
+from wheres_waldo.parcellation import Parcellation
+
+
+@pytest.fixture
+def parcellation():
+    names = ["7Networks_LH_Vis_1", "7Networks_LH_Default_2", "7Networks_RH_Vis_3"]
+    return Parcellation([1, 2, 3], names, [[-30, 0, 0], [-10, 0, 0], [30, 0, 0]], 7)
+
+
+def test_roi_details(parcellation):
+    details = parcellation.roi_details([2, 0])
+    assert list(details["label"]) == [3, 1]
+    assert list(details["values"]) == ["RH_Vis_3", "LH_Vis_1"]
+
+
+@pytest.mark.parametrize("roi", [-1, -3, 3])
+def test_roi_details_out_of_range(parcellation, roi):
+    with pytest.raises(IndexError, match="between 0 and 2"):
+        parcellation.roi_details([0, roi])
@@ -0,0 +1,50 @@
+"""Tests for the probabilistic atlases of wheres_waldo.probabilistic."""
+import nibabel as nib
+import numpy as np
+import pytest
+
+from wheres_waldo.probabilistic import ProbabilisticAtlas
+
+AFFINE = np.diag([2.0, 2.0, 2.0, 1.0])
+LABELS = ["A", "B", "C"]
+COORDS = np.array([[2.5, 3.0, 4.2], [0.0, 0.0, 0.0], [9.9, 1.1, 6.0], [-1.0, 2.0, 2.0]])
+
+
+@pytest.fixture
+def probabilities():
+    return np.random.default_rng(0).uniform(size=(6, 5, 4, 3))
+
+
+def _expected(probabilities, img):
+    """Probabilities interpolated from the real values of an atlas loaded in memory."""
+    return ProbabilisticAtlas(probabilities, img.affine, LABELS).probabilities(COORDS)
+
+
+@pytest.mark.parametrize("suffix", [".nii", ".nii.gz"])
+def test_load_scaled(probabilities, tmp_path, suffix):
+    path = str(tmp_path / f"atlas{suffix}")
+    img = nib.Nifti1Image(np.round(probabilities * 1000).astype(np.int16), AFFINE)
+    img.header.set_slope_inter(0.0005, 0.25)
+    nib.save(img, path)
+
+    atlas = ProbabilisticAtlas.load(path, LABELS)
+    # The stored values are memory-mapped, not scaled in memory
+    assert isinstance(atlas.maps, np.memmap) and atlas.maps.dtype == np.int16
+    expected = 0.0005 * np.round(probabilities * 1000) + 0.25
+    np.testing.assert_allclose(
+        atlas.probabilities(COORDS), _expected(expected, atlas), rtol=1e-6, atol=1e-6
+    )
+    # Points outside of the atlas have a probability of 0, whatever the intercept
+    assert (atlas.probabilities([[100, 100, 100]]) == 0).all()
+
+
+def test_load_percentages(probabilities, tmp_path):
+    path = str(tmp_path / "atlas.nii")
+    percentages = np.round(probabilities * 100).astype(np.uint8)
+    nib.save(nib.Nifti1Image(percentages, AFFINE), path)
+
+    atlas = ProbabilisticAtlas.load(path, LABELS)
+    assert isinstance(atlas.maps, np.memmap) and atlas.maps.dtype == np.uint8
+    np.testing.assert_allclose(
+        atlas.probabilities(COORDS), _expected(percentages / 100, atlas), atol=1e-12
+    )
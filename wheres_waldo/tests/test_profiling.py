@@ -0,0 +1,56 @@
+"""Tests for the stage instrumentation of wheres_waldo.profiling."""
+import json
+import tracemalloc
+
+import pytest
+
+from wheres_waldo.profiling import Profiler
+
+
+def test_profiler_report(tmp_path):
+    output = str(tmp_path / "profile.json")
+    with Profiler(output) as profiler:
+        assert tracemalloc.is_tracing()
+        with profiler.span("allocate") as span:
+            data = bytearray(1 << 20)
+            span.rows = len(data)
+        with profiler.span("noop", rows=3):
+            pass
+    assert not tracemalloc.is_tracing()
+
+    with open(output) as f:
+        report = json.load(f)
+    allocate, noop = report["spans"]
+    assert allocate["name"] == "allocate"
+    assert allocate["rows"] == 1 << 20
+    assert allocate["allocated_bytes"] >= 1 << 20
+    assert allocate["peak_bytes"] >= allocate["allocated_bytes"]
+    assert allocate["error"] is None
+    assert noop["rows"] == 3
+    assert report["total"]["wall_s"] == pytest.approx(allocate["wall_s"] + noop["wall_s"])
+
+
+def test_profiler_reports_failures(tmp_path):
+    output = str(tmp_path / "profile.json")
+    with pytest.raises(KeyError):
+        with Profiler(output) as profiler:
+            with profiler.span("lookup"):
+                {}["missing"]
+            with profiler.span("never"):
+                pass
+    assert not tracemalloc.is_tracing()
+
+    with open(output) as f:
+        (span,) = json.load(f)["spans"]
+    assert span["name"] == "lookup"
+    assert span["error"] == "KeyError"
+    assert span["wall_s"] >= 0
+
+
+def test_disabled_profiler(tmp_path):
+    with Profiler() as profiler:
+        assert not tracemalloc.is_tracing()
+        with profiler.span("stage") as span:
+            span.rows = 1
+        assert span.rows is None
+    assert profiler.spans == []
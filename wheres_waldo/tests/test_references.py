@@ -0,0 +1,78 @@
+"""Tests for the reference map comparisons of wheres_waldo.references."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import spearmanr
+
+from wheres_waldo import references
+
+
+@pytest.fixture
+def maps():
+    rng = np.random.default_rng(0)
+    queries = rng.normal(size=(30, 3))
+    library = rng.normal(size=(30, 7))
+    # Ties, and a reference equal to a query up to an increasing transform
+    library[:, 0] = np.round(library[:, 0])
+    library[:, 1] = np.exp(queries[:, 2])
+    return queries, library
+
+
+@pytest.mark.parametrize("max_memory", [8 * 30, 8 * 30 * 3, 1 << 20])
+def test_correlate_maps_pearson(maps, max_memory):
+    queries, library = maps
+    correlations = references.correlate_maps(queries, library, max_memory=max_memory)
+    expected = np.corrcoef(queries.T, library.T)[:3, 3:]
+    np.testing.assert_allclose(correlations, expected)
+
+
+def test_correlate_maps_spearman(maps):
+    queries, library = maps
+    correlations = references.correlate_maps(queries, library, "spearman", max_memory=8 * 30 * 2)
+    expected = spearmanr(queries, library).statistic[:3, 3:]
+    np.testing.assert_allclose(correlations, expected)
+    assert correlations[2, 1] == pytest.approx(1)
+
+
+def test_correlate_maps_errors(maps):
+    queries, library = maps
+    library[:, 3] = 1
+    with np.errstate(invalid="ignore"):
+        assert np.isnan(references.correlate_maps(queries, library)[:, 3]).all()
+    with pytest.raises(ValueError, match="method must be one of"):
+        references.correlate_maps(queries, library, "kendall")
+    with pytest.raises(ValueError, match="reference maps have 30"):
+        references.correlate_maps(queries[:10], library)
+
+
+def test_load_library(maps, tmp_path, cache_dir):
+    _, library = maps
+    paths = []
+    for i, columns in enumerate(([0, 1, 2], [3, 4, 5, 6])):
+        paths.append(str(tmp_path / f"maps{i}.csv"))
+        pd.DataFrame(library[:, columns], columns=[f"map{c}" for c in columns]).to_csv(
+            paths[-1], index=False
+        )
+
+    matrix, names = references.load_library(paths)
+    assert names == [f"map{c}" for c in range(7)]
+    assert isinstance(matrix, np.memmap)
+    np.testing.assert_allclose(matrix, library.astype(np.float32))
+    # Built once in the cache
+    entries = sorted(os.listdir(os.path.join(cache_dir, "references")))
+    assert len(entries) == 2 and entries[1] == f"{entries[0]}.json"
+    assert references.load_library(paths)[0].filename.endswith(entries[0])
+    assert len(os.listdir(os.path.join(cache_dir, "references"))) == 2
+
+    # Explicit libraries are loaded as they are
+    path = str(tmp_path / "library.npy")
+    references.load_library(paths, path)
+    matrix, names = references.load_library(path)
+    np.testing.assert_allclose(matrix, library.astype(np.float32))
+    assert names == [f"map{c}" for c in range(7)]
+
+    pd.DataFrame(library[:10]).to_csv(paths[1], index=False)
+    with pytest.raises(ValueError, match="has 10 parcels, not 30"):
+        references.build_library(paths, path)
@@ -0,0 +1,85 @@
+"""Tests for the spin-test null models of wheres_waldo.spins."""
+import os
+
+import numpy as np
+import pytest
+
+from wheres_waldo import atlas
+from wheres_waldo.spins import (
+    _spin_chunk,
+    null_distribution,
+    random_rotations,
+    sphere_centroids,
+    spin_permutations,
+    spin_test,
+)
+from wheres_waldo.surface import surface_labels_url
+from wheres_waldo.tests.utils import update, write_surface_labels
+
+
+def test_random_rotations():
+    rotations = random_rotations(500, seed=3)
+    assert rotations.shape == (500, 3, 3)
+    # Proper rotations: orthogonal, with a determinant of 1
+    np.testing.assert_allclose(
+        rotations @ rotations.transpose(0, 2, 1),
+        np.broadcast_to(np.eye(3), (500, 3, 3)),
+        atol=1e-12,
+    )
+    np.testing.assert_allclose(np.linalg.det(rotations), 1)
+    np.testing.assert_array_equal(random_rotations(500, seed=3), rotations)
+    # Uniform rotations move a point to anywhere on the sphere: mean position near 0
+    assert np.abs((rotations @ [0, 0, 1]).mean(axis=0)).max() < 0.1
+
+
+def test_spin_permutations(surface_atlas):
+    spheres, _ = surface_atlas
+    centroids, hemispheres = sphere_centroids(spheres)
+    assert (hemispheres[:20] == "lh").all() and (hemispheres[50:70] == "rh").all()
+    assert (hemispheres[20:50] == "").all() and np.isnan(centroids[20:50]).all()
+    np.testing.assert_allclose(np.linalg.norm(centroids[:20], axis=1), 100, rtol=0.01)
+
+    # Without rotation, parcels stay in place
+    np.testing.assert_array_equal(
+        _spin_chunk(centroids, hemispheres, np.eye(3)[None]), [np.arange(100)]
+    )
+
+    perms = spin_permutations(spheres, n_perm=50, seed=1, n_jobs=2)
+    assert perms.shape == (50, 100)
+    # Parcels are spun within their hemisphere, and missing ones are left in place
+    assert np.isin(perms[:, :20], np.arange(20)).all()
+    assert np.isin(perms[:, 50:70], np.arange(50, 70)).all()
+    np.testing.assert_array_equal(perms[:, 20:50], np.tile(np.arange(20, 50), (50, 1)))
+    np.testing.assert_array_equal(perms[:, 70:], np.tile(np.arange(70, 100), (50, 1)))
+    assert len({tuple(perm) for perm in perms}) > 40
+    # Cached permutations are reused, other seeds differ
+    assert isinstance(spin_permutations(spheres, n_perm=50, seed=1), np.memmap)
+    assert not np.array_equal(spin_permutations(spheres, n_perm=50, seed=2), perms)
+
+
+def test_spin_test():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=10)
+    perms = np.array([rng.permutation(10) for _ in range(200)])
+    nulls = null_distribution(lambda maps: maps.sum(axis=1), x, perms, chunk_size=7)
+    np.testing.assert_allclose(nulls, x.sum())
+
+    r, p, nulls = spin_test(x, 2 * x + 1, perms)
+    assert r == pytest.approx(1)
+    np.testing.assert_allclose(nulls, [np.corrcoef(x[perm], x)[0, 1] for perm in perms])
+    assert p == (1 + np.sum(np.abs(nulls) >= abs(r))) / 201
+
+
+def test_spin_permutations_follow_updates(atlas_server, upstream, surface_atlas):
+    spheres, keys = surface_atlas
+    first = np.array(spin_permutations(spheres, n_perm=20))
+    assert not (first[:, 50:70] == np.arange(50, 70)).all()
+
+    # The right hemisphere now has a single parcel, which can only be spun onto itself
+    names = ["Unknown", "7Networks_RH_Vis_51"]
+    write_surface_labels(atlas_server, upstream, "rh", np.minimum(keys["rh"], 1), names)
+    update(surface_labels_url(hemi="rh"))
+    updated = spin_permutations(spheres, n_perm=20)
+    np.testing.assert_array_equal(updated[:, :50], first[:, :50])
+    np.testing.assert_array_equal(updated[:, 50:], np.tile(np.arange(50, 100), (20, 1)))
+    assert len(os.listdir(os.path.join(atlas.get_cache_dir(), "spins"))) == 1
@@ -0,0 +1,55 @@
+"""Tests for the surface parcellations of wheres_waldo.surface."""
+import numpy as np
+import pytest
+
+from wheres_waldo.surface import SurfaceParcellation, load_mesh, surface_labels_url
+
+
+def test_surface_labels_url(monkeypatch):
+    monkeypatch.setenv("WALDO_SURFACE_URL", "http://example.org/")
+    assert surface_labels_url(200, 17, "fsaverage5", "rh") == (
+        "http://example.org/FreeSurfer5.3/fsaverage5/label/"
+        "rh.Schaefer2018_200Parcels_17Networks_order.annot"
+    )
+    assert surface_labels_url(mesh="fslr32k") == (
+        "http://example.org/HCP/fslr32k/gifti/Schaefer2018_100Parcels_7Networks_order_lh.label.gii"
+    )
+    with pytest.raises(ValueError, match="mesh must be one of"):
+        surface_labels_url(mesh="fsnative")
+    with pytest.raises(ValueError, match="hemi must be one of"):
+        surface_labels_url(hemi="both")
+
+
+def test_surface_parcels(surface_atlas):
+    _, keys = surface_atlas
+    surface = SurfaceParcellation.load()
+    for hemi, first in (("lh", 1), ("rh", 51)):
+        # Keys of the label files are numbered per hemisphere
+        expected = np.where(keys[hemi] > 0, keys[hemi] + first - 1, 0)
+        np.testing.assert_array_equal(surface.labels[hemi], expected)
+
+    vertices = np.arange(len(keys["rh"]))
+    result = surface.parcels(vertices, "rh")
+    np.testing.assert_array_equal(result["label"], surface.labels["rh"])
+    np.testing.assert_array_equal(result["roi"], surface.labels["rh"] - 1)
+    medial = keys["rh"] == 0
+    assert medial.any()
+    assert (result["values"][medial] == "").all()
+    assert (result["values"][~medial] == [f"RH_Vis_{i}" for i in result["label"][~medial]]).all()
+
+
+def test_surface_nearest_vertices(surface_atlas):
+    spheres, _ = surface_atlas
+    surface = SurfaceParcellation.load()
+    coords = load_mesh(spheres["lh"])
+    vertices = np.array([0, 10, 200, 499])
+    result = surface.nearest_vertices(coords[vertices] * 1.01, "lh", spheres["lh"])
+    np.testing.assert_array_equal(result["vertex"], vertices)
+    np.testing.assert_allclose(result["distance"], 1, rtol=1e-6)
+    np.testing.assert_array_equal(result["label"], surface.labels["lh"][vertices])
+
+    # Coordinates can be given instead of a surface file, but must match the mesh
+    result = surface.nearest_vertices(coords[vertices], "lh", coords)
+    np.testing.assert_array_equal(result["vertex"], vertices)
+    with pytest.raises(ValueError, match="has 499 vertices"):
+        surface.nearest_vertices(coords[:1], "lh", coords[:-1])
@@ -0,0 +1,284 @@
+"""Helpers of the tests: a server with validators, access to its files, and atlas files."""
+import email.utils
+import functools
+import gzip
+import json
+import os
+import os.path as op
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import nibabel as nib
+import numpy as np
+from scipy.spatial import ConvexHull
+
+from wheres_waldo import atlas
+from wheres_waldo.surface import HEMISPHERES, surface_labels_url
+
+# Grid of the label volumes written by :func:`write_labels`
+SHAPE = (6, 7, 8)
+AFFINE = np.diag([2.0, 2.0, 2.0, 1.0])
+
+
+def validators(path):
+    """Return the ``ETag`` and ``Last-Modified`` headers sent by :class:`AtlasHandler`."""
+    stat = os.stat(path)
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return etag, email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serve files without logging requests."""
+
+    def log_message(self, *args):
+        pass
+
+
+class AtlasServer:
+    """
+    Serve a directory over HTTP from a background thread.
+
+    Use as a context manager, or call :meth:`start` and :meth:`stop`. While running, the
+    ``WALDO_ATLAS_URL`` environment variable points to the server.
+    """
+
+    def __init__(self, directory, handler=QuietHandler):
+        self.directory = directory
+        self.handler = handler
+        self.server = None
+        self._previous_url = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), functools.partial(self.handler, directory=self.directory)
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self._previous_url = os.environ.get("WALDO_ATLAS_URL")
+        os.environ["WALDO_ATLAS_URL"] = self.url
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._previous_url is None:
+            os.environ.pop("WALDO_ATLAS_URL", None)
+        else:
+            os.environ["WALDO_ATLAS_URL"] = self._previous_url
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class AtlasHandler(QuietHandler):
+    """
+    Serve files with ``ETag`` and ``Last-Modified`` validators, answering conditional
+    requests, and record every request in the ``requests`` list of the server.
+    """
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def _not_modified(self, path, etag):
+        if "If-None-Match" in self.headers:
+            return self.headers["If-None-Match"] == etag
+        since = self.headers.get("If-Modified-Since")
+        if since is None:
+            return False
+        return int(op.getmtime(path)) <= email.utils.parsedate_to_datetime(since).timestamp()
+
+    def _serve(self, body):
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        path = self.translate_path(self.path)
+        if not op.isfile(path):
+            self.send_error(404)
+            return
+        etag, last_modified = self._validators(path)
+        if self._not_modified(path, etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        with open(path, "rb") as f:
+            self._send(f.read(), etag, last_modified, body)
+
+    def _validators(self, path):
+        return validators(path)
+
+    def _send(self, data, etag, last_modified, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+
+class RangeHandler(AtlasHandler):
+    """
+    :class:`AtlasHandler` that also answers range requests.
+
+    Attributes of the server configure it (see the ``range_server`` fixture): ``weak_etag`` sends
+    weak ETags, ``ranges`` advertises range support, ``changed`` answers range requests
+    with the whole file as if it changed, and range requests fail with 503 once
+    ``fail_after`` of them succeeded, or while ``failures`` is positive.
+    """
+
+    def _validators(self, path):
+        etag, last_modified = validators(path)
+        return f"W/{etag}" if self.server.weak_etag else etag, last_modified
+
+    def end_headers(self):
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+    def _send(self, data, etag, last_modified, body):
+        ranges = self.server.ranges
+        requested = self.headers.get("Range") if ranges else None
+        if_range = self.headers.get("If-Range")
+        # Weak ETags never match If-Range (RFC 7233, section 3.2)
+        valid = (
+            if_range is None
+            or if_range == last_modified
+            or (if_range == etag and not etag.startswith("W/"))
+        )
+        if requested is None or not valid or self.server.changed:
+            super()._send(data, etag, last_modified, body)
+            return
+
+        with self.server.lock:
+            fail_after = self.server.fail_after
+            failed = fail_after is not None and self.server.served >= fail_after
+            if self.server.failures > 0:
+                self.server.failures -= 1
+                failed = True
+            if not failed:
+                self.server.served += 1
+        if failed:
+            self.send_error(503)
+            return
+
+        start, end = (int(value) for value in requested.split("=")[1].split("-"))
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        if body:
+            self.wfile.write(data[start : end + 1])
+
+
+def requests_to(server, command="GET"):
+    """Return the requests of a given method received by an :class:`AtlasServer`."""
+    return [request for request in server.server.requests if request[0] == command]
+
+
+def write_upstream(server, upstream, url, data):
+    """Write ``data`` as the file served at ``url``, and return its local path."""
+    path = op.join(upstream, url[len(server.url) + 1 :])
+    os.makedirs(op.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def cached_metadata(path):
+    """Return the metadata stored with the cached copy of an atlas file."""
+    with open(atlas._metadata_path(path)) as f:
+        return json.load(f)
+
+
+def age(path, seconds):
+    """Pretend that the cached copy was last checked ``seconds`` ago."""
+    metadata = cached_metadata(path)
+    metadata["checked"] = time.time() - seconds
+    atlas._write_metadata(path, metadata)
+
+
+def update(*urls):
+    """Make the cached copies of ``urls`` due for revalidation."""
+    for url in urls:
+        age(op.join(atlas.get_cache_dir(), op.basename(url)), 10**6)
+
+
+def write_labels(server, upstream, n_networks, labels):
+    """Serve ``labels`` on the :data:`SHAPE` grid as the label volume of a 100 parcel variant."""
+    data = nib.Nifti1Image(labels.astype(np.int32), AFFINE).to_bytes()
+    write_upstream(server, upstream, atlas.labels_url(100, n_networks), gzip.compress(data))
+
+
+def write_centroids(server, upstream, n_networks, first):
+    """Serve the centroid table of a 100 parcel variant, whose first network is ``first``."""
+    rows = ["ROI Label,ROI Name,R,A,S"] + [
+        f"{label},{n_networks}Networks_{hemi}_{first}_{label},0,0,0"
+        for label, hemi in zip(range(1, 101), ["LH"] * 50 + ["RH"] * 50)
+    ]
+    write_upstream(server, upstream, atlas.centroid_url(100, n_networks), "\n".join(rows).encode())
+
+
+def sphere_mesh(n_vertices, radius=100.0):
+    """Return the vertices and triangles of a sphere of evenly spread vertices."""
+    # Fibonacci lattice
+    index = np.arange(n_vertices) + 0.5
+    z = 1 - 2 * index / n_vertices
+    theta = np.pi * (1 + 5**0.5) * index
+    xy = np.sqrt(1 - z**2)
+    coords = radius * np.stack([xy * np.cos(theta), xy * np.sin(theta), z], axis=1)
+    return coords, ConvexHull(coords).simplices
+
+
+def write_surface_labels(server, upstream, hemi, keys, names):
+    """Serve a ``.annot`` file as the fsaverage labels of ``hemi`` of the 100 parcel variant."""
+    # Labels are identified by their color in .annot files
+    ctab = np.zeros((len(names), 4), dtype=np.int32)
+    ctab[:, 0] = np.arange(len(names))
+    path = op.join(upstream, f"{hemi}.annot")
+    nib.freesurfer.write_annot(path, keys, ctab, [name.encode() for name in names], True)
+    with open(path, "rb") as f:
+        write_upstream(server, upstream, surface_labels_url(hemi=hemi), f.read())
+
+
+def write_surface_atlas(server, upstream, directory, n_vertices=500, n_labeled=20):
+    """
+    Serve the fsaverage labels of a toy mesh, in which each hemisphere is a sphere.
+
+    The first ``n_labeled`` parcels of each hemisphere are Voronoi cells of the sphere,
+    around a polar cap of unlabeled vertices (the medial wall); the others are missing.
+
+    Returns
+    -------
+    spheres : dict
+        FreeSurfer geometry file of each hemisphere, written in ``directory``.
+    keys : dict
+        Key of each vertex in the label file of each hemisphere, 0 on the medial wall.
+    """
+    write_centroids(server, upstream, 7, "Vis")
+    coords, faces = sphere_mesh(n_vertices)
+    rng = np.random.default_rng(0)
+    spheres, keys = {}, {}
+    for hemi, first in zip(HEMISPHERES, (1, 51)):
+        seeds = coords[rng.choice(n_vertices, n_labeled, replace=False)]
+        nearest = np.argmin(((coords[:, None] - seeds) ** 2).sum(axis=2), axis=1)
+        keys[hemi] = np.where(coords[:, 2] > 90, 0, nearest + 1)
+        names = ["Unknown"] + [
+            f"7Networks_{hemi[0].upper()}H_Vis_{label}"
+            for label in range(first, first + n_labeled)
+        ]
+        write_surface_labels(server, upstream, hemi, keys[hemi], names)
+        spheres[hemi] = op.join(directory, f"{hemi}.sphere")
+        nib.freesurfer.write_geometry(spheres[hemi], coords, faces)
+    return spheres, keys
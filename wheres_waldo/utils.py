@@ -1,5 +1,9 @@
+import logging
+
 import numpy as np
 
+LGR = logging.getLogger(__name__)
+
 
 def get_MNI_152(freesurfer_coords):
     v = np.array(freesurfer_coords)
@@ -15,4 +19,4 @@ def get_MNI_152(freesurfer_coords):
 
 def location_details(x):
     # TODO: write function to get location details with NiMARE
-    print(x)
+    LGR.debug("Location details of ROI %s", x)
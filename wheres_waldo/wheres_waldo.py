@@ -1,10 +1,37 @@
 import argparse
+import importlib
+import logging
+import os.path as op
 import sys
 
+import numpy as np
 import pandas as pd
 
 from wheres_waldo import __version__
-from wheres_waldo.utils import get_MNI_152, location_details
+from wheres_waldo.atlas import centroid_url, fetch_file, load_labels, variant_name
+from wheres_waldo.enrichment import network_enrichment
+from wheres_waldo.geodesic import parcel_distances
+from wheres_waldo.homologs import homolog_table
+from wheres_waldo.logs import Progress, add_logging_arguments, setup_logging
+from wheres_waldo.masks import MASK_MODES, roi_masks
+from wheres_waldo.probabilistic import ProbabilisticAtlas
+from wheres_waldo.profiling import Profiler
+from wheres_waldo.registry import get_parcellation
+from wheres_waldo.surface import HEMISPHERES, MESHES
+from wheres_waldo.utils import location_details
+
+# Subcommands of the ``waldo`` command line, mapped to the module implementing them
+COMMANDS = {
+    "annotate-connectome": "wheres_waldo.connectome",
+    "clusters": "wheres_waldo.clusters",
+    "compare": "wheres_waldo.references",
+    "edges": "wheres_waldo.edgelist",
+    "fetch": "wheres_waldo.fetch",
+    "sample": "wheres_waldo.probabilistic",
+    "translate": "wheres_waldo.correspondence",
+}
+
+LGR = logging.getLogger(__name__)
 
 
 def _get_parser():
@@ -63,6 +90,116 @@ def _get_parser():
         dest="n_parcels",
         choices=[100, 200, 300, 400, 500, 600, 700, 800, 900, 1000],
     )
+    optional.add_argument(
+        "--masks",
+        help=(
+            "Also write NIfTI masks of the ROIs: one binary mask per ROI (roi), a single 4D "
+            "image with one volume per ROI (4d), or a single label image (label). Masks of "
+            "single ROIs are named after their ROI Label in the centroid table, i.e. the ROI "
+            "plus 1 (--rois 0 writes roi-1_mask)."
+        ),
+        required=False,
+        type=str,
+        default=None,
+        dest="masks",
+        choices=MASK_MODES,
+    )
+    optional.add_argument(
+        "--masks-dir",
+        help="Directory of the masks. Defaults to the directory of the output file.",
+        required=False,
+        type=str,
+        default=None,
+        dest="masks_dir",
+    )
+    optional.add_argument(
+        "--compresslevel",
+        help="gzip compression level of the masks, 0 writing uncompressed .nii files.",
+        required=False,
+        type=int,
+        default=6,
+        dest="compresslevel",
+        choices=range(10),
+    )
+    optional.add_argument(
+        "--geodesic",
+        help=(
+            "Surface files (left and right hemispheres) used to also write the geodesic "
+            "distances between the ROIs, to <output>_geodesic.csv."
+        ),
+        required=False,
+        type=str,
+        nargs=2,
+        default=None,
+        dest="geodesic",
+        metavar=("LH_SURFACE", "RH_SURFACE"),
+    )
+    optional.add_argument(
+        "--mesh",
+        help="Mesh of the --geodesic surfaces.",
+        required=False,
+        type=str,
+        default="fsaverage",
+        dest="mesh",
+        choices=MESHES,
+    )
+    optional.add_argument(
+        "--enrichment",
+        help=(
+            "Also test the over-representation of the ROIs in each network against the "
+            "given number of random ROI sets, writing <output>_enrichment.csv."
+        ),
+        required=False,
+        type=int,
+        default=None,
+        dest="enrichment",
+        metavar="N_PERM",
+    )
+    optional.add_argument(
+        "--homologs",
+        help=(
+            "Also report the homologous parcel of each ROI in the other hemisphere, and its "
+            "coordinates."
+        ),
+        action="store_true",
+        dest="homologs",
+    )
+    optional.add_argument(
+        "--probabilistic-atlas",
+        help=(
+            "4D probabilistic atlas in MNI152 space and text file of its region names, used "
+            "to also report the most probable regions at the MNI152 coordinates of the ROIs."
+        ),
+        required=False,
+        type=str,
+        nargs=2,
+        default=None,
+        dest="probabilistic_atlas",
+        metavar=("ATLAS", "LABELS"),
+    )
+    optional.add_argument(
+        "-j",
+        "--n-jobs",
+        help="Number of parallel jobs, writing masks or computing geodesic distances.",
+        required=False,
+        type=int,
+        default=1,
+        dest="n_jobs",
+    )
+    optional.add_argument(
+        "--profile",
+        help=(
+            "Report per-stage wall time, CPU time, allocated memory and row counts as JSON, "
+            "to the given file or to stderr if no file is given."
+        ),
+        required=False,
+        type=str,
+        nargs="?",
+        const="-",
+        default=None,
+        dest="profile",
+    )
+    add_logging_arguments(optional)
     optional.add_argument("-v", "--version", action="version", version=("%(prog)s " + __version__))
 
     parser._action_groups.append(optional)
@@ -70,67 +207,134 @@ def _get_parser():
     return parser
 
 
-def wheres_waldo(rois, output, n_networks=7, n_parcels=100):
-    # TODO: write main function
-
-    # Download the Schaefer2018_100Parcels_7Networks_order_FSLMNI152_1mm.Centroid_RAS.csv file
-    # from gh_url and save it to the current directory.
-    gh_url = (
-        "https://raw.githubusercontent.com/ThomasYeoLab/CBIG/master/stable_projects/"
-        "brain_parcellation/Schaefer2018_LocalGlobal/Parcellations/MNI/"
-        "Centroid_coordinates"
-    )
-
-    print(
-        f"Downloading Schaefer 2018 parcellation with {n_parcels} parcels and {n_networks}"
-        f"networks..."
-    )
-    csv_file = (
-        f"{gh_url}/Schaefer2018_{n_parcels}Parcels_{n_networks}Networks_order_FSLMNI152_1mm"
-        f".Centroid_RAS.csv"
-    )
-    schaefer_info = pd.read_csv(csv_file, error_bad_lines=False)
-
-    # Initialize empty directory to store the results
-    dict_keys = ["values", "roi_label", "FS_coords", "MNI_152_coords", "location_detail"]
-    output_dict = {key: [] for key in dict_keys}
-
-    # Loop through each ROI and get details
-    for roi in rois:
-        print(f"Gettin details for {roi} ROI...")
-
-        # Name of the ROI
-        output_dict["values"].append(
-            schaefer_info["ROI Name"][roi].rsplit(f"{n_networks}Networks_", 1)[1]
+def wheres_waldo(
+    rois,
+    output,
+    n_networks=7,
+    n_parcels=100,
+    masks=None,
+    masks_dir=None,
+    compresslevel=6,
+    geodesic=None,
+    mesh="fsaverage",
+    enrichment=None,
+    homologs=False,
+    probabilistic_atlas=None,
+    n_jobs=1,
+    profile=None,
+):
+    # The report is written even if a stage fails, with the spans measured so far
+    with Profiler(profile) as profiler:
+        # Download the Schaefer2018_100Parcels_7Networks_order_FSLMNI152_1mm.Centroid_RAS.csv file
+        # into the atlas cache.
+        LGR.info(
+            "Downloading Schaefer 2018 parcellation with %d parcels and %d networks...",
+            n_parcels,
+            n_networks,
         )
+        with profiler.span("atlas_fetch"):
+            fetch_file(centroid_url(n_parcels, n_networks))
+        with profiler.span("atlas_parse") as span:
+            parcellation = get_parcellation(n_parcels, n_networks)
+            span.rows = len(parcellation)
 
-        # ROI label
-        output_dict["roi_label"].append(schaefer_info["ROI Name"][roi])
-
-        # FS coordinates
-        fs_coordinates = [
-            schaefer_info["R"][roi],
-            schaefer_info["A"][roi],
-            schaefer_info["S"][roi],
-            1,
-        ]
-        output_dict["FS_coords"].append(fs_coordinates)
+        # Get the details of all ROIs at once
+        with profiler.span("roi_resolution", rows=len(rois)):
+            details = parcellation.roi_details(rois)
 
         # MNI 152 coordinates
-        output_dict["MNI_152_coords"].append(get_MNI_152(fs_coordinates))
+        with profiler.span("coordinate_transform", rows=len(rois)):
+            mni_coords = parcellation.to_mni(details["FS_coords"])
 
         # Location detail
-        output_dict["location_detail"].append(location_details(roi))
+        location_detail = []
+        with profiler.span("location_detail", rows=len(rois)), Progress(
+            len(rois), "Getting location details", LGR
+        ) as progress:
+            for roi in rois:
+                location_detail.append(location_details(roi))
+                progress.update()
+            if probabilistic_atlas is not None:
+                # Sample the atlas at all ROIs at once
+                regions = ProbabilisticAtlas.load(*probabilistic_atlas).sample(mni_coords)
+
+        # Save the results to a csv file
+        LGR.info("Saving results to %s...", output)
+        with profiler.span("write", rows=len(rois)):
+            fs_coords = details["FS_coords"]
+            if np.array_equal(fs_coords, np.round(fs_coords)):
+                fs_coords = fs_coords.astype(int)
+            output_df = pd.DataFrame(
+                {
+                    "values": details["values"],
+                    "roi_label": details["roi_label"],
+                    "FS_coords": fs_coords.tolist(),
+                    "MNI_152_coords": list(mni_coords),
+                    "location_detail": location_detail,
+                }
+            )
+            if probabilistic_atlas is not None:
+                output_df["location_labels"] = regions["label"].tolist()
+                output_df["location_probabilities"] = regions["probability"].round(4).tolist()
+            if homologs:
+                # Gather the homologs of all ROIs at once from the table of the variant
+                homolog_rois = homolog_table(n_parcels, n_networks)["homolog"][rois]
+                homolog_details = parcellation.roi_details(homolog_rois)
+                output_df["homolog_roi"] = homolog_rois
+                output_df["homolog_values"] = homolog_details["values"]
+                homolog_coords = homolog_details["FS_coords"]
+                output_df["homolog_FS_coords"] = homolog_coords.astype(fs_coords.dtype).tolist()
+                output_df["homolog_MNI_152_coords"] = list(parcellation.to_mni(homolog_coords))
+            output_df.to_csv(output, index=False)
 
-    # Save the results to a csv file
-    print(f"Saving results to {output}...")
-    output_df = pd.DataFrame(output_dict)
-    output_df.to_csv(output, index=False)
+        if masks is not None:
+            if masks_dir is None:
+                masks_dir = op.dirname(op.abspath(output))
+            LGR.info("Saving %s masks to %s...", masks, masks_dir)
+            with profiler.span("masks", rows=len(rois)):
+                roi_masks(
+                    load_labels(n_parcels, n_networks),
+                    details["label"],
+                    masks_dir,
+                    prefix=f"{variant_name(n_parcels, n_networks)}_",
+                    mode=masks,
+                    compresslevel=compresslevel,
+                    n_jobs=n_jobs,
+                )
+
+        if geodesic is not None:
+            distances_file = f"{op.splitext(output)[0]}_geodesic.csv"
+            LGR.info("Saving geodesic distances to %s...", distances_file)
+            with profiler.span("geodesic", rows=len(rois)):
+                distances = parcel_distances(
+                    rois,
+                    dict(zip(HEMISPHERES, geodesic)),
+                    n_parcels,
+                    n_networks,
+                    mesh,
+                    n_jobs=n_jobs,
+                )
+                pd.DataFrame(distances, index=details["values"], columns=details["values"]).to_csv(
+                    distances_file
+                )
+
+        if enrichment is not None:
+            enrichment_file = f"{op.splitext(output)[0]}_enrichment.csv"
+            LGR.info("Saving network enrichment to %s...", enrichment_file)
+            with profiler.span("enrichment", rows=enrichment):
+                network_enrichment(rois, parcellation, n_perm=enrichment).to_csv(
+                    enrichment_file, index=False
+                )
 
 
 def _main(argv=None):
-    options = _get_parser().parse_args(argv)
-    wheres_waldo(**vars(options))
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in COMMANDS:
+        return importlib.import_module(COMMANDS[argv[0]])._main(argv[1:])
+
+    options = vars(_get_parser().parse_args(argv))
+    setup_logging(quiet=options.pop("quiet"), log_json=options.pop("log_json"))
+    wheres_waldo(**options)
 
 
 if __name__ == "__main__":